@@ -0,0 +1,112 @@
+"""
+Microbenchmark of the CPU a matching request spends on the elasticsearch response, from the raw response bytes
+to the rendered api response:
+
+- baseline: full hits envelope decoded with json, every hit validated into a MatchingJob, validated and serialized
+  by FastAPI against the response_model of the route, rendered with json
+- response_model: only hits.hits._id and hits.hits._score (filter_path) decoded with orjson, the MatchingJobs
+  validated by the repository in one call, validated and serialized again against the response_model, rendered
+  with orjson
+- lean: like response_model, but the route renders the matches itself with `dump_json` and returns the response,
+  which FastAPI doesn't validate, see `api.lib.rendering.json_response`
+
+The response_model steps are the ones FastAPI's `serialize_response` runs with the route's own response field.
+
+Runs without elasticsearch: python -m api.benchmarks.hit_decoding [--hits 100] [--repeat 2000] [--runs 7]
+"""
+
+import argparse
+import json
+import random
+import timeit
+from typing import List
+
+import orjson
+from fastapi import Response
+from fastapi.responses import JSONResponse, ORJSONResponse
+
+from api.lib.rendering import json_response
+from api.models.job_models import MATCHING_JOBS, MatchingJob
+from api.repositories.candidate_repository import CandidateRepository
+from api.routes.candidates import router
+
+# Response field FastAPI validates and serializes the results of GET /candidates/{id}/jobs with
+response_field = next(route for route in router.routes if route.path == "/candidates/{id}/jobs").response_field
+
+
+def build_response(n_hits: int) -> dict:
+    """Builds a search response like elasticsearch returns it for a matching query without _source."""
+    hits = [
+        {"_index": "jobs", "_id": str(id), "_score": random.uniform(0, 10), "_ignored": ["description.keyword"]}
+        for id in random.sample(range(1, 100_000), n_hits)
+    ]
+    return {
+        "took": 3,
+        "timed_out": False,
+        "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
+        "hits": {"total": {"value": 10_000, "relation": "gte"}, "max_score": hits[0]["_score"], "hits": hits},
+    }
+
+
+def filter_response(response: dict) -> dict:
+    """Applies the MATCH_HITS_FILTER_PATH the way elasticsearch does."""
+    return {"hits": {"hits": [{"_id": hit["_id"], "_score": hit["_score"]} for hit in response["hits"]["hits"]]}}
+
+
+def serialize_response(jobs: List[MatchingJob]):
+    """What FastAPI's serialize_response does for a route result that isn't a Response."""
+    value, errors = response_field.validate(jobs, {}, loc=("response",))
+    assert not errors
+    return response_field.serialize(value)
+
+
+def baseline(raw_response: bytes) -> bytes:
+    hits = json.loads(raw_response).get("hits", {}).get("hits", [])
+    jobs = [MatchingJob.model_validate({"id": hit.get("_id"), "relevance_score": hit.get("_score")}) for hit in hits]
+    return JSONResponse(serialize_response(jobs)).body
+
+
+def with_response_model(raw_response: bytes, repository: CandidateRepository) -> bytes:
+    jobs = repository._extract_jobs_from_es_response(orjson.loads(raw_response))
+    return ORJSONResponse(serialize_response(jobs)).body
+
+
+def lean(raw_response: bytes, repository: CandidateRepository) -> bytes:
+    jobs = repository._extract_jobs_from_es_response(orjson.loads(raw_response))
+    return json_response(MATCHING_JOBS.dump_json(jobs), Response()).body
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--hits", type=int, default=100, help="hits per response, the maximum limit of the api")
+    parser.add_argument("--repeat", type=int, default=2000, help="requests per measurement")
+    parser.add_argument("--runs", type=int, default=7, help="measurements per variant, the fastest one counts")
+    args = parser.parse_args()
+
+    response = build_response(args.hits)
+    full_response = json.dumps(response).encode()
+    filtered_response = json.dumps(filter_response(response)).encode()
+    repository = CandidateRepository(None, None, None, None)
+    expected = orjson.loads(baseline(full_response))
+    assert expected == orjson.loads(with_response_model(filtered_response, repository))
+    assert expected == orjson.loads(lean(filtered_response, repository))
+
+    variants = {
+        "baseline": lambda: baseline(full_response),
+        "response_model": lambda: with_response_model(filtered_response, repository),
+        "lean": lambda: lean(filtered_response, repository),
+    }
+    results = {
+        name: min(timeit.repeat(variant, number=args.repeat, repeat=args.runs)) for name, variant in variants.items()
+    }
+    print(f"{args.hits} hits, response {len(full_response)} -> {len(filtered_response)} bytes")
+    for name, seconds in results.items():
+        saved = results["baseline"] - seconds
+        print(
+            f"{name:>14}: {seconds / args.repeat * 1e6:8.1f} µs per request, "
+            f"{saved / args.repeat * 1e6:6.1f} µs ({saved / results['baseline']:.0%}) less than baseline"
+        )
+
+
+if __name__ == "__main__":
+    main()
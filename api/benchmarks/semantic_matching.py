@@ -0,0 +1,141 @@
+"""
+Recall and latency of the semantic matching mode compared to the bool query mode, for jobs matched to a random
+sample of candidates:
+
+- query: the bool query of mode=query (salary OR seniority OR shared top skills)
+- semantic: mode=semantic, kNN over the skill vectors restricted to the salary and seniority filters, reranked
+- exact: brute force similarity over all jobs passing the same filters, the ground truth of the kNN search
+- knn nc=<n>: the kNN search alone with n num_candidates, its recall@k is measured against exact
+
+overlap@k is the share of the top k of the query mode that the semantic mode returns as well. It is low by design,
+the semantic mode ranks by similar skills while the query mode mostly ranks by exactly shared ones.
+
+Needs a seeded elasticsearch (ES_URL), skill vectors included:
+python -m api.benchmarks.semantic_matching [--samples 200] [--k 10] [--num-candidates 50 100 200 400]
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from typing import Awaitable, Callable
+
+from api.lib.elasticsearch import ElasticsearchClient
+from api.lib.elasticsearch.connection import close_elasticsearch, open_elasticsearch
+from api.lib.semantic import SEMANTIC_RERANK_WINDOW, SKILL_VECTOR_FIELD
+from api.models.candidate_models import CandidateDocument
+from api.models.matching_models import MatchingFilters, MatchingMode
+from api.repositories.candidate_repository import CandidateRepository
+
+
+async def timed(call: Callable[[], Awaitable]) -> tuple[float, object]:
+    start = time.perf_counter()
+    result = await call()
+    return time.perf_counter() - start, result
+
+
+async def sample_candidates(
+    candidates: ElasticsearchClient, samples: int, seed: int
+) -> list[tuple[int, CandidateDocument]]:
+    """Returns random candidates that have a skill vector, with their ids."""
+    response = await candidates.search(
+        query={
+            "query": {
+                "function_score": {
+                    "query": {"exists": {"field": SKILL_VECTOR_FIELD}},
+                    "random_score": {"seed": seed, "field": "id"},
+                }
+            },
+            "size": samples,
+        },
+        return_source=True,
+    )
+    return [(int(hit["_id"]), CandidateDocument.model_validate(hit["_source"])) for hit in response["hits"]["hits"]]
+
+
+async def exact_nearest_jobs(jobs: ElasticsearchClient, vector: list[float], filters: list[dict], k: int) -> list[int]:
+    """Scores every job passing the filters, the exact top k the kNN search approximates."""
+    response = await jobs.search(
+        query={
+            "query": {
+                "script_score": {
+                    "query": {"bool": {"filter": [{"exists": {"field": SKILL_VECTOR_FIELD}}, *filters]}},
+                    "script": {
+                        "source": f"dotProduct(params.vector, '{SKILL_VECTOR_FIELD}')",
+                        "params": {"vector": vector},
+                    },
+                }
+            },
+            "size": k,
+        }
+    )
+    return [int(hit["_id"]) for hit in response["hits"]["hits"]]
+
+
+def summarize(name: str, seconds: list[float], recall: list[float] | None = None, overlap: list[float] | None = None):
+    quantiles = statistics.quantiles(seconds, n=20) if len(seconds) > 1 else seconds * 19
+    columns = [f"{name:<16}", f"{statistics.median(seconds) * 1000:8.2f}", f"{quantiles[18] * 1000:8.2f}"]
+    columns.append(f"{statistics.mean(recall):9.3f}" if recall else " " * 9)
+    columns.append(f"{statistics.mean(overlap):10.3f}" if overlap else "")
+    print("  ".join(columns))
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--samples", type=int, default=200, help="number of candidates to match")
+    parser.add_argument("--k", type=int, default=10, help="number of matches per candidate")
+    parser.add_argument("--num-candidates", type=int, nargs="+", default=[50, 100, 200, 400])
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    open_elasticsearch()
+    candidates, jobs = ElasticsearchClient("candidates"), ElasticsearchClient("jobs")
+    repository = CandidateRepository(candidates, jobs, None, None)
+    latencies: dict[str, list[float]] = {}
+    recalls: dict[str, list[float]] = {}
+    overlaps: list[float] = []
+    try:
+        for candidate_id, candidate in await sample_candidates(candidates, args.samples, args.seed):
+            filters = repository._extract_filters_from_candidate(candidate, MatchingFilters())
+            matches = {}
+            for mode in (MatchingMode.QUERY, MatchingMode.SEMANTIC):
+                seconds, matches[mode] = await timed(
+                    lambda: repository.get_matching_jobs_for_candidate(candidate_id, args.k, mode)
+                )
+                latencies.setdefault(mode.value, []).append(seconds)
+            shared = {match.id for match in matches[MatchingMode.QUERY]} & {
+                match.id for match in matches[MatchingMode.SEMANTIC]
+            }
+            overlaps.append(len(shared) / args.k)
+
+            seconds, exact = await timed(lambda: exact_nearest_jobs(jobs, candidate.skill_vector, filters, args.k))
+            latencies.setdefault("exact", []).append(seconds)
+            for num_candidates in args.num_candidates:
+                name = f"knn nc={num_candidates}"
+                seconds, response = await timed(
+                    lambda: jobs.knn_search(
+                        field=SKILL_VECTOR_FIELD,
+                        query_vector=candidate.skill_vector,
+                        k=args.k,
+                        num_candidates=max(args.k, num_candidates),
+                        filter=filters,
+                    )
+                )
+                latencies.setdefault(name, []).append(seconds)
+                found = {int(hit["_id"]) for hit in response.get("hits", {}).get("hits", [])}
+                recalls.setdefault(name, []).append(len(found & set(exact)) / len(exact) if exact else 1.0)
+    finally:
+        await close_elasticsearch()
+
+    print(f"{len(overlaps)} candidates, k={args.k}, rerank window {max(args.k, SEMANTIC_RERANK_WINDOW)}")
+    print(f"{'':<16}  {'p50 ms':>8}  {'p95 ms':>8}  {'recall@k':>9}  {'overlap@k':>10}")
+    summarize("query", latencies["query"])
+    summarize("semantic", latencies["semantic"], overlap=overlaps)
+    summarize("exact", latencies["exact"])
+    for num_candidates in args.num_candidates:
+        name = f"knn nc={num_candidates}"
+        summarize(name, latencies[name], recall=recalls[name])
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,94 @@
+"""
+Startup benchmark: starts the api with uvicorn as a new process, like `fastapi run` does, and measures the time from
+the process start until every given path answered with a 200 for the first time, and the latency of that first
+response. The first request after startup used to pay for opening connections and loading indices and snapshots.
+
+Needs whatever the configured backend needs, e.g. elasticsearch at ES_URL with the seeded indices, or
+SEARCH_BACKEND=in_memory IN_MEMORY_DATA_SOURCE=files to run without it:
+
+python -m api.benchmarks.startup [--runs 5] [--path /health/ready --path /jobs/1]
+"""
+
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def measure(paths: list[str], timeout: float) -> tuple[dict[str, float], dict[str, float]]:
+    """
+    Starts one api process and polls every path until it answers with a 200.
+
+    Returns:
+        tuple[dict[str, float], dict[str, float]]: seconds from the process start to the first 200 of every path,
+            and the latency of that response
+    """
+    port = free_port()
+    started_at = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api.main:app", "--port", str(port), "--log-level", "warning"],
+        env=os.environ.copy(),
+    )
+    ready: dict[str, float] = {}
+    latencies: dict[str, float] = {}
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}") as client:
+            while len(ready) < len(paths):
+                if time.perf_counter() - started_at > timeout:
+                    raise TimeoutError(f"{set(paths) - set(ready)} didn't answer with a 200 within {timeout}s.")
+                if process.poll() is not None:
+                    raise RuntimeError(f"api exited with {process.returncode}.")
+                for path in paths:
+                    if path in ready:
+                        continue
+                    request_start = time.perf_counter()
+                    try:
+                        status = client.get(path).status_code
+                    except httpx.TransportError:
+                        break
+                    if status == 200:
+                        ready[path] = time.perf_counter() - started_at
+                        latencies[path] = time.perf_counter() - request_start
+                time.sleep(0.01)
+    finally:
+        process.terminate()
+        process.wait()
+    return ready, latencies
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="number of process starts")
+    parser.add_argument("--path", dest="paths", action="append", help="path polled until it answers with a 200")
+    parser.add_argument("--timeout", type=float, default=120, help="seconds a run may take")
+    args = parser.parse_args()
+    paths = args.paths or ["/health/ready", "/jobs/1", "/candidates/1/jobs"]
+
+    results: dict[str, list[float]] = {path: [] for path in paths}
+    latencies: dict[str, list[float]] = {path: [] for path in paths}
+    for _ in range(args.runs):
+        ready, latency = measure(paths, args.timeout)
+        for path in paths:
+            results[path].append(ready[path])
+            latencies[path].append(latency[path])
+
+    print(f"{'path':<24}  {'first 200 (s)':>14}  {'first latency (ms)':>19}")
+    for path in paths:
+        print(
+            f"{path:<24}  {statistics.median(results[path]):14.3f}  {statistics.median(latencies[path]) * 1000:19.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
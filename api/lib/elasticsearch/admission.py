@@ -0,0 +1,257 @@
+import asyncio
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Any, AsyncIterator, Callable
+
+from dotenv import load_dotenv
+from fastapi import Depends
+
+from api.lib.elasticsearch.connection import ES_CONNECTIONS_PER_NODE
+from api.lib.elasticsearch.exceptions import SearchOverloadedError
+
+
+class AdmissionLane(str, Enum):
+    """Route classes with their own budget, in order of priority: a free slot goes to the first lane waiting for one"""
+
+    INTERACTIVE = "interactive"
+    MATCH = "match"
+    BATCH = "batch"
+    EXPORT = "export"
+
+
+@dataclass(frozen=True)
+class LaneBudget:
+    """
+    Args:
+        concurrency (int): requests of the lane elasticsearch works on at the same time
+        queue_size (int): requests of the lane waiting for a slot, further ones are rejected right away
+        max_wait (float): seconds a request waits for a slot before it is rejected
+    """
+
+    concurrency: int
+    queue_size: int
+    max_wait: float
+
+
+load_dotenv(override=True)
+# Elasticsearch requests of this worker in flight at the same time, as many as the pool has connections by default.
+# 0 disables admission control.
+ADMISSION_MAX_CONCURRENCY = int(os.getenv("ADMISSION_MAX_CONCURRENCY", str(ES_CONNECTIONS_PER_NODE)))
+# Budget of every lane, overridable with e.g. ADMISSION_EXPORT_CONCURRENCY, ADMISSION_EXPORT_QUEUE_SIZE and
+# ADMISSION_EXPORT_MAX_WAIT_SECONDS. Lookups may use every slot, the heavier lanes only part of them.
+DEFAULT_LANE_BUDGETS = {
+    AdmissionLane.INTERACTIVE: LaneBudget(concurrency=ADMISSION_MAX_CONCURRENCY, queue_size=200, max_wait=0.5),
+    AdmissionLane.MATCH: LaneBudget(
+        concurrency=max(1, ADMISSION_MAX_CONCURRENCY * 6 // 10), queue_size=100, max_wait=2
+    ),
+    AdmissionLane.BATCH: LaneBudget(concurrency=max(1, ADMISSION_MAX_CONCURRENCY * 3 // 10), queue_size=20, max_wait=5),
+    AdmissionLane.EXPORT: LaneBudget(
+        concurrency=max(1, ADMISSION_MAX_CONCURRENCY * 2 // 10), queue_size=10, max_wait=10
+    ),
+}
+# Upper bounds of the buckets of the admission wait histogram
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Lane of the elasticsearch requests of the current request, set by the `admission_lane` dependency of its route.
+# Requests outside of a route, e.g. the warm-up on startup, count as matching.
+_lane: ContextVar[AdmissionLane] = ContextVar("admission_lane", default=AdmissionLane.MATCH)
+
+
+@dataclass
+class LaneStats:
+    admitted: int = 0
+    queued: int = 0
+    rejected: int = 0
+    timed_out: int = 0
+    wait_seconds: float = 0.0
+    # Waits per bucket of WAIT_BUCKETS, the last one counts longer waits
+    wait_buckets: list[int] = field(default_factory=lambda: [0] * (len(WAIT_BUCKETS) + 1))
+
+    def record_wait(self, seconds: float) -> None:
+        self.wait_seconds += seconds
+        self.wait_buckets[next((i for i, bound in enumerate(WAIT_BUCKETS) if seconds <= bound), -1)] += 1
+
+
+class _Lane:
+    def __init__(self, budget: LaneBudget) -> None:
+        self.budget = budget
+        self.active = 0
+        self.waiters: deque[asyncio.Future] = deque()
+        self.stats = LaneStats()
+
+
+class AdmissionController:
+    """
+    Bounds the elasticsearch requests a worker has in flight, so a burst of heavy requests can't take every
+    connection of the pool. Every lane gets at most `concurrency` of the `max_concurrency` slots. Requests beyond
+    that wait in the bounded queue of their lane; whenever a slot frees up it goes to the oldest request of the
+    first lane in `AdmissionLane` order that is waiting and under its budget, so lookups overtake batches and exports.
+    A request that didn't get a slot within the `max_wait` of its lane, or found its queue full, is rejected with a
+    `SearchOverloadedError`, answered with a 429.
+
+    Args:
+        max_concurrency (int): slots shared by all lanes, 0 admits every request right away
+        budgets (dict[AdmissionLane, LaneBudget]): budget of every lane
+        clock (Callable[[], float]): monotonic time in seconds
+    """
+
+    def __init__(
+        self,
+        *,
+        max_concurrency: int,
+        budgets: dict[AdmissionLane, LaneBudget],
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.max_concurrency = max_concurrency
+        self.active = 0
+        self.__lanes = {lane: _Lane(budgets[lane]) for lane in AdmissionLane}
+        self.__clock = clock
+
+    def stats(self, lane: AdmissionLane) -> LaneStats:
+        return self.__lanes[lane].stats
+
+    def queue_depth(self, lane: AdmissionLane) -> int:
+        return len(self.__lanes[lane].waiters)
+
+    def in_flight(self, lane: AdmissionLane) -> int:
+        return self.__lanes[lane].active
+
+    @asynccontextmanager
+    async def admit(self, lane: AdmissionLane | None = None) -> AsyncIterator[None]:
+        """
+        Holds a slot of the lane, by default the lane of the current request, while the block runs.
+
+        Raises:
+            SearchOverloadedError: If the queue of the lane is full or no slot became free within its max wait.
+        """
+        if self.max_concurrency <= 0:
+            yield
+            return
+        state = self.__lanes[lane or _lane.get()]
+        await self.__acquire(state)
+        try:
+            yield
+        finally:
+            self.__release(state)
+
+    def try_admit(self, lane: AdmissionLane | None = None) -> Callable[[], None] | None:
+        """
+        Takes a slot of the lane, by default the lane of the current request, if one is free right now and no request
+        waits for it. For optional requests like hedges, which are dropped rather than queued.
+
+        Returns:
+            Callable[[], None] | None: releases the slot, None if no slot was free
+        """
+        if self.max_concurrency <= 0:
+            return lambda: None
+        state = self.__lanes[lane or _lane.get()]
+        if not self.__has_slot(state) or self.__waiting_before(state):
+            return None
+        self.__grant(state)
+        return lambda: self.__release(state)
+
+    async def __acquire(self, state: _Lane) -> None:
+        if self.__has_slot(state) and not self.__waiting_before(state):
+            self.__grant(state)
+            state.stats.record_wait(0.0)
+            return
+        budget = state.budget
+        if len(state.waiters) >= budget.queue_size:
+            state.stats.rejected += 1
+            raise SearchOverloadedError(
+                f"Too many requests are waiting for elasticsearch, {len(state.waiters)} in this lane",
+                retry_after=budget.max_wait,
+            )
+
+        start = self.__clock()
+        waiter = asyncio.get_running_loop().create_future()
+        state.waiters.append(waiter)
+        state.stats.queued += 1
+        try:
+            # Waiting on a set doesn't cancel the waiter on timeout, a slot granted meanwhile isn't lost
+            await asyncio.wait({waiter}, timeout=budget.max_wait)
+        except asyncio.CancelledError:
+            self.__abandon(state, waiter)
+            raise
+        state.stats.record_wait(self.__clock() - start)
+        if not waiter.done():
+            self.__abandon(state, waiter)
+            state.stats.timed_out += 1
+            raise SearchOverloadedError(
+                f"No elasticsearch slot became free within {budget.max_wait}s", retry_after=budget.max_wait
+            )
+
+    def __release(self, state: _Lane) -> None:
+        state.active -= 1
+        self.active -= 1
+        self.__dispatch()
+
+    def __abandon(self, state: _Lane, waiter: asyncio.Future) -> None:
+        """Gives up waiting, a slot that was granted in the meantime is handed on."""
+        if waiter.done():
+            self.__release(state)
+        else:
+            waiter.cancel()
+            state.waiters.remove(waiter)
+
+    def __has_slot(self, state: _Lane) -> bool:
+        return self.active < self.max_concurrency and state.active < state.budget.concurrency
+
+    def __waiting_before(self, state: _Lane) -> bool:
+        """Whether a request of this lane or a lane of higher priority waits for a slot it may get."""
+        for lane in self.__lanes.values():
+            if lane.waiters and lane.active < lane.budget.concurrency:
+                return True
+            if lane is state:
+                return False
+        return False
+
+    def __grant(self, state: _Lane) -> None:
+        state.active += 1
+        self.active += 1
+        state.stats.admitted += 1
+
+    def __dispatch(self) -> None:
+        """Hands free slots to the waiting requests, lanes in order of priority."""
+        for state in self.__lanes.values():
+            while state.waiters and self.__has_slot(state):
+                self.__grant(state)
+                state.waiters.popleft().set_result(None)
+            if self.active >= self.max_concurrency:
+                return
+
+
+def admission_lane(lane: AdmissionLane) -> Any:
+    """Route dependency putting the elasticsearch requests of the route into the given lane."""
+
+    async def set_lane() -> None:
+        _lane.set(lane)
+
+    return Depends(set_lane)
+
+
+_admission_controller: AdmissionController | None = None
+
+
+def get_admission_controller() -> AdmissionController:
+    """
+    Returns the admission controller of this worker, with ADMISSION_MAX_CONCURRENCY slots and the budgets of
+    DEFAULT_LANE_BUDGETS, overridden by ADMISSION_<LANE>_CONCURRENCY, _QUEUE_SIZE and _MAX_WAIT_SECONDS.
+    """
+    global _admission_controller
+    if _admission_controller is None:
+        budgets = {}
+        for lane, default in DEFAULT_LANE_BUDGETS.items():
+            prefix = f"ADMISSION_{lane.name}"
+            budgets[lane] = LaneBudget(
+                concurrency=int(os.getenv(f"{prefix}_CONCURRENCY", default.concurrency)),
+                queue_size=int(os.getenv(f"{prefix}_QUEUE_SIZE", default.queue_size)),
+                max_wait=float(os.getenv(f"{prefix}_MAX_WAIT_SECONDS", default.max_wait)),
+            )
+        _admission_controller = AdmissionController(max_concurrency=ADMISSION_MAX_CONCURRENCY, budgets=budgets)
+    return _admission_controller
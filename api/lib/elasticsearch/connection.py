@@ -0,0 +1,85 @@
+import os
+from typing import Optional
+
+from dotenv import load_dotenv
+from elasticsearch import AsyncElasticsearch
+from elasticsearch.serializer import OrjsonSerializer
+
+
+def _env_flag(name: str, default: bool) -> bool:
+    return os.getenv(name, str(default)).strip().lower() in ("1", "true", "yes", "on")
+
+
+load_dotenv(override=True)
+ES_URL = os.getenv("ES_URL")
+# Connections kept per elasticsearch node and uvicorn worker, every worker process has its own pool
+ES_CONNECTIONS_PER_NODE = int(os.getenv("ES_CONNECTIONS_PER_NODE", "10"))
+# The keep alive of idle connections isn't configurable: neither the aiohttp nor the httpx node of elastic_transport
+# has an option for it, so pooled connections are closed after aiohttp's default of 15 idle seconds
+ES_REQUEST_TIMEOUT = float(os.getenv("ES_REQUEST_TIMEOUT", "10"))
+# Retries of a failed request, the requests of the repositories are retried with backoff by
+# `api.lib.elasticsearch.resilience`, the transport only retries the others, e.g. the scroll of the snapshots
+ES_MAX_RETRIES = int(os.getenv("ES_MAX_RETRIES", "3"))
+ES_RETRY_ON_TIMEOUT = _env_flag("ES_RETRY_ON_TIMEOUT", True)
+ES_RETRY_ON_STATUS = [int(status) for status in os.getenv("ES_RETRY_ON_STATUS", "429,502,503,504").split(",")]
+ES_HTTP_COMPRESS = _env_flag("ES_HTTP_COMPRESS", True)
+# Discovers the other nodes of the cluster on start, on node failures and every ES_SNIFF_INTERVAL seconds
+ES_SNIFF = _env_flag("ES_SNIFF", False)
+ES_SNIFF_INTERVAL = float(os.getenv("ES_SNIFF_INTERVAL", "60"))
+
+_elasticsearch: Optional[AsyncElasticsearch] = None
+
+
+def create_elasticsearch() -> AsyncElasticsearch:
+    """
+    Builds a client for ES_URL with the pool, timeout, retry, compression and sniffing settings of the environment.
+    Responses are decoded with orjson. No connection is opened until the first request.
+    """
+    # Passing any of the sniffing options enables sniffing, so they are only set when it is wanted
+    sniffing_options = {}
+    if ES_SNIFF:
+        sniffing_options = {
+            "sniff_on_start": True,
+            "sniff_on_node_failure": True,
+            "min_delay_between_sniffing": ES_SNIFF_INTERVAL,
+        }
+
+    return AsyncElasticsearch(
+        ES_URL,
+        connections_per_node=ES_CONNECTIONS_PER_NODE,
+        request_timeout=ES_REQUEST_TIMEOUT,
+        max_retries=ES_MAX_RETRIES,
+        retry_on_timeout=ES_RETRY_ON_TIMEOUT,
+        retry_on_status=ES_RETRY_ON_STATUS,
+        http_compress=ES_HTTP_COMPRESS,
+        serializer=OrjsonSerializer(),
+        **sniffing_options,
+    )
+
+
+def open_elasticsearch() -> AsyncElasticsearch:
+    """
+    Creates the client all indices of this process share, called by the lifespan of the app on startup.
+    """
+    global _elasticsearch
+    if _elasticsearch is None:
+        _elasticsearch = create_elasticsearch()
+    return _elasticsearch
+
+
+def get_elasticsearch() -> AsyncElasticsearch:
+    """
+    Returns the shared client. It is created on first use when the app lifespan didn't run,
+    like in tests with an ASGI transport or in scripts.
+    """
+    return open_elasticsearch()
+
+
+async def close_elasticsearch() -> None:
+    """
+    Closes the connections of the shared client, called by the lifespan of the app on shutdown.
+    """
+    global _elasticsearch
+    if _elasticsearch is not None:
+        client, _elasticsearch = _elasticsearch, None
+        await client.close()
@@ -1,19 +1,65 @@
+import os
 from typing import Annotated
 
+from dotenv import load_dotenv
 from fastapi import Depends
 
 from api.lib.elasticsearch import ElasticsearchClient
+from api.lib.in_memory import InMemorySearchClient
+from api.lib.search_backend import SearchBackend
 
+load_dotenv(override=True)
+# "elasticsearch" or "in_memory", selects the backend the repositories retrieve and match entities from
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "elasticsearch")
 
-# Dependency function to return a fresh client per request
+
+_search_backends: dict[str, SearchBackend] = {}
+
+
+def get_search_backend(index: str) -> SearchBackend:
+    """
+    Returns the search backend of the given index. Backends hold no per request state,
+    so one instance per index is created and reused by all requests.
+    """
+    if index not in _search_backends:
+        if SEARCH_BACKEND == "in_memory":
+            _search_backends[index] = InMemorySearchClient(index)
+        else:
+            _search_backends[index] = ElasticsearchClient(index)
+    return _search_backends[index]
+
+
+# Dependency functions returning the shared backend of each index
 def get_candidates_elasticsearch_client():
-    return ElasticsearchClient("candidates")
+    return get_search_backend("candidates")
 
 
 def get_jobs_elasticsearch_client():
-    return ElasticsearchClient("jobs")
+    return get_search_backend("jobs")
+
+
+# Precomputed top matches, see seed_image/precompute_matches.py
+def get_candidate_matches_elasticsearch_client():
+    return get_search_backend("matches_candidates")
+
+
+def get_job_matches_elasticsearch_client():
+    return get_search_backend("matches_jobs")
+
+
+# Matching queries of every candidate or job, see seed_image/percolator.py
+def get_candidate_queries_elasticsearch_client():
+    return get_search_backend("percolate_candidates")
+
+
+def get_job_queries_elasticsearch_client():
+    return get_search_backend("percolate_jobs")
 
 
 # Annotated dependencies for injection into routes
-CandidatesElasticsearchDep = Annotated[ElasticsearchClient, Depends(get_candidates_elasticsearch_client)]
-JobsElasticsearchDep = Annotated[ElasticsearchClient, Depends(get_jobs_elasticsearch_client)]
+CandidatesElasticsearchDep = Annotated[SearchBackend, Depends(get_candidates_elasticsearch_client)]
+JobsElasticsearchDep = Annotated[SearchBackend, Depends(get_jobs_elasticsearch_client)]
+CandidateMatchesElasticsearchDep = Annotated[SearchBackend, Depends(get_candidate_matches_elasticsearch_client)]
+JobMatchesElasticsearchDep = Annotated[SearchBackend, Depends(get_job_matches_elasticsearch_client)]
+CandidateQueriesElasticsearchDep = Annotated[SearchBackend, Depends(get_candidate_queries_elasticsearch_client)]
+JobQueriesElasticsearchDep = Annotated[SearchBackend, Depends(get_job_queries_elasticsearch_client)]
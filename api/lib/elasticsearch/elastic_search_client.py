@@ -1,40 +1,88 @@
+import asyncio
 import os
+from typing import AsyncIterator
 
 from dotenv import load_dotenv
 from elastic_transport import ObjectApiResponse
 from elasticsearch import AsyncElasticsearch
 from elasticsearch.exceptions import NotFoundError
+from elasticsearch.helpers import async_scan
 
-from api.lib.elasticsearch.exceptions import IDNotFoundError
+from api.lib.elasticsearch.connection import get_elasticsearch
+from api.lib.elasticsearch.entity_cache import CachedEntity, get_entity_cache
+from api.lib.elasticsearch.exceptions import IDNotFoundError, PointInTimeNotFoundError
+from api.lib.elasticsearch.resilience import get_resilience
+from api.lib.metrics import count_found_documents, count_msearch_hits, count_search_hits, get_elasticsearch_metrics
+from api.lib.search_backend import MATCH_HITS_FILTER_PATH, TIEBREAKER_FIELD, SearchBackend
+from api.lib.singleflight import get_single_flight
 
 load_dotenv(override=True)
-ES_URL = os.getenv("ES_URL")
+PIT_KEEP_ALIVE = os.getenv("PIT_KEEP_ALIVE", "2m")
+# Seconds the generation of an index is reused, ETags of matching results lag behind writes by at most this long
+INDEX_GENERATION_TTL_SECONDS = float(os.getenv("INDEX_GENERATION_TTL_SECONDS", "5"))
+# The primary copies of the shards with their highest sequence number, it grows with every write and delete
+GENERATION_FILTER_PATH = ["indices.*.shards.*.routing.primary", "indices.*.shards.*.seq_no.max_seq_no"]
 
+# Paged searches only need the ids, scores and sort values of the hits and the point in time of the next page
+PAGE_FILTER_PATH = ["took", "pit_id", *MATCH_HITS_FILTER_PATH, "hits.hits.sort"]
 
-class ElasticsearchClient:
+
+def _with_took(filter_path: list[str] | None) -> list[str] | None:
+    """Keeps `took` in filtered responses, it is recorded in the metrics."""
+    return None if filter_path is None else ["took", *filter_path]
+
+
+def _with_preference(searches: list[dict], preference: str | None) -> list[dict]:
+    """Sets the preference in the header of every search of an msearch, the msearch itself doesn't take one."""
+    if preference is None:
+        return searches
+    return [{**search, "preference": preference} if i % 2 == 0 else search for i, search in enumerate(searches)]
+
+
+class ElasticsearchClient(SearchBackend):
     """
     Class containing methods for retrieving jobs or candidates from the
     respective Elasticsearch index by ID as well as sending queries.
+    All instances share the connection pool of the process, see `api.lib.elasticsearch.connection`.
+    `index` is the alias the seeder points to the current version of the index, e.g. "jobs" -> "jobs_v3",
+    so reindexing swaps the data underneath without the API noticing.
+    Requests go through `api.lib.elasticsearch.resilience`, which times them out adaptively, hedges slow reads
+    and stops sending them while the circuit breaker of the cluster is open.
 
     Args:
         index (str): "candidates"
     """
 
-    __client = AsyncElasticsearch(ES_URL)
+    __registered_search_templates: set[str] = set()
 
     def __init__(self, index) -> None:
-        self.index = index
+        super().__init__(index)
+        self.cache = get_entity_cache(index)
+        # The cache already reuses documents, so only concurrent fetches of the same document are coalesced
+        self.single_flight = get_single_flight(f"entities/{index}", reuse_window=0)
+        self.metrics = get_elasticsearch_metrics(index)
+        self.resilience = get_resilience(index)
+        self.generation_single_flight = get_single_flight(
+            f"generation/{index}", reuse_window=INDEX_GENERATION_TTL_SECONDS
+        )
+
+    @property
+    def __client(self) -> AsyncElasticsearch:
+        return get_elasticsearch()
 
     async def get_entity(
         self,
         *,
         id: int,
+        source_includes: list[str] | None = None,
     ) -> dict:
         """
         Returns the document corresponding to the given document ID as dictionary.
+        Documents are served from the entity cache of the index if possible.
 
         Args:
             id (int): ID of the document to return.
+            source_includes (list[str] | None): Only return these fields of the document, all fields if not set.
 
         Returns:
             dict: Entity object corresponding to the given ID.
@@ -42,51 +90,500 @@ class ElasticsearchClient:
         Raises:
             IDNotFoundError: If the ID was not found in the index.
         """
+        entity = await self.get_versioned_entity(id=id)
+        if source_includes is None:
+            return dict(entity.source)
+        return {field: entity.source[field] for field in source_includes if field in entity.source}
 
-        try:
-            return (await self.__client.get_source(index=self.index, id=str(id), source=True)).body
-        except NotFoundError as error:
-            raise IDNotFoundError("ID '{}' was not found in the index '{}'.".format(id, self.index)) from error
+    async def get_entity_with_version(self, *, id: int) -> tuple[dict, str]:
+        """
+        Returns the document corresponding to the given document ID together with its version,
+        the concrete index, `_primary_term` and `_seq_no` it was read with.
+
+        Args:
+            id (int): ID of the document to return.
+
+        Returns:
+            tuple[dict, str]: Entity object and version corresponding to the given ID.
+
+        Raises:
+            IDNotFoundError: If the ID was not found in the index.
+        """
+        entity = await self.get_versioned_entity(id=id)
+        return dict(entity.source), f"{entity.index}/{entity.primary_term}/{entity.seq_no}"
+
+    async def get_versioned_entity(self, *, id: int) -> CachedEntity:
+        """
+        Returns the document corresponding to the given document ID together with its `_seq_no`/`_primary_term`
+        and the index version it was read from.
+        Concurrent calls for the same ID share one lookup.
+
+        Args:
+            id (int): ID of the document to return.
+
+        Returns:
+            CachedEntity: Entity object and version corresponding to the given ID.
+
+        Raises:
+            IDNotFoundError: If the ID was not found in the index.
+        """
+
+        async def fetch() -> CachedEntity:
+            try:
+                response = (
+                    await self.metrics.get.observe(
+                        self.resilience.call(
+                            "get",
+                            lambda client, preference: client.get(index=self.index, id=str(id), preference=preference),
+                        )
+                    )
+                ).body
+            except NotFoundError as error:
+                raise IDNotFoundError("ID '{}' was not found in the index '{}'.".format(id, self.index)) from error
+            return CachedEntity(
+                source=response["_source"],
+                seq_no=response["_seq_no"],
+                primary_term=response["_primary_term"],
+                index=response["_index"],
+            )
 
-    async def search_with_bool_queries(
+        async def fetch_version() -> CachedEntity | None:
+            try:
+                response = (
+                    await self.metrics.get.observe(
+                        self.resilience.call(
+                            "get",
+                            lambda client, preference: client.get(
+                                index=self.index, id=str(id), source=False, preference=preference
+                            ),
+                        )
+                    )
+                ).body
+            except NotFoundError:
+                return None
+            return CachedEntity(
+                source={}, seq_no=response["_seq_no"], primary_term=response["_primary_term"], index=response["_index"]
+            )
+
+        return await self.single_flight.do(id, lambda: self.cache.get(id, fetch=fetch, fetch_version=fetch_version))
+
+    async def get_entities(
         self,
         *,
-        should_queries: list[dict] | None = None,
-        must_queries: list[dict] | None = None,
-        return_source=False,
-        size: int = 10,
-    ):
+        ids: list[int],
+    ) -> dict[int, dict]:
         """
-        Builds a boolean query comprising the provided should and must sub queries.
+        Returns the documents corresponding to the given document IDs with a single mget request.
+        Documents that are in the entity cache of the index are not requested again.
 
         Args:
-            should_queries: the sub-queries that are to be concatenated by the OR operator
-            must_queries: the sub-queries that are to be concatenated by the AND operator
-            return_source: whether to return the _source field of the document.
-            size: how many docs to returns
+            ids (list[int]): IDs of the documents to return.
 
         Returns:
-            The matching documents.
+            dict[int, dict]: Entity objects keyed by their ID. IDs that were not found in the index are omitted.
         """
-        if not (should_queries or must_queries):
-            raise ValueError("Either should_queries or must_queries must be set.")
+        entities = {}
+        missing_ids = []
+        for id in ids:
+            entity = self.cache.peek(id)
+            if entity is None:
+                missing_ids.append(id)
+            else:
+                entities[id] = dict(entity.source)
 
-        query = {
-            "query": {
-                "bool": {
-                    "must": must_queries or [],
-                    "should": should_queries or [],
-                }
-            },
+        if not missing_ids:
+            return entities
+
+        response = await self.metrics.mget.observe(
+            self.resilience.call(
+                "mget",
+                lambda client, preference: client.mget(
+                    index=self.index, ids=[str(id) for id in missing_ids], preference=preference
+                ),
+            ),
+            count_found_documents,
+        )
+        for doc in response.body["docs"]:
+            if doc.get("found"):
+                entity = CachedEntity(
+                    source=doc["_source"], seq_no=doc["_seq_no"], primary_term=doc["_primary_term"], index=doc["_index"]
+                )
+                entities[int(doc["_id"])] = dict(self.cache.put(int(doc["_id"]), entity).source)
+        return entities
+
+    async def get_generation(self) -> str:
+        """
+        Returns the concrete indices behind the alias with the sum of the highest sequence numbers of their
+        primary shards. It changes with every write, delete and alias swap. The shard stats are fetched at most
+        once every INDEX_GENERATION_TTL_SECONDS, concurrent calls share the request.
+
+        Returns:
+            str: e.g. "jobs_v3:10500"
+        """
+
+        async def fetch() -> str:
+            response = await self.metrics.index_stats.observe(
+                self.resilience.call(
+                    "index_stats",
+                    lambda client, preference: client.indices.stats(
+                        index=self.index, metric="docs", level="shards", filter_path=GENERATION_FILTER_PATH
+                    ),
+                    hedge=False,
+                )
+            )
+            generation = []
+            for index, stats in sorted(response.body.get("indices", {}).items()):
+                max_seq_no = sum(
+                    copy["seq_no"]["max_seq_no"]
+                    for copies in stats["shards"].values()
+                    for copy in copies
+                    if copy["routing"]["primary"]
+                )
+                generation.append(f"{index}:{max_seq_no}")
+            return ",".join(generation)
+
+        return await self.generation_single_flight.do(self.index, fetch)
+
+    async def search(self, query: dict, return_source=False, filter_path: list[str] | None = None) -> ObjectApiResponse:
+        """
+        Executes a query on the index.
+
+        Args:
+            query: the search request body
+            return_source: whether to return the _source field of the documents, or the list of its fields to return.
+            filter_path: parts of the response elasticsearch returns, all if not set.
+                Hits disappear from the response altogether if there are none.
+        """
+        return await self.metrics.search.observe(
+            self.resilience.call(
+                "search",
+                lambda client, preference: client.search(
+                    body=query,
+                    index=self.index,
+                    source=return_source,
+                    filter_path=_with_took(filter_path),
+                    preference=preference,
+                ),
+            ),
+            count_search_hits,
+        )
+
+    async def multi_search(
+        self, *, queries: list[dict], return_source=False, filter_path: list[str] | None = None
+    ) -> list[dict]:
+        """
+        Executes several queries on the index with a single msearch request.
+
+        Args:
+            queries: the search request bodies, e.g. built by `build_bool_query`
+            return_source: whether to return the _source field of the documents.
+            filter_path: parts of every single response elasticsearch returns, all if not set.
+
+        Returns:
+            One response per query in the same order. Failed queries contain an "error" key instead of hits.
+        """
+        if not queries:
+            return []
+
+        searches = []
+        for query in queries:
+            searches.append({})
+            searches.append({**query, "_source": return_source})
+
+        if filter_path is not None:
+            # "status" is part of every response and keeps responses without hits from being filtered out entirely
+            filter_path = ["took", *(f"responses.{path}" for path in [*filter_path, "status", "error"])]
+        response = await self.metrics.msearch.observe(
+            self.resilience.call(
+                "msearch",
+                lambda client, preference: client.msearch(
+                    searches=_with_preference(searches, preference), index=self.index, filter_path=filter_path
+                ),
+            ),
+            count_msearch_hits,
+        )
+        return response.body["responses"]
+
+    async def search_page(
+        self,
+        *,
+        query: dict,
+        size: int,
+        pit_id: str | None = None,
+        search_after: list | None = None,
+    ) -> dict:
+        """
+        Returns one page of the hits of the given query with search_after on a point in time,
+        so deep pages neither get slower nor are limited by max_result_window like from/size.
+        The point in time is closed once the last page was returned.
+
+        Args:
+            query: the search request body, its "size" is overridden by `size`
+            size: number of hits per page
+            pit_id: point in time of the previous page, a new one is opened if not set
+            search_after: "sort" values of the last hit of the previous page
+
+        Returns:
+            The search response, "pit_id" holds the point in time the next page has to use.
+
+        Raises:
+            PointInTimeNotFoundError: If the point in time of the previous page expired.
+        """
+        continues = pit_id is not None
+        if pit_id is None:
+            pit_id = await self.__open_point_in_time()
+
+        body = {
+            **query,
             "size": size,
+            "pit": {"id": pit_id, "keep_alive": PIT_KEEP_ALIVE},
+            "sort": [{"_score": "desc"}, {TIEBREAKER_FIELD: "asc"}],
+            "track_total_hits": False,
         }
-        return await self.search(query=query, return_source=return_source)
+        if search_after is not None:
+            body["search_after"] = search_after
 
-    async def search(self, query: dict, return_source=False) -> ObjectApiResponse:
+        try:
+            response = (
+                await self.metrics.search_page.observe(
+                    self.resilience.call(
+                        "search_page",
+                        lambda client, preference: client.search(body=body, source=False, filter_path=PAGE_FILTER_PATH),
+                        hedge=False,
+                    ),
+                    count_search_hits,
+                )
+            ).body
+        except NotFoundError as error:
+            # Elasticsearch answers a point in time that outlived its keep alive with a search_context_missing 404
+            if not continues:
+                raise
+            raise PointInTimeNotFoundError(f"The point in time of the page on '{self.index}' expired.") from error
+        response.setdefault("hits", {}).setdefault("hits", [])
+        if len(response["hits"]["hits"]) < size:
+            await self.__close_point_in_time(response["pit_id"])
+        return response
+
+    async def iter_sliced_hits(self, *, query: dict, slices: int, page_size: int) -> AsyncIterator[dict]:
         """
-        Executes a query on the index.
+        Iterates over all hits of the given query in no particular order. The hits are split into slices of one
+        point in time that are paged through concurrently with search_after in index order (`_shard_doc`).
+        Every slice hands its pages over through a bounded queue, so memory stays bounded by a few pages
+        per slice and hits are yielded as soon as their page arrives.
+
+        Args:
+            query: the search request body, only its "query" is used
+            slices: number of slices fetched concurrently
+            page_size: number of hits fetched per request
+
+        Yields:
+            dict: hits with "_id" and "_score"
         """
-        return await self.__client.search(body=query, index=self.index, source=return_source)
+        pit_id = await self.__open_point_in_time()
+        pages: asyncio.Queue[list[dict] | BaseException | None] = asyncio.Queue(maxsize=slices)
+
+        async def fetch_slice(slice_id: int) -> None:
+            try:
+                body = {
+                    "query": query["query"],
+                    "size": page_size,
+                    "pit": {"id": pit_id, "keep_alive": PIT_KEEP_ALIVE},
+                    "sort": ["_shard_doc"],
+                    "track_scores": True,
+                    "track_total_hits": False,
+                }
+                if slices > 1:
+                    body["slice"] = {"id": slice_id, "max": slices}
+                while True:
+                    response = await self.metrics.sliced_search.observe(
+                        self.resilience.call(
+                            "sliced_search",
+                            lambda client, preference: client.search(
+                                body=body, source=False, filter_path=PAGE_FILTER_PATH
+                            ),
+                            hedge=False,
+                        ),
+                        count_search_hits,
+                    )
+                    hits = response.body.get("hits", {}).get("hits", [])
+                    if hits:
+                        await pages.put(hits)
+                    if len(hits) < page_size:
+                        break
+                    body["search_after"] = hits[-1]["sort"]
+                await pages.put(None)
+            except Exception as error:
+                await pages.put(error)
+
+        tasks = [asyncio.create_task(fetch_slice(slice_id)) for slice_id in range(slices)]
+        try:
+            running = slices
+            while running:
+                page = await pages.get()
+                if page is None:
+                    running -= 1
+                elif isinstance(page, BaseException):
+                    raise page
+                else:
+                    for hit in page:
+                        yield hit
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await self.__close_point_in_time(pit_id)
+
+    async def __open_point_in_time(self) -> str:
+        response = await self.metrics.open_point_in_time.observe(
+            self.resilience.call(
+                "open_point_in_time",
+                lambda client, preference: client.open_point_in_time(index=self.index, keep_alive=PIT_KEEP_ALIVE),
+                hedge=False,
+            )
+        )
+        return response.body["id"]
+
+    async def __close_point_in_time(self, pit_id: str) -> None:
+        await self.metrics.close_point_in_time.observe(
+            self.resilience.call(
+                "close_point_in_time",
+                lambda client, preference: client.close_point_in_time(id=pit_id),
+                hedge=False,
+            )
+        )
+
+    async def ensure_search_template(self, *, id: str, source: str) -> None:
+        """
+        Registers a mustache search template as stored script, once per process.
+
+        Args:
+            id: id under which the template is stored and referenced by `search_template`
+            source: the mustache template of the search request body
+        """
+        if id in self.__registered_search_templates:
+            return
+
+        await self.resilience.call(
+            "put_script",
+            lambda client, preference: client.put_script(id=id, script={"lang": "mustache", "source": source}),
+            hedge=False,
+        )
+        self.__registered_search_templates.add(id)
 
-    async def close(self):
-        await self.__client.close()
+    async def search_template(
+        self, *, id: str, params: dict, filter_path: list[str] | None = None
+    ) -> ObjectApiResponse:
+        """
+        Executes a stored search template on the index.
+        Only the template id and its params are sent, the query itself is rendered by elasticsearch.
+
+        Args:
+            id: id of a template registered with `ensure_search_template`
+            params: values for the template variables
+            filter_path: parts of the response elasticsearch returns, all if not set.
+
+        Returns:
+            The matching documents.
+        """
+        return await self.metrics.search_template.observe(
+            self.resilience.call(
+                "search_template",
+                lambda client, preference: client.search_template(
+                    index=self.index, id=id, params=params, filter_path=_with_took(filter_path), preference=preference
+                ),
+            ),
+            count_search_hits,
+        )
+
+    async def knn_search(
+        self,
+        *,
+        field: str,
+        query_vector: list[float],
+        k: int,
+        num_candidates: int,
+        filter: list[dict] | None = None,
+        source_includes: list[str] | None = None,
+    ) -> dict:
+        """
+        Returns the k documents whose vector in `field` is closest to the query vector with an approximate kNN
+        search. The filter is applied while traversing the HNSW graph, so k hits are returned as long as
+        enough documents match it.
+
+        Args:
+            field: dense_vector field to search
+            query_vector: vector to find the nearest neighbours of
+            k: number of hits to return
+            num_candidates: nearest neighbours considered per shard, more improve recall and cost latency
+            filter: queries a hit has to match
+            source_includes: fields of the _source to return with every hit, none if not set
+
+        Returns:
+            The search response with the _id, _score and the included _source of the hits.
+        """
+        knn = {"field": field, "query_vector": query_vector, "k": k, "num_candidates": num_candidates}
+        if filter:
+            knn["filter"] = filter
+        response = await self.metrics.knn_search.observe(
+            self.resilience.call(
+                "knn_search",
+                lambda client, preference: client.search(
+                    index=self.index,
+                    knn=knn,
+                    size=k,
+                    source=source_includes or False,
+                    filter_path=_with_took([*MATCH_HITS_FILTER_PATH, "hits.hits._source"]),
+                    preference=preference,
+                ),
+            ),
+            count_search_hits,
+        )
+        return response.body
+
+    async def percolate(self, *, documents: list[dict], size: int) -> list[dict]:
+        """
+        Matches the documents against the stored queries of the percolator index with a single msearch,
+        one percolate query per document, so every document gets its own top `size` queries and total.
+
+        Args:
+            documents: documents to percolate, enriched like indexed documents
+            size: maximum number of matching queries returned per document
+
+        Returns:
+            One response per document in the same order. Failed searches contain an "error" key instead of hits.
+        """
+        searches = []
+        for document in documents:
+            searches.append({})
+            searches.append(
+                {
+                    "query": {"percolate": {"field": "query", "document": document}},
+                    "size": size,
+                    "track_total_hits": True,
+                    "_source": False,
+                }
+            )
+        filter_path = [
+            "took",
+            *(f"responses.{path}" for path in [*MATCH_HITS_FILTER_PATH, "hits.total.value", "status", "error"]),
+        ]
+        response = await self.metrics.percolate.observe(
+            self.resilience.call(
+                "percolate",
+                lambda client, preference: client.msearch(
+                    searches=_with_preference(searches, preference), index=self.index, filter_path=filter_path
+                ),
+            ),
+            count_msearch_hits,
+        )
+        return response.body["responses"]
+
+    async def scan_entities(self) -> AsyncIterator[tuple[int, dict]]:
+        """
+        Iterates over all documents of the index with a scroll, e.g. to load them into another backend.
+
+        Yields:
+            tuple[int, dict]: ID and entity object of every document.
+        """
+        async for doc in async_scan(self.__client, index=self.index, query={"query": {"match_all": {}}}):
+            yield int(doc["_id"]), doc["_source"]
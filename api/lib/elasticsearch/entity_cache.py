@@ -0,0 +1,163 @@
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+ENTITY_CACHE_MAX_SIZE = int(os.getenv("ENTITY_CACHE_MAX_SIZE", "10000"))
+ENTITY_CACHE_TTL_SECONDS = float(os.getenv("ENTITY_CACHE_TTL_SECONDS", "60"))
+
+
+@dataclass
+class CachedEntity:
+    """
+    A cached document together with the version it had in the index when it was fetched.
+    `index` is the concrete index behind the alias, sequence numbers are only comparable within one index.
+    """
+
+    source: dict
+    seq_no: int
+    primary_term: int
+    index: str = ""
+    expires_at: float = 0.0
+
+    def same_version(self, other: "CachedEntity | None") -> bool:
+        return other is not None and (self.index, self.seq_no, self.primary_term) == (
+            other.index,
+            other.seq_no,
+            other.primary_term,
+        )
+
+
+@dataclass
+class EntityCacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    revalidations: int = 0
+    invalidations: int = 0
+
+
+class EntityCache:
+    """
+    Bounded in-process cache for the documents of one index, keyed by document ID.
+
+    Entries are evicted in LRU order once `max_size` is reached. Entries older than `ttl` are not dropped
+    but revalidated: only the version (`_seq_no`/`_primary_term`) of the document is fetched and if it
+    didn't change the entry is served again without transferring the document.
+
+    Args:
+        max_size (int): maximum number of cached documents, 0 disables the cache
+        ttl (float): seconds after which an entry has to be revalidated
+    """
+
+    def __init__(self, *, max_size: int, ttl: float) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.stats = EntityCacheStats()
+        self.__entries: OrderedDict[int, CachedEntity] = OrderedDict()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+    async def get(
+        self,
+        id: int,
+        *,
+        fetch: Callable[[], Awaitable[CachedEntity]],
+        fetch_version: Callable[[], Awaitable[CachedEntity | None]],
+    ) -> CachedEntity:
+        """
+        Returns the cached entity for the given ID, loading or revalidating it when necessary.
+
+        Args:
+            id (int): ID of the document.
+            fetch: coroutine function fetching the full document with its version.
+            fetch_version: coroutine function fetching only the version of the document, None if it is gone.
+
+        Returns:
+            CachedEntity: the up to date entity.
+        """
+        if not self.enabled:
+            return await fetch()
+
+        entry = self.__entries.get(id)
+        if entry is None:
+            self.stats.misses += 1
+            return self.put(id, await fetch())
+
+        if entry.expires_at <= time.monotonic():
+            if not entry.same_version(await fetch_version()):
+                self.stats.invalidations += 1
+                self.invalidate(id)
+                return self.put(id, await fetch())
+            self.stats.revalidations += 1
+            entry.expires_at = time.monotonic() + self.ttl
+
+        self.stats.hits += 1
+        self.__entries.move_to_end(id)
+        return entry
+
+    def peek(self, id: int) -> CachedEntity | None:
+        """
+        Returns the entity for the given ID if it is cached and fresh, without loading anything.
+        """
+        entry = self.__entries.get(id)
+        if entry is None or entry.expires_at <= time.monotonic():
+            self.stats.misses += 1
+            return None
+
+        self.stats.hits += 1
+        self.__entries.move_to_end(id)
+        return entry
+
+    def put(self, id: int, entry: CachedEntity) -> CachedEntity:
+        if not self.enabled:
+            return entry
+
+        entry.expires_at = time.monotonic() + self.ttl
+        self.__entries[id] = entry
+        self.__entries.move_to_end(id)
+        while len(self.__entries) > self.max_size:
+            self.__entries.popitem(last=False)
+            self.stats.evictions += 1
+        return entry
+
+    def invalidate(self, id: int) -> None:
+        self.__entries.pop(id, None)
+
+    def clear(self) -> None:
+        self.__entries.clear()
+
+
+_entity_caches: dict[str, EntityCache] = {}
+
+
+def get_entity_cache(index: str) -> EntityCache:
+    """
+    Returns the process wide cache of the given index.
+    Size and TTL default to ENTITY_CACHE_MAX_SIZE and ENTITY_CACHE_TTL_SECONDS and can be overridden
+    per index, e.g. with ENTITY_CACHE_JOBS_MAX_SIZE and ENTITY_CACHE_JOBS_TTL_SECONDS.
+
+    Args:
+        index (str): name of the index, e.g. "jobs" or "candidates"
+    """
+    if index not in _entity_caches:
+        prefix = f"ENTITY_CACHE_{index.upper()}"
+        _entity_caches[index] = EntityCache(
+            max_size=int(os.getenv(f"{prefix}_MAX_SIZE", ENTITY_CACHE_MAX_SIZE)),
+            ttl=float(os.getenv(f"{prefix}_TTL_SECONDS", ENTITY_CACHE_TTL_SECONDS)),
+        )
+    return _entity_caches[index]
+
+
+def get_entity_caches() -> dict[str, EntityCache]:
+    """Returns the caches of all indices that were used so far, keyed by index."""
+    return dict(_entity_caches)
@@ -2,3 +2,41 @@ class IDNotFoundError(Exception):
     """
     Raised when a non-existing id was queried.
     """
+
+
+class UnsupportedSearchError(Exception):
+    """
+    Raised when the configured search backend can't execute the requested kind of search.
+    """
+
+
+class PointInTimeNotFoundError(Exception):
+    """
+    Raised when the point in time of a page expired or was closed.
+    """
+
+
+class SearchUnavailableError(Exception):
+    """
+    Raised when elasticsearch can't be reached, is overloaded or the circuit breaker in front of it is open.
+
+    Args:
+        message (str): description of the failure
+        retry_after (float): seconds after which a retry has a chance to succeed
+    """
+
+    def __init__(self, message: str, *, retry_after: float = 1.0) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class SearchTimeoutError(SearchUnavailableError):
+    """
+    Raised when elasticsearch didn't answer within the timeout of the operation.
+    """
+
+
+class SearchOverloadedError(SearchUnavailableError):
+    """
+    Raised when a request was shed by the admission control because too many requests wait for elasticsearch.
+    """
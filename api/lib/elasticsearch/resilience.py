@@ -0,0 +1,555 @@
+import asyncio
+import math
+import os
+import random
+import time
+from collections import OrderedDict, deque
+from contextvars import ContextVar
+from dataclasses import dataclass
+from enum import Enum
+from typing import Any, Awaitable, Callable, Hashable, Optional, TypeVar
+
+from dotenv import load_dotenv
+from elastic_transport import ConnectionError, ConnectionTimeout, ObjectApiResponse, TransportError
+from elasticsearch import ApiError, AsyncElasticsearch
+from fastapi import Request
+from fastapi.responses import ORJSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from api.lib.elasticsearch.admission import get_admission_controller
+from api.lib.elasticsearch.connection import (
+    ES_MAX_RETRIES,
+    ES_REQUEST_TIMEOUT,
+    ES_RETRY_ON_STATUS,
+    ES_RETRY_ON_TIMEOUT,
+    get_elasticsearch,
+)
+from api.lib.elasticsearch.exceptions import SearchOverloadedError, SearchTimeoutError, SearchUnavailableError
+
+load_dotenv(override=True)
+# Latencies of the last successful requests kept per index and operation, their percentiles drive timeouts and hedging
+ES_LATENCY_WINDOW = int(os.getenv("ES_LATENCY_WINDOW", "1000"))
+# Until an operation has this many latencies it runs with ES_REQUEST_TIMEOUT and isn't hedged
+ES_LATENCY_MIN_SAMPLES = int(os.getenv("ES_LATENCY_MIN_SAMPLES", "100"))
+# The timeout of an operation is its p99 times this factor, within ES_MIN_TIMEOUT and ES_REQUEST_TIMEOUT
+ES_TIMEOUT_P99_MULTIPLIER = float(os.getenv("ES_TIMEOUT_P99_MULTIPLIER", "3"))
+ES_MIN_TIMEOUT = float(os.getenv("ES_MIN_TIMEOUT", "0.5"))
+# Retry n of a request waits a random time up to min(ES_RETRY_MAX_BACKOFF, ES_RETRY_BACKOFF_FACTOR * 2 ** n) seconds
+ES_RETRY_BACKOFF_FACTOR = float(os.getenv("ES_RETRY_BACKOFF_FACTOR", "0.1"))
+ES_RETRY_MAX_BACKOFF = float(os.getenv("ES_RETRY_MAX_BACKOFF", "2"))
+# A duplicate of a read is sent once it took longer than the p95 of its operation, but not sooner than ES_HEDGE_MIN_DELAY
+ES_HEDGE_ENABLED = os.getenv("ES_HEDGE_ENABLED", "true").strip().lower() in ("1", "true", "yes", "on")
+ES_HEDGE_MIN_DELAY = float(os.getenv("ES_HEDGE_MIN_DELAY", "0.01"))
+# Share of the requests of an index that may be hedged, so a slow cluster doesn't get twice the load
+ES_HEDGE_BUDGET = float(os.getenv("ES_HEDGE_BUDGET", "0.05"))
+# Consecutive failed requests that open the circuit breaker, and seconds until it lets a probe request through
+ES_BREAKER_FAILURE_THRESHOLD = int(os.getenv("ES_BREAKER_FAILURE_THRESHOLD", "5"))
+ES_BREAKER_RESET_SECONDS = float(os.getenv("ES_BREAKER_RESET_SECONDS", "10"))
+# Last successful result per matching request, served while elasticsearch is unavailable
+STALE_RESULTS_MAX_SIZE = int(os.getenv("STALE_RESULTS_MAX_SIZE", "10000"))
+STALE_RESULTS_MAX_AGE_SECONDS = float(os.getenv("STALE_RESULTS_MAX_AGE_SECONDS", "3600"))
+
+DEGRADED_HEADER = "X-Degraded"
+_CACHE_HEADERS = (b"etag", b"cache-control")
+# Hedges saved up while requests are fast, so a burst of slow requests can still be hedged
+HEDGE_BURST = 10
+
+T = TypeVar("T")
+
+# Sends one request with the given client and `preference`, None lets elasticsearch pick the shard copies
+SendRequest = Callable[[AsyncElasticsearch, Optional[str]], Awaitable[ObjectApiResponse]]
+
+# Set by the DegradedResponseMiddleware for every request, True once a stale result was served
+_degraded: ContextVar[list[bool] | None] = ContextVar("degraded", default=None)
+
+
+def is_failure(error: BaseException) -> bool:
+    """
+    Whether an error means elasticsearch is unavailable: it couldn't be reached, didn't answer in time,
+    rejected the request because it is overloaded or failed itself. Errors caused by the request, e.g. a
+    missing document or an invalid query, are answers and don't count.
+    """
+    if isinstance(error, (TransportError, TimeoutError)):
+        return True
+    if isinstance(error, ApiError):
+        return error.status_code == 429 or error.status_code >= 500
+    return False
+
+
+def is_retryable(error: BaseException) -> bool:
+    """
+    Whether a request that failed with the error may be sent again: the node couldn't be reached, didn't answer
+    in time and ES_RETRY_ON_TIMEOUT is set, or answered with one of ES_RETRY_ON_STATUS.
+    """
+    if isinstance(error, ConnectionTimeout):
+        return ES_RETRY_ON_TIMEOUT
+    if isinstance(error, ConnectionError):
+        return True
+    return isinstance(error, ApiError) and error.status_code in ES_RETRY_ON_STATUS
+
+
+def retry_backoff(attempt: int) -> float:
+    """Seconds to wait before the given retry, exponential backoff with full jitter."""
+    return random.uniform(0, min(ES_RETRY_MAX_BACKOFF, ES_RETRY_BACKOFF_FACTOR * 2**attempt))
+
+
+class LatencyWindow:
+    """
+    Durations of the last `size` requests of one operation. Sorting them is comparatively expensive,
+    so the percentiles are only recomputed after a tenth of the window was replaced.
+
+    Args:
+        size (int): number of durations kept
+    """
+
+    def __init__(self, size: int) -> None:
+        self.__samples: deque[float] = deque(maxlen=size)
+        self.__refresh_every = max(1, size // 10)
+        self.__since_refresh = 0
+        self.__sorted: list[float] = []
+
+    def __len__(self) -> int:
+        return len(self.__samples)
+
+    def record(self, seconds: float) -> None:
+        self.__samples.append(seconds)
+        self.__since_refresh += 1
+
+    def percentile(self, q: float) -> float:
+        """Returns the q-quantile (0 < q <= 1) of the kept durations, 0 if there are none."""
+        if not self.__sorted or self.__since_refresh >= self.__refresh_every:
+            self.__sorted = sorted(self.__samples)
+            self.__since_refresh = 0
+        if not self.__sorted:
+            return 0.0
+        return self.__sorted[min(len(self.__sorted) - 1, math.ceil(q * len(self.__sorted)) - 1)]
+
+
+class CircuitState(str, Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+@dataclass
+class CircuitBreakerStats:
+    opened: int = 0
+    rejected: int = 0
+
+
+class CircuitBreaker:
+    """
+    Stops sending requests to elasticsearch after `failure_threshold` consecutive failures, so requests fail
+    fast instead of piling up on a cluster that is down or overloaded.
+
+    After `reset_timeout` seconds the breaker is half open and lets one probe request through. An answer closes
+    it, a failure opens it again. Another probe is let through every `reset_timeout` seconds, so a probe whose
+    caller went away doesn't keep the breaker half open forever.
+
+    Args:
+        failure_threshold (int): consecutive failures that open the breaker
+        reset_timeout (float): seconds the breaker stays open before a probe is let through
+        clock: monotonic clock in seconds, replaced in tests
+    """
+
+    def __init__(
+        self, *, failure_threshold: int, reset_timeout: float, clock: Callable[[], float] = time.monotonic
+    ) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.stats = CircuitBreakerStats()
+        self.__clock = clock
+        self.__state = CircuitState.CLOSED
+        self.__failures = 0
+        self.__next_probe_at = 0.0
+
+    @property
+    def state(self) -> CircuitState:
+        return self.__state
+
+    @property
+    def retry_after(self) -> float:
+        """Seconds until the breaker lets the next request through, 0 if it is closed."""
+        if self.__state == CircuitState.CLOSED:
+            return 0.0
+        return max(0.0, self.__next_probe_at - self.__clock())
+
+    def allow(self) -> bool:
+        """Whether a request may be sent now, a request let through while the breaker isn't closed is a probe."""
+        if self.__state == CircuitState.CLOSED:
+            return True
+        now = self.__clock()
+        if now < self.__next_probe_at:
+            self.stats.rejected += 1
+            return False
+        self.__state = CircuitState.HALF_OPEN
+        self.__next_probe_at = now + self.reset_timeout
+        return True
+
+    def record_success(self) -> None:
+        self.__failures = 0
+        self.__state = CircuitState.CLOSED
+
+    def record_failure(self) -> None:
+        self.__failures += 1
+        if self.__state == CircuitState.HALF_OPEN or (
+            self.__state == CircuitState.CLOSED and self.__failures >= self.failure_threshold
+        ):
+            self.__state = CircuitState.OPEN
+            self.__next_probe_at = self.__clock() + self.reset_timeout
+            self.stats.opened += 1
+
+
+@dataclass
+class ResilienceStats:
+    requests: int = 0
+    retries: int = 0
+    hedged: int = 0
+    hedge_wins: int = 0
+    hedges_not_admitted: int = 0
+    timeouts: int = 0
+    failures: int = 0
+
+
+class ElasticsearchResilience:
+    """
+    Sends the requests of one index with a timeout derived from the observed latencies of their operation,
+    hedges slow reads and feeds the outcome into the circuit breaker of the cluster.
+
+    A read that is still running after the p95 of its operation gets a duplicate with a random `preference`,
+    which routes it to a random copy of every shard, and the transport sends it to the next node of its pool.
+    The first answer wins and the other request is cancelled. Hedges are limited to ES_HEDGE_BUDGET of the
+    requests, so the extra load stays bounded when the whole cluster is slow rather than a single copy. A hedge
+    also needs an admission slot of the lane that is free right now, it is dropped rather than queued.
+
+    Args:
+        index (str): alias the requests are sent to, used in error messages
+        breaker (CircuitBreaker): breaker shared by all indices of the cluster
+        client: returns the client the requests are sent with, replaced in tests
+    """
+
+    def __init__(
+        self,
+        index: str,
+        breaker: CircuitBreaker,
+        client: Callable[[], AsyncElasticsearch] = get_elasticsearch,
+    ) -> None:
+        self.index = index
+        self.breaker = breaker
+        self.__client = client
+        self.stats: dict[str, ResilienceStats] = {}
+        self.__latencies: dict[str, LatencyWindow] = {}
+        self.__hedge_tokens = float(HEDGE_BURST)
+
+    def latencies(self, operation: str) -> LatencyWindow:
+        latencies = self.__latencies.get(operation)
+        if latencies is None:
+            latencies = self.__latencies[operation] = LatencyWindow(ES_LATENCY_WINDOW)
+            self.stats[operation] = ResilienceStats()
+        return latencies
+
+    def timeout(self, operation: str) -> float:
+        """Seconds the next request of the operation may take, ES_REQUEST_TIMEOUT until enough were observed."""
+        latencies = self.latencies(operation)
+        if len(latencies) < ES_LATENCY_MIN_SAMPLES:
+            return ES_REQUEST_TIMEOUT
+        return min(ES_REQUEST_TIMEOUT, max(ES_MIN_TIMEOUT, latencies.percentile(0.99) * ES_TIMEOUT_P99_MULTIPLIER))
+
+    def hedge_delay(self, operation: str) -> float | None:
+        """Seconds after which the next request of the operation is hedged, None if it isn't."""
+        latencies = self.latencies(operation)
+        if not ES_HEDGE_ENABLED or len(latencies) < ES_LATENCY_MIN_SAMPLES:
+            return None
+        # A probe decides whether the breaker closes, a duplicate would only add load to a struggling cluster
+        if self.breaker.state != CircuitState.CLOSED:
+            return None
+        return max(ES_HEDGE_MIN_DELAY, latencies.percentile(0.95))
+
+    async def call(self, operation: str, send: SendRequest, *, hedge: bool = True) -> ObjectApiResponse:
+        """
+        Sends a request of the operation unless the circuit breaker is open, once the admission control
+        gave it a slot of the lane of the current request, see `api.lib.elasticsearch.admission`.
+
+        Args:
+            operation (str): name of the operation, e.g. "search", latencies are tracked per operation
+            send: sends the request with the given client and preference
+            hedge (bool): whether the request may be sent twice, only for reads that don't depend on a
+                point in time or scroll
+
+        Returns:
+            ObjectApiResponse: the first answer
+
+        Raises:
+            SearchUnavailableError: if the breaker is open, or elasticsearch can't be reached, is overloaded or failed
+            SearchTimeoutError: if elasticsearch didn't answer within the timeout of the operation
+            SearchOverloadedError: if the request was shed because too many requests wait for elasticsearch
+        """
+        if not self.breaker.allow():
+            raise SearchUnavailableError(
+                f"Elasticsearch is unavailable, the circuit breaker is open for {self.breaker.retry_after:.1f}s",
+                retry_after=self.breaker.retry_after,
+            )
+
+        async with get_admission_controller().admit():
+            return await self.__send(operation, send, hedge)
+
+    async def __send(self, operation: str, send: SendRequest, hedge: bool) -> ObjectApiResponse:
+        timeout = self.timeout(operation)
+        hedge_delay = self.hedge_delay(operation) if hedge else None
+        stats = self.stats[operation]
+        stats.requests += 1
+        # The transport sends a single attempt, retries wait with backoff here and have to finish within the timeout
+        client = self.__client().options(request_timeout=timeout, max_retries=0)
+        try:
+            async with asyncio.timeout(timeout):
+                response = await self.__retry(operation, client, send, hedge_delay)
+        except TimeoutError as error:
+            stats.timeouts += 1
+            self.breaker.record_failure()
+            raise SearchTimeoutError(
+                f"Elasticsearch didn't answer the {operation} on '{self.index}' within {timeout:.3f}s"
+            ) from error
+        except Exception as error:
+            if not is_failure(error):
+                self.breaker.record_success()
+                raise
+            stats.failures += 1
+            self.breaker.record_failure()
+            raise SearchUnavailableError(
+                f"Elasticsearch failed the {operation} on '{self.index}': {error}",
+                retry_after=self.breaker.retry_after or 1.0,
+            ) from error
+        self.breaker.record_success()
+        return response
+
+    async def __retry(
+        self, operation: str, client: AsyncElasticsearch, send: SendRequest, hedge_delay: float | None
+    ) -> ObjectApiResponse:
+        for attempt in range(ES_MAX_RETRIES + 1):
+            if attempt:
+                # Retrying immediately would hammer a node that is already overloaded
+                await asyncio.sleep(retry_backoff(attempt))
+            try:
+                return await self.__race(operation, client, send, hedge_delay)
+            except Exception as error:
+                if attempt == ES_MAX_RETRIES or not is_retryable(error):
+                    raise
+                self.stats[operation].retries += 1
+
+    async def __race(
+        self, operation: str, client: AsyncElasticsearch, send: SendRequest, hedge_delay: float | None
+    ) -> ObjectApiResponse:
+        latencies = self.latencies(operation)
+        if hedge_delay is None:
+            return await self.__timed(latencies, send(client, None))
+
+        self.__hedge_tokens = min(HEDGE_BURST, self.__hedge_tokens + ES_HEDGE_BUDGET)
+        primary = asyncio.ensure_future(self.__timed(latencies, send(client, None)))
+        tasks = {primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=hedge_delay)
+            if done or self.__hedge_tokens < 1:
+                return await primary
+            # The hedge holds a slot of its own until it finished or was cancelled, but doesn't wait for one
+            release = get_admission_controller().try_admit()
+            if release is None:
+                self.stats[operation].hedges_not_admitted += 1
+                return await primary
+
+            self.__hedge_tokens -= 1
+            self.stats[operation].hedged += 1
+            hedge = asyncio.ensure_future(self.__timed(latencies, send(client, f"hedge-{random.getrandbits(32):08x}")))
+            hedge.add_done_callback(lambda _: release())
+            tasks.add(hedge)
+            pending = set(tasks)
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                # An answer of either request wins, a failure only counts once the other request failed too
+                for task in done:
+                    if task.exception() is None or not is_failure(task.exception()):
+                        if task is hedge:
+                            self.stats[operation].hedge_wins += 1
+                        return task.result()
+                if not pending:
+                    return done.pop().result()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    @staticmethod
+    async def __timed(latencies: LatencyWindow, request: Awaitable[ObjectApiResponse]) -> ObjectApiResponse:
+        start = time.perf_counter()
+        response = await request
+        latencies.record(time.perf_counter() - start)
+        return response
+
+
+_circuit_breaker: CircuitBreaker | None = None
+_resiliences: dict[str, ElasticsearchResilience] = {}
+
+
+def get_circuit_breaker() -> CircuitBreaker:
+    """Returns the breaker of the cluster, all indices share it since they share the nodes."""
+    global _circuit_breaker
+    if _circuit_breaker is None:
+        _circuit_breaker = CircuitBreaker(
+            failure_threshold=ES_BREAKER_FAILURE_THRESHOLD, reset_timeout=ES_BREAKER_RESET_SECONDS
+        )
+    return _circuit_breaker
+
+
+def get_resilience(index: str) -> ElasticsearchResilience:
+    """Returns the process wide latencies and hedging state of the given index."""
+    if index not in _resiliences:
+        _resiliences[index] = ElasticsearchResilience(index, get_circuit_breaker())
+    return _resiliences[index]
+
+
+def get_resiliences() -> dict[str, ElasticsearchResilience]:
+    """Returns the resilience state of all indices that were used so far, keyed by index."""
+    return dict(_resiliences)
+
+
+@dataclass
+class StaleResultStats:
+    served: int = 0
+    missing: int = 0
+
+
+class StaleResults:
+    """
+    The last successful result of every key, served in place of a fresh one while elasticsearch is unavailable.
+    Entries are evicted in LRU order once `max_size` is reached and aren't served once they are older than
+    `max_age`. Results are shared between callers and must not be mutated.
+
+    Args:
+        max_size (int): maximum number of kept results, 0 disables serving stale results
+        max_age (float): seconds a result may be served after it was fetched
+    """
+
+    def __init__(self, *, max_size: int, max_age: float) -> None:
+        self.max_size = max_size
+        self.max_age = max_age
+        self.stats = StaleResultStats()
+        self.__results: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.__results)
+
+    async def get(self, key: Hashable, *, fetch: Callable[[], Awaitable[T]]) -> T:
+        """
+        Returns the result of `fetch()` and keeps it. If elasticsearch is unavailable the kept result of the key
+        is returned instead and the response is marked as degraded. Requests shed by the admission control aren't
+        answered from the kept results, the client has to get the 429 to back off.
+
+        Args:
+            key (Hashable): identifies requests with the same result
+            fetch: coroutine function fetching a fresh result
+
+        Raises:
+            SearchUnavailableError: if elasticsearch is unavailable and there is no result to fall back to
+            SearchOverloadedError: if the request was shed by the admission control
+        """
+        if self.max_size <= 0:
+            return await fetch()
+
+        try:
+            result = await fetch()
+        except SearchOverloadedError:
+            raise
+        except SearchUnavailableError:
+            kept = self.__results.get(key)
+            if kept is None or kept[0] + self.max_age <= time.monotonic():
+                self.stats.missing += 1
+                raise
+            self.stats.served += 1
+            mark_degraded()
+            return kept[1]
+
+        self.__results[key] = (time.monotonic(), result)
+        self.__results.move_to_end(key)
+        while len(self.__results) > self.max_size:
+            self.__results.popitem(last=False)
+        return result
+
+    def clear(self) -> None:
+        self.__results.clear()
+
+
+_stale_results: dict[str, StaleResults] = {}
+
+
+def get_stale_results(name: str) -> StaleResults:
+    """
+    Returns the process wide stale results of the given name.
+
+    Args:
+        name (str): name of the results, e.g. "matching_jobs"
+    """
+    if name not in _stale_results:
+        _stale_results[name] = StaleResults(max_size=STALE_RESULTS_MAX_SIZE, max_age=STALE_RESULTS_MAX_AGE_SECONDS)
+    return _stale_results[name]
+
+
+def get_all_stale_results() -> dict[str, StaleResults]:
+    """Returns all stale results that were used so far, keyed by name."""
+    return dict(_stale_results)
+
+
+def mark_degraded() -> None:
+    """Marks the response of the current request as degraded, see DegradedResponseMiddleware."""
+    degraded = _degraded.get()
+    if degraded is not None:
+        degraded[0] = True
+
+
+class DegradedResponseMiddleware:
+    """
+    ASGI middleware adding the `X-Degraded: stale` header to responses that were served from stale results
+    because elasticsearch was unavailable, so clients can tell them apart from fresh ones. Their caching
+    headers are replaced by `Cache-Control: no-store`.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        degraded = [False]
+        token = _degraded.set(degraded)
+
+        async def send_with_degraded_header(message: Message) -> None:
+            if message["type"] == "http.response.start" and degraded[0]:
+                # A stale result must neither be cached nor be revalidated with the ETag of the current version
+                headers = [(name, value) for name, value in message.get("headers", []) if name not in _CACHE_HEADERS]
+                message["headers"] = [
+                    *headers,
+                    (DEGRADED_HEADER.lower().encode(), b"stale"),
+                    (b"cache-control", b"no-store"),
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_degraded_header)
+        finally:
+            _degraded.reset(token)
+
+
+async def search_unavailable_handler(request: Request, error: SearchUnavailableError) -> ORJSONResponse:
+    """
+    Answers with a 504 if elasticsearch timed out, a 429 if the request was shed by the admission control and a 503
+    otherwise, all tell the client when to retry.
+    """
+    status_code = 503
+    if isinstance(error, SearchTimeoutError):
+        status_code = 504
+    elif isinstance(error, SearchOverloadedError):
+        status_code = 429
+    return ORJSONResponse(
+        status_code=status_code,
+        content={"detail": str(error)},
+        headers={"Retry-After": str(max(1, math.ceil(error.retry_after)))},
+    )
@@ -0,0 +1,90 @@
+import json
+import os
+import zlib
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+# Same dictionary and levels as the enrichment of the seeder, see seed_image/enrichment.py.
+# api/tests/test_enrichment.py asserts both enrich the seed data identically
+SKILL_DICTIONARY_PATH = Path(
+    os.getenv("SKILL_DICTIONARY_PATH", Path(__file__).parents[2] / "seed_image" / "data" / "skill_dictionary.json")
+)
+UNKNOWN_SKILL_ID_OFFSET = 1 << 30
+SENIORITY_LEVELS = {"none": 0, "junior": 1, "midlevel": 2, "senior": 3}
+# How many levels below or above the seniority of a job a candidate may be, e.g. SENIORITY_LEVELS_BELOW=1
+# lets senior jobs accept midlevel candidates. Precomputed matches have to be computed with the same values
+SENIORITY_LEVELS_BELOW = int(os.getenv("SENIORITY_LEVELS_BELOW", "0"))
+SENIORITY_LEVELS_ABOVE = int(os.getenv("SENIORITY_LEVELS_ABOVE", "0"))
+
+SKILL_ID_FIELDS = {"top_skills": "top_skill_ids", "other_skills": "other_skill_ids"}
+
+
+def _normalize(name: str) -> str:
+    return " ".join(name.lower().split())
+
+
+class Enricher:
+    """
+    Adds the skill ids and seniority levels the seeder adds at ingest to documents that are read
+    from the data files directly, i.e. by the in memory backend.
+
+    Args:
+        dictionary_path (Path): the skill dictionary, a JSON array of {"id", "name", "synonyms"} entries
+    """
+
+    def __init__(self, dictionary_path: Path = SKILL_DICTIONARY_PATH) -> None:
+        with open(dictionary_path, encoding="utf-8") as file_pointer:
+            entries = json.load(file_pointer)
+        self.skill_ids = {
+            _normalize(name): entry["id"] for entry in entries for name in [entry["name"], *entry.get("synonyms", [])]
+        }
+        self.skill_names = {entry["id"]: entry["name"] for entry in entries}
+
+    def skill_id(self, skill: str) -> int:
+        name = _normalize(skill)
+        skill_id = self.skill_ids.get(name)
+        if skill_id is None:
+            skill_id = UNKNOWN_SKILL_ID_OFFSET + zlib.crc32(name.encode("utf-8")) % UNKNOWN_SKILL_ID_OFFSET
+        return skill_id
+
+    def skill_name(self, skill_id: int) -> str | None:
+        """Returns the name of a skill of the dictionary, None for the ids of unknown skills, they can't be reversed."""
+        return self.skill_names.get(skill_id)
+
+    def enrich(self, source: dict) -> dict:
+        for field, enriched_field in SKILL_ID_FIELDS.items():
+            if field in source:
+                source[enriched_field] = list(dict.fromkeys(self.skill_id(skill) for skill in source[field] or []))
+        if "seniority" in source:
+            source["seniority_level"] = seniority_level(source["seniority"])
+        if "seniorities" in source:
+            levels = (seniority_level(seniority) for seniority in source["seniorities"] or [])
+            source["seniority_levels"] = sorted({level for level in levels if level is not None})
+        return source
+
+
+def seniority_level(seniority: str | None) -> int | None:
+    return None if seniority is None else SENIORITY_LEVELS.get(_normalize(seniority))
+
+
+def accepting_job_levels(candidate_level: int) -> dict:
+    """Returns the range of the seniority levels of the jobs that accept a candidate of the given level."""
+    return {"gte": candidate_level - SENIORITY_LEVELS_ABOVE, "lte": candidate_level + SENIORITY_LEVELS_BELOW}
+
+
+def accepted_candidate_levels(job_level: int) -> dict:
+    """Returns the range of the seniority levels of the candidates a job of the given level accepts."""
+    return {"gte": job_level - SENIORITY_LEVELS_BELOW, "lte": job_level + SENIORITY_LEVELS_ABOVE}
+
+
+_enricher: Enricher | None = None
+
+
+def get_enricher() -> Enricher:
+    """Returns the enricher of the process, the skill dictionary is only read once."""
+    global _enricher
+    if _enricher is None:
+        _enricher = Enricher()
+    return _enricher
@@ -0,0 +1,51 @@
+import json
+import os
+from typing import AsyncIterator
+
+from dotenv import load_dotenv
+from fastapi.responses import StreamingResponse
+
+load_dotenv(override=True)
+# Number of slices fetched concurrently and hits per request when exporting all matches
+EXPORT_SLICES = int(os.getenv("EXPORT_SLICES", "4"))
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "1000"))
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+CSV_MEDIA_TYPE = "text/csv"
+
+
+def streaming_export_response(
+    rows: AsyncIterator[dict], *, fields: list[str], accept: str | None, filename: str
+) -> StreamingResponse:
+    """
+    Streams the given rows as NDJSON, or as CSV if the client accepts text/csv.
+    Rows are encoded and written one by one as they are produced, they are never collected.
+
+    Args:
+        rows (AsyncIterator[dict]): rows to export
+        fields (list[str]): keys of the rows, in the order of the CSV columns
+        accept (str | None): Accept header of the request
+        filename (str): file name without extension suggested to the client
+    """
+    if accept and CSV_MEDIA_TYPE in accept and NDJSON_MEDIA_TYPE not in accept:
+        return StreamingResponse(
+            _csv_lines(rows, fields),
+            media_type=CSV_MEDIA_TYPE,
+            headers={"Content-Disposition": f'attachment; filename="{filename}.csv"'},
+        )
+    return StreamingResponse(
+        _ndjson_lines(rows),
+        media_type=NDJSON_MEDIA_TYPE,
+        headers={"Content-Disposition": f'attachment; filename="{filename}.ndjson"'},
+    )
+
+
+async def _ndjson_lines(rows: AsyncIterator[dict]) -> AsyncIterator[str]:
+    async for row in rows:
+        yield json.dumps(row, separators=(",", ":")) + "\n"
+
+
+async def _csv_lines(rows: AsyncIterator[dict], fields: list[str]) -> AsyncIterator[str]:
+    yield ",".join(fields) + "\n"
+    async for row in rows:
+        yield ",".join(str(row[field]) for field in fields) + "\n"
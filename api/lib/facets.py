@@ -0,0 +1,154 @@
+import os
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Hashable, Iterable
+
+from dotenv import load_dotenv
+
+from api.lib.enrichment import SKILL_ID_FIELDS, get_enricher
+
+load_dotenv(override=True)
+# Most frequent terms returned per terms facet
+FACET_TERMS_SIZE = int(os.getenv("FACET_TERMS_SIZE", "20"))
+# Width of the buckets of the salary facet
+FACET_SALARY_INTERVAL = int(os.getenv("FACET_SALARY_INTERVAL", "10000"))
+# Facets of match sets kept per worker, 0 disables the cache
+FACET_CACHE_MAX_SIZE = int(os.getenv("FACET_CACHE_MAX_SIZE", "10000"))
+
+# Field every facet of MatchingFacet aggregates in the index the matches come from
+FACET_FIELDS = {
+    "jobs": {
+        "top_skills": SKILL_ID_FIELDS["top_skills"],
+        "other_skills": SKILL_ID_FIELDS["other_skills"],
+        "seniority": "seniorities",
+        "salary": "max_salary",
+    },
+    "candidates": {
+        "top_skills": SKILL_ID_FIELDS["top_skills"],
+        "other_skills": SKILL_ID_FIELDS["other_skills"],
+        "seniority": "seniority",
+        "salary": "salary_expectation",
+    },
+}
+# Facets counted per bucket of FACET_SALARY_INTERVAL instead of per term
+HISTOGRAM_FACETS = {"salary"}
+# Facets counted per skill id, so synonyms of a skill share a bucket, which is keyed by the name of the skill
+SKILL_FACETS = {"top_skills", "other_skills"}
+# The only parts of the aggregations the facets are read from, added to the filter_path of the matching search
+FACET_FILTER_PATH = ["aggregations.*.buckets.key", "aggregations.*.buckets.doc_count"]
+
+
+def build_facet_aggregations(index: str, facets: Iterable[str]) -> dict:
+    """
+    Returns the "aggs" that compute the given facets over all documents of the index a matching query matches,
+    one aggregation per facet named after it.
+
+    Args:
+        index (str): "jobs" or "candidates", the index the matches come from
+        facets (Iterable[str]): values of MatchingFacet
+    """
+    aggregations = {}
+    for facet in facets:
+        field = FACET_FIELDS[index][facet]
+        if facet in HISTOGRAM_FACETS:
+            # Without min_doc_count elasticsearch adds every empty bucket between the lowest and the highest salary
+            aggregations[facet] = {"histogram": {"field": field, "interval": FACET_SALARY_INTERVAL, "min_doc_count": 1}}
+        else:
+            aggregations[facet] = {"terms": {"field": field, "size": FACET_TERMS_SIZE}}
+    return aggregations
+
+
+def extract_facets(response: dict, facets: Iterable[str]) -> dict[str, list[dict]]:
+    """
+    Extracts the buckets of every facet from a search response with the aggregations of `build_facet_aggregations`.
+    Skill ids are mapped back to the names of the skill dictionary, unknown skills keep their id. Other terms are
+    lowercased by the normalizer of the fields, histogram keys are the lower bounds of the buckets.
+
+    Args:
+        response (dict): An elasticsearch response, filtered with FACET_FILTER_PATH or not
+
+    Returns:
+        dict[str, list[dict]]: "key" and "doc_count" of the buckets of every facet, the filter_path leaves out
+            facets without buckets, they get an empty list
+    """
+    aggregations = response.get("aggregations", {})
+    result = {}
+    for facet in facets:
+        buckets = aggregations.get(facet, {}).get("buckets", [])
+        if facet in HISTOGRAM_FACETS:
+            # Elasticsearch returns histogram keys as floats even for integer fields
+            buckets = [{"key": int(bucket["key"]), "doc_count": bucket["doc_count"]} for bucket in buckets]
+        elif facet in SKILL_FACETS:
+            enricher = get_enricher()
+            buckets = [
+                {"key": enricher.skill_name(bucket["key"]) or bucket["key"], "doc_count": bucket["doc_count"]}
+                for bucket in buckets
+            ]
+        result[facet] = [{"key": bucket["key"], "doc_count": bucket["doc_count"]} for bucket in buckets]
+    return result
+
+
+@dataclass
+class FacetCacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+
+class FacetCache:
+    """
+    Bounded in-process cache for the facets of match sets. The key holds the version of everything a match set
+    is computed from, see e.g. `CandidateRepository.get_matching_jobs_version`, so entries never have to be
+    invalidated: once a document changes its entries aren't requested anymore and are evicted in LRU order once
+    `max_size` is reached. Facets are shared between callers and must not be mutated.
+
+    Args:
+        max_size (int): maximum number of cached facets, 0 disables the cache
+    """
+
+    def __init__(self, *, max_size: int) -> None:
+        self.max_size = max_size
+        self.stats = FacetCacheStats()
+        self.__entries: OrderedDict[Hashable, dict[str, list[dict]]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+    def get(self, key: Hashable) -> dict[str, list[dict]] | None:
+        """Returns the cached facets of the key, None if they have to be aggregated."""
+        facets = self.__entries.get(key)
+        if facets is None:
+            self.stats.misses += 1
+            return None
+        self.stats.hits += 1
+        self.__entries.move_to_end(key)
+        return facets
+
+    def put(self, key: Hashable, facets: dict[str, list[dict]]) -> None:
+        if self.max_size <= 0:
+            return
+        self.__entries[key] = facets
+        self.__entries.move_to_end(key)
+        while len(self.__entries) > self.max_size:
+            self.__entries.popitem(last=False)
+            self.stats.evictions += 1
+
+
+_facet_caches: dict[str, FacetCache] = {}
+
+
+def get_facet_cache(name: str) -> FacetCache:
+    """
+    Returns the process wide facet cache of the given name.
+
+    Args:
+        name (str): name of the cache, e.g. "matching_jobs"
+    """
+    if name not in _facet_caches:
+        _facet_caches[name] = FacetCache(max_size=FACET_CACHE_MAX_SIZE)
+    return _facet_caches[name]
+
+
+def get_facet_caches() -> dict[str, FacetCache]:
+    """Returns the facet caches that were used so far, keyed by name."""
+    return dict(_facet_caches)
@@ -0,0 +1,46 @@
+import hashlib
+import os
+from typing import Any
+
+from dotenv import load_dotenv
+from fastapi import Response
+
+load_dotenv(override=True)
+# Cache-Control of GET /jobs/{id} and GET /candidates/{id}, documents rarely change
+ENTITY_CACHE_CONTROL = os.getenv("ENTITY_CACHE_CONTROL", "public, max-age=60, stale-while-revalidate=300")
+# Cache-Control of the matching routes, their results also change when any document of the other index changes
+MATCHES_CACHE_CONTROL = os.getenv("MATCHES_CACHE_CONTROL", "public, max-age=30, stale-while-revalidate=60")
+
+
+def make_etag(*parts: Any) -> str:
+    """
+    Returns a strong ETag for a response that only depends on the given parts, e.g. the version of a document
+    and the request parameters. The parts are hashed, so no index names or versions leak into the header.
+    """
+    return '"{}"'.format(hashlib.blake2b(repr(parts).encode(), digest_size=16).hexdigest())
+
+
+def is_not_modified(if_none_match: str | None, etag: str) -> bool:
+    """
+    Whether the client already has the representation with the given ETag, according to its If-None-Match header.
+    If-None-Match is compared weakly, so `W/"..."` sent back by a compressing proxy matches as well.
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+def set_cache_headers(response: Response, etag: str | None, cache_control: str) -> None:
+    """Sets ETag and Cache-Control, a response without an ETag couldn't be revalidated and isn't cached."""
+    if etag is None:
+        response.headers["Cache-Control"] = "no-store"
+        return
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = cache_control
+
+
+def not_modified_response(etag: str, cache_control: str) -> Response:
+    """Returns a 304 without body, it repeats the headers a 200 would have had for caches to refresh them."""
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control})
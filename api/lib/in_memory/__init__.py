@@ -0,0 +1 @@
+from api.lib.in_memory.in_memory_client import InMemorySearchClient as InMemorySearchClient
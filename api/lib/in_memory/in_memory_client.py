@@ -0,0 +1,223 @@
+import asyncio
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import AsyncIterator
+
+import orjson
+from dotenv import load_dotenv
+from elastic_transport import ApiResponseMeta, HttpHeaders, NodeConfig, ObjectApiResponse
+
+from api.lib.elasticsearch import ElasticsearchClient
+from api.lib.elasticsearch.exceptions import IDNotFoundError, UnsupportedSearchError
+from api.lib.enrichment import Enricher
+from api.lib.in_memory.in_memory_index import InMemoryIndex
+from api.lib.search_backend import SearchBackend
+
+load_dotenv(override=True)
+# "files" loads the seed data files, "elasticsearch" scrolls through the elasticsearch index
+IN_MEMORY_DATA_SOURCE = os.getenv("IN_MEMORY_DATA_SOURCE", "files")
+IN_MEMORY_DATA_PATH = Path(os.getenv("IN_MEMORY_DATA_PATH", Path(__file__).parents[3] / "seed_image" / "data"))
+
+_IN_MEMORY_RESPONSE_META = ApiResponseMeta(
+    status=200,
+    http_version="1.1",
+    headers=HttpHeaders(),
+    duration=0.0,
+    node=NodeConfig(scheme="memory", host="localhost", port=0),
+)
+
+
+class InMemorySearchClient(SearchBackend):
+    """
+    Search backend that holds all documents of an index in memory and matches them in process,
+    as alternative to the ElasticsearchClient for catalogues that comfortably fit into RAM.
+    The index is loaded on first use, see `load_in_memory_index`.
+
+    Args:
+        index (str): "candidates" or "jobs"
+    """
+
+    supports_knn_search = False
+
+    async def get_entity(
+        self,
+        *,
+        id: int,
+        source_includes: list[str] | None = None,
+    ) -> dict:
+        entity = (await load_in_memory_index(self.index)).get(id)
+        if entity is None:
+            raise IDNotFoundError("ID '{}' was not found in the index '{}'.".format(id, self.index))
+        if source_includes is None:
+            return dict(entity)
+        return {field: entity[field] for field in source_includes if field in entity}
+
+    async def get_entities(
+        self,
+        *,
+        ids: list[int],
+    ) -> dict[int, dict]:
+        index = await load_in_memory_index(self.index)
+        return {id: dict(entity) for id in ids if (entity := index.get(id)) is not None}
+
+    async def get_entity_with_version(self, *, id: int) -> tuple[dict, str]:
+        entity = await self.get_entity(id=id)
+        return entity, hashlib.blake2b(orjson.dumps(entity, option=orjson.OPT_SORT_KEYS), digest_size=16).hexdigest()
+
+    async def get_generation(self) -> str:
+        await load_in_memory_index(self.index)
+        return _in_memory_generations[self.index]
+
+    # The responses are built in process, so filter_path wouldn't save anything and is ignored
+    async def search(self, query: dict, return_source=False, filter_path: list[str] | None = None) -> ObjectApiResponse:
+        return ObjectApiResponse(body=await self._search(query, return_source), meta=_IN_MEMORY_RESPONSE_META)
+
+    async def multi_search(
+        self, *, queries: list[dict], return_source=False, filter_path: list[str] | None = None
+    ) -> list[dict]:
+        responses = []
+        for query in queries:
+            try:
+                responses.append(await self._search(query, return_source))
+            except UnsupportedSearchError as error:
+                responses.append({"error": str(error), "status": 400})
+        return responses
+
+    async def search_page(
+        self,
+        *,
+        query: dict,
+        size: int,
+        pit_id: str | None = None,
+        search_after: list | None = None,
+    ) -> dict:
+        # The in memory index never changes after loading, so it is its own point in time
+        index = await load_in_memory_index(self.index)
+        _, top = index.search(
+            query.get("query", {"match_all": {}}),
+            size=size,
+            search_after=None if search_after is None else (search_after[0], search_after[1]),
+        )
+        return {
+            "took": 0,
+            "timed_out": False,
+            "pit_id": None,
+            "hits": {
+                "hits": [
+                    {"_index": self.index, "_id": str(id), "_score": score, "sort": [score, id]} for id, score in top
+                ]
+            },
+        }
+
+    async def iter_sliced_hits(self, *, query: dict, slices: int, page_size: int) -> AsyncIterator[dict]:
+        # Everything is in memory already, so there is nothing to fetch concurrently
+        index = await load_in_memory_index(self.index)
+        for id, score in index.iter_matches(query.get("query", {"match_all": {}})):
+            yield {"_index": self.index, "_id": str(id), "_score": score}
+
+    async def ensure_search_template(self, *, id: str, source: str) -> None:
+        raise UnsupportedSearchError("The in memory backend doesn't support search templates.")
+
+    async def search_template(
+        self, *, id: str, params: dict, filter_path: list[str] | None = None
+    ) -> ObjectApiResponse:
+        raise UnsupportedSearchError("The in memory backend doesn't support search templates.")
+
+    async def knn_search(
+        self,
+        *,
+        field: str,
+        query_vector: list[float],
+        k: int,
+        num_candidates: int,
+        filter: list[dict] | None = None,
+        source_includes: list[str] | None = None,
+    ) -> dict:
+        raise UnsupportedSearchError("The in memory backend doesn't support kNN searches.")
+
+    async def percolate(self, *, documents: list[dict], size: int) -> list[dict]:
+        raise UnsupportedSearchError("The in memory backend doesn't support percolator indices.")
+
+    async def _search(self, query: dict, return_source: bool | list[str]) -> dict:
+        # There is nothing to profile on the elasticsearch side, profiled requests only get the python profile
+        unsupported = set(query) - {"query", "size", "from", "profile", "aggs"}
+        if unsupported:
+            raise UnsupportedSearchError(f"The in memory backend doesn't support {sorted(unsupported)}.")
+
+        index = await load_in_memory_index(self.index)
+        total, top = index.search(
+            query.get("query", {"match_all": {}}), size=query.get("size", 10), from_=query.get("from", 0)
+        )
+        hits = []
+        for id, score in top:
+            hit = {"_index": self.index, "_id": str(id), "_score": score}
+            if isinstance(return_source, list):
+                source = index.get(id)
+                hit["_source"] = {field: source[field] for field in return_source if field in source}
+            elif return_source:
+                hit["_source"] = index.get(id)
+            hits.append(hit)
+
+        response = {
+            "took": 0,
+            "timed_out": False,
+            "hits": {
+                "total": {"value": total, "relation": "eq"},
+                "max_score": top[0][1] if top else None,
+                "hits": hits,
+            },
+        }
+        if "aggs" in query:
+            response["aggregations"] = index.aggregate(query.get("query", {"match_all": {}}), query["aggs"])
+        return response
+
+
+_in_memory_indices: dict[str, InMemoryIndex] = {}
+# The documents of an index never change once it is loaded, so the generation is the one of the data it was loaded from
+_in_memory_generations: dict[str, str] = {}
+_in_memory_index_locks: dict[str, asyncio.Lock] = {}
+
+
+async def load_in_memory_index(index: str) -> InMemoryIndex:
+    """
+    Returns the in memory index of the given name, loading it once per process from IN_MEMORY_DATA_SOURCE.
+
+    Args:
+        index (str): "candidates" or "jobs"
+
+    Raises:
+        UnsupportedSearchError: If there is no data file of the index, e.g. for the precomputed matches.
+    """
+    if index in _in_memory_indices:
+        return _in_memory_indices[index]
+
+    async with _in_memory_index_locks.setdefault(index, asyncio.Lock()):
+        if index not in _in_memory_indices:
+            if IN_MEMORY_DATA_SOURCE == "elasticsearch":
+                _in_memory_generations[index] = await ElasticsearchClient(index).get_generation()
+                documents = await _read_elasticsearch_index(index)
+            else:
+                path = IN_MEMORY_DATA_PATH / f"{index}.json"
+                if not path.is_file():
+                    raise UnsupportedSearchError(f"The in memory backend has no data for the {index} index.")
+                stat = path.stat()
+                _in_memory_generations[index] = f"{path.name}:{stat.st_size}:{stat.st_mtime_ns}"
+                documents = _read_data_file(path)
+            _in_memory_indices[index] = InMemoryIndex(documents)
+    return _in_memory_indices[index]
+
+
+def _read_data_file(path: Path) -> dict[int, dict]:
+    """
+    Reads a data file in the bulk action format of the seed image, a list of {"_id", "_source"} objects.
+    The documents are enriched like the seeder enriches them before indexing.
+    """
+    enricher = Enricher()
+    with open(path, encoding="utf-8") as file_pointer:
+        return {int(action["_id"]): enricher.enrich(action["_source"]) for action in json.load(file_pointer)}
+
+
+async def _read_elasticsearch_index(index: str) -> dict[int, dict]:
+    return {id: source async for id, source in ElasticsearchClient(index).scan_entities()}
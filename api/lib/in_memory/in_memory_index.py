@@ -0,0 +1,274 @@
+import heapq
+import itertools
+import math
+from bisect import bisect_left, bisect_right
+from typing import Callable, Iterator
+
+from api.lib.elasticsearch.exceptions import UnsupportedSearchError
+
+# BM25 parameters elasticsearch uses by default
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+class InMemoryIndex:
+    """
+    Holds all documents of one index in memory and evaluates the subset of the elasticsearch query DSL
+    that the repositories build: bool (must, should, filter), constant_score, term, terms, terms_set,
+    range, match_all and match_none.
+
+    String fields are lowercased like by the `lowercase` normalizer of the indices and kept in an inverted
+    index whose posting lists are bitsets (python ints, bit i = i-th document). Numeric fields are kept as
+    sorted arrays so range queries are two bisects.
+
+    Scoring mirrors elasticsearch for keyword fields: a term scores its BM25 weight with a term frequency of
+    one and no length norms, `idf * 1 / (1 + k1 * (1 - b + b / avgdl))`, where avgdl is the average number
+    of values per document in that field. terms_set sums the scores of the matching terms, bool sums its
+    must and should clauses, while terms, range, constant_score and match_all are constant score queries.
+    Ties are broken by id.
+
+    `aggregate` computes the terms and histogram aggregations of the matching facets from the same posting lists
+    and sorted columns, terms of numeric fields like the skill ids are counted from their columns.
+
+    Args:
+        documents (dict[int, dict]): documents keyed by their ID
+    """
+
+    def __init__(self, documents: dict[int, dict]) -> None:
+        self.ids = list(documents.keys())
+        self.sources = list(documents.values())
+        self.positions = {id: position for position, id in enumerate(self.ids)}
+        self.all_documents = (1 << len(self.ids)) - 1
+
+        self.postings: dict[str, dict[str, int]] = {}
+        self.numeric_columns: dict[str, tuple[list[float], list[int]]] = {}
+        self.field_doc_count: dict[str, int] = {}
+        self.field_value_count: dict[str, int] = {}
+
+        postings: dict[str, dict[str, bytearray]] = {}
+        numeric_values: dict[str, list[tuple[float, int]]] = {}
+        for position, source in enumerate(self.sources):
+            for field, value in source.items():
+                # Objects aren't searchable, like the disabled `matches` object of the precomputed matches
+                values = {
+                    v.lower() if isinstance(v, str) else v
+                    for v in (value if isinstance(value, list) else [value])
+                    if isinstance(v, (str, int, float))
+                }
+                if not values:
+                    continue
+                self.field_doc_count[field] = self.field_doc_count.get(field, 0) + 1
+                self.field_value_count[field] = self.field_value_count.get(field, 0) + len(values)
+                for v in values:
+                    if isinstance(v, str):
+                        bits = postings.setdefault(field, {}).setdefault(v, self._empty_bits())
+                        bits[position >> 3] |= 1 << (position & 7)
+                    elif isinstance(v, (int, float)):
+                        numeric_values.setdefault(field, []).append((v, position))
+
+        for field, terms in postings.items():
+            self.postings[field] = {term: int.from_bytes(bits, "little") for term, bits in terms.items()}
+        for field, pairs in numeric_values.items():
+            pairs.sort()
+            self.numeric_columns[field] = ([v for v, _ in pairs], [p for _, p in pairs])
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def get(self, id: int) -> dict | None:
+        position = self.positions.get(id)
+        return None if position is None else self.sources[position]
+
+    def search(
+        self,
+        query: dict,
+        size: int = 10,
+        from_: int = 0,
+        search_after: tuple[float, int] | None = None,
+    ) -> tuple[int, list[tuple[int, float]]]:
+        """
+        Returns the total number of matching documents and the top `size` of them as (id, score) pairs,
+        ordered by descending score and ascending id.
+
+        Args:
+            query (dict): query in the elasticsearch query DSL
+            size (int): number of hits to return
+            from_ (int): number of hits to skip
+            search_after (tuple[float, int] | None): only return hits that are ordered after this (score, id)
+        """
+        matches, score = self._evaluate(query)
+        scored = ((self.ids[position], score(position)) for position in _positions(matches))
+        if search_after is not None:
+            after = (-search_after[0], search_after[1])
+            scored = (hit for hit in scored if (-hit[1], hit[0]) > after)
+        top = heapq.nsmallest(from_ + size, scored, key=lambda hit: (-hit[1], hit[0]))[from_:]
+        return matches.bit_count(), top
+
+    def iter_matches(self, query: dict) -> Iterator[tuple[int, float]]:
+        """
+        Iterates over all matching documents as (id, score) pairs in insertion order.
+        """
+        matches, score = self._evaluate(query)
+        for position in _positions(matches):
+            yield self.ids[position], score(position)
+
+    def aggregate(self, query: dict, aggregations: dict) -> dict:
+        """
+        Computes aggregations over all documents matching the query, in the format of the "aggregations" of an
+        elasticsearch response. Terms buckets are ordered by descending count and ascending term, histogram buckets
+        by key and only hold keys with documents, like with a min_doc_count of 1.
+
+        Args:
+            query (dict): query in the elasticsearch query DSL
+            aggregations (dict): "aggs" of the search request, of terms (field, size) and histogram (field, interval)
+
+        Raises:
+            UnsupportedSearchError: If an aggregation is of another type.
+        """
+        matches, _ = self._evaluate(query)
+        matched = matches.to_bytes(len(self._empty_bits()), "little")
+        result = {}
+        for name, aggregation in aggregations.items():
+            ((kind, body),) = aggregation.items()
+            if kind == "terms":
+                counts = (
+                    (term, (bits & matches).bit_count()) for term, bits in self.postings.get(body["field"], {}).items()
+                )
+                if body["field"] in self.numeric_columns:
+                    # Numeric terms like skill ids have no posting lists, they are counted from their sorted column
+                    values, positions = self.numeric_columns[body["field"]]
+                    numeric_counts: dict[float, int] = {}
+                    for value, position in zip(values, positions):
+                        if matched[position >> 3] >> (position & 7) & 1:
+                            numeric_counts[value] = numeric_counts.get(value, 0) + 1
+                    counts = itertools.chain(counts, numeric_counts.items())
+                top = heapq.nsmallest(
+                    body.get("size", 10),
+                    (bucket for bucket in counts if bucket[1]),
+                    key=lambda bucket: (-bucket[1], bucket[0]),
+                )
+                result[name] = {"buckets": [{"key": term, "doc_count": count} for term, count in top]}
+            elif kind == "histogram":
+                interval = body["interval"]
+                values, positions = self.numeric_columns.get(body["field"], ([], []))
+                histogram: dict[float, int] = {}
+                for value, position in zip(values, positions):
+                    if matched[position >> 3] >> (position & 7) & 1:
+                        key = float(math.floor(value / interval) * interval)
+                        histogram[key] = histogram.get(key, 0) + 1
+                result[name] = {
+                    "buckets": [{"key": key, "doc_count": count} for key, count in sorted(histogram.items())]
+                }
+            else:
+                raise UnsupportedSearchError(f"The in memory backend doesn't support {kind} aggregations.")
+        return result
+
+    def _evaluate(self, query: dict) -> tuple[int, Callable[[int], float]]:
+        """
+        Evaluates a query once and returns the bitset of the matching documents together with a function
+        that scores a matching document by its position.
+        """
+        ((kind, body),) = query.items()
+
+        if kind == "match_all":
+            return self.all_documents, _constant(1.0)
+        if kind == "match_none":
+            return 0, _constant(0.0)
+        if kind == "constant_score":
+            matches, _ = self._evaluate(body["filter"])
+            return matches, _constant(body.get("boost", 1.0))
+        if kind == "bool":
+            return self._evaluate_bool(body)
+
+        ((field, argument),) = body.items()
+        if kind == "term":
+            term = argument["value"] if isinstance(argument, dict) else argument
+            return self._term(field, term), _constant(self._term_score(field, term))
+        if kind == "terms":
+            matches = 0
+            for term in argument:
+                matches |= self._term(field, term)
+            return matches, _constant(1.0)
+        if kind == "terms_set":
+            terms = [(self._term(field, term), self._term_score(field, term)) for term in set(argument["terms"])]
+            matches = self._match_at_least([bitset for bitset, _ in terms], argument["minimum_should_match"])
+            return matches, lambda position: sum(weight for bitset, weight in terms if bitset >> position & 1)
+        if kind == "range":
+            return self._range(field, argument), _constant(1.0)
+
+        raise UnsupportedSearchError(f"The in memory backend doesn't support '{kind}' queries.")
+
+    def _evaluate_bool(self, body: dict) -> tuple[int, Callable[[int], float]]:
+        required = [self._evaluate(clause) for clause in body.get("must", [])]
+        filters = [self._evaluate(clause)[0] for clause in body.get("filter", [])]
+        should = [self._evaluate(clause) for clause in body.get("should", [])]
+
+        matches = self.all_documents
+        for bitset in [bitset for bitset, _ in required] + filters:
+            matches &= bitset
+        if should:
+            minimum_should_match = body.get("minimum_should_match", 0 if required or filters else 1)
+            matches &= self._match_at_least([bitset for bitset, _ in should], minimum_should_match)
+
+        scoring = required + should
+        return matches, lambda position: sum(score(position) for bitset, score in scoring if bitset >> position & 1)
+
+    def _term(self, field: str, term) -> int:
+        if isinstance(term, str):
+            return self.postings.get(field, {}).get(term.lower(), 0)
+        return self._range(field, {"gte": term, "lte": term})
+
+    def _term_score(self, field: str, term) -> float:
+        doc_count = self.field_doc_count.get(field, 0)
+        term_doc_count = self._term(field, term).bit_count()
+        if not doc_count or not term_doc_count:
+            return 0.0
+        idf = math.log(1 + (doc_count - term_doc_count + 0.5) / (term_doc_count + 0.5))
+        average_values = self.field_value_count[field] / doc_count
+        return idf / (1 + BM25_K1 * (1 - BM25_B + BM25_B / average_values))
+
+    def _range(self, field: str, bounds: dict) -> int:
+        values, positions = self.numeric_columns.get(field, ([], []))
+        start, end = 0, len(values)
+        if "gte" in bounds:
+            start = max(start, bisect_left(values, bounds["gte"]))
+        if "gt" in bounds:
+            start = max(start, bisect_right(values, bounds["gt"]))
+        if "lte" in bounds:
+            end = min(end, bisect_right(values, bounds["lte"]))
+        if "lt" in bounds:
+            end = min(end, bisect_left(values, bounds["lt"]))
+
+        bits = self._empty_bits()
+        for position in positions[start:end]:
+            bits[position >> 3] |= 1 << (position & 7)
+        return int.from_bytes(bits, "little")
+
+    def _empty_bits(self) -> bytearray:
+        return bytearray((len(self.ids) + 7) // 8)
+
+    def _match_at_least(self, bitsets: list[int], minimum: int) -> int:
+        """Returns the documents that are set in at least `minimum` of the given bitsets."""
+        if not bitsets:
+            return 0
+        if minimum <= 0:
+            return self.all_documents
+        # counts[i] holds the documents that are set in more than i of the bitsets seen so far
+        counts = [0] * minimum
+        for bitset in bitsets:
+            for i in range(minimum - 1, 0, -1):
+                counts[i] |= counts[i - 1] & bitset
+            counts[0] |= bitset
+        return counts[minimum - 1]
+
+
+def _constant(score: float) -> Callable[[int], float]:
+    return lambda _: score
+
+
+def _positions(bitset: int) -> Iterator[int]:
+    for byte_index, byte in enumerate(bitset.to_bytes((bitset.bit_length() + 7) // 8, "little")):
+        while byte:
+            lowest = byte & -byte
+            yield byte_index * 8 + lowest.bit_length() - 1
+            byte ^= lowest
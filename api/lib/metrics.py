@@ -0,0 +1,368 @@
+import time
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Iterable
+
+from elastic_transport import ObjectApiResponse
+from elasticsearch import NotFoundError
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import REGISTRY, CounterMetricFamily, GaugeMetricFamily, HistogramMetricFamily
+from starlette.routing import BaseRoute, Route
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from api.lib.elasticsearch.admission import WAIT_BUCKETS, AdmissionLane, get_admission_controller
+from api.lib.elasticsearch.entity_cache import get_entity_caches
+from api.lib.elasticsearch.resilience import CircuitState, get_all_stale_results, get_circuit_breaker, get_resiliences
+from api.lib.facets import get_facet_caches
+from api.lib.singleflight import get_single_flights
+from api.lib.snapshot import get_snapshot_stores
+
+# Requests are labelled by status class instead of status code, so every label set is known upfront
+STATUS_CLASSES = ("1xx", "2xx", "3xx", "4xx", "5xx")
+# Label of requests that didn't match any route, e.g. 404s for unknown paths
+UNMATCHED_ROUTE = "<unmatched>"
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (128, 512, 2048, 8192, 32768, 131072, 524288, 2097152, 8388608)
+HIT_BUCKETS = (0, 1, 10, 25, 50, 100, 250, 1000)
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Time from receiving a request until its response is sent completely",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+HTTP_REQUEST_ELASTICSEARCH_DURATION = Histogram(
+    "http_request_elasticsearch_duration_seconds",
+    "Time a request spent waiting for elasticsearch end-to-end, including admission waits and retries, the rest is "
+    "spent in the API (validation, serialization, ...)",
+    ["method", "route"],
+    buckets=LATENCY_BUCKETS,
+)
+HTTP_REQUESTS_IN_PROGRESS = Gauge("http_requests_in_progress", "Requests currently being handled", ["method"])
+HTTP_RESPONSE_SIZE = Histogram(
+    "http_response_size_bytes", "Size of the response bodies", ["method", "route"], buckets=SIZE_BUCKETS
+)
+
+ES_REQUEST_DURATION = Histogram(
+    "elasticsearch_request_duration_seconds",
+    "End-to-end time of an elasticsearch operation as the API sees it: the wait for an admission slot, every "
+    "attempt with the backoff between retries, hedges, network and decoding. admission_wait_seconds has the wait",
+    ["index", "operation"],
+    buckets=LATENCY_BUCKETS,
+)
+ES_TOOK = Histogram(
+    "elasticsearch_took_seconds",
+    "Time elasticsearch reports it spent on a search operation (`took`)",
+    ["index", "operation"],
+    buckets=LATENCY_BUCKETS,
+)
+ES_HITS = Histogram(
+    "elasticsearch_hits", "Hits or documents returned per operation", ["index", "operation"], buckets=HIT_BUCKETS
+)
+ES_ERRORS = Counter("elasticsearch_errors", "Failed elasticsearch operations", ["index", "operation"])
+
+# Seconds the current request waited for elasticsearch, set by the MetricsMiddleware for every request
+_elasticsearch_seconds: ContextVar[list[float] | None] = ContextVar("elasticsearch_seconds", default=None)
+
+
+class RouteMetrics:
+    """The metric children of one method and route, resolved once so requests only look up this object"""
+
+    def __init__(self, method: str, route: str) -> None:
+        self.durations = {
+            status_class: HTTP_REQUEST_DURATION.labels(method, route, status_class) for status_class in STATUS_CLASSES
+        }
+        self.elasticsearch_duration = HTTP_REQUEST_ELASTICSEARCH_DURATION.labels(method, route)
+        self.response_size = HTTP_RESPONSE_SIZE.labels(method, route)
+
+
+_route_metrics: dict[tuple[str, str], RouteMetrics] = {}
+_in_progress: dict[str, Gauge] = {}
+
+
+def get_route_metrics(method: str, route: str) -> RouteMetrics:
+    route_metrics = _route_metrics.get((method, route))
+    if route_metrics is None:
+        route_metrics = _route_metrics[(method, route)] = RouteMetrics(method, route)
+    return route_metrics
+
+
+def preallocate_route_metrics(routes: Iterable[BaseRoute]) -> None:
+    """Creates the label sets of all routes upfront, called by the lifespan of the app on startup."""
+    for route in routes:
+        if isinstance(route, Route):
+            for method in route.methods or ():
+                get_route_metrics(method, route.path)
+                _in_progress.setdefault(method, HTTP_REQUESTS_IN_PROGRESS.labels(method))
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording latency, elasticsearch time, in flight requests and response size per route.
+    Routes are labelled by their path template (e.g. "/jobs/{id}"), so the number of label sets is bounded.
+    The route of a request is only known after the router matched it, so requests in flight are labelled
+    by method only.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+        size = 0
+        elasticsearch_seconds = [0.0]
+        token = _elasticsearch_seconds.set(elasticsearch_seconds)
+
+        async def send_with_metrics(message: Message) -> None:
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        method = scope["method"]
+        in_progress = _in_progress.get(method)
+        if in_progress is None:
+            in_progress = _in_progress[method] = HTTP_REQUESTS_IN_PROGRESS.labels(method)
+        in_progress.inc()
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            in_progress.dec()
+            _elasticsearch_seconds.reset(token)
+            route = scope.get("route")
+            route_metrics = get_route_metrics(method, route.path if isinstance(route, Route) else UNMATCHED_ROUTE)
+            route_metrics.durations[STATUS_CLASSES[min(status // 100, 5) - 1]].observe(time.perf_counter() - start)
+            route_metrics.elasticsearch_duration.observe(elasticsearch_seconds[0])
+            route_metrics.response_size.observe(size)
+
+
+class OperationMetrics:
+    """The metric children of one elasticsearch operation on one index"""
+
+    def __init__(self, index: str, operation: str) -> None:
+        self.duration = ES_REQUEST_DURATION.labels(index, operation)
+        self.took = ES_TOOK.labels(index, operation)
+        self.hits = ES_HITS.labels(index, operation)
+        self.errors = ES_ERRORS.labels(index, operation)
+
+    async def observe(
+        self, request: Awaitable[ObjectApiResponse], count_hits: Callable[[dict], int] | None = None
+    ) -> ObjectApiResponse:
+        """
+        Awaits an elasticsearch request and records its duration, the `took` of the response if there is one
+        and the number of hits counted by `count_hits`. Missing documents aren't errors.
+        """
+        start = time.perf_counter()
+        try:
+            response = await request
+        except NotFoundError:
+            raise
+        except Exception:
+            self.errors.inc()
+            raise
+        finally:
+            self.record_duration(time.perf_counter() - start)
+
+        body = response.body
+        if isinstance(body, dict):
+            if "took" in body:
+                self.took.observe(body["took"] / 1000)
+            if count_hits is not None:
+                self.hits.observe(count_hits(body))
+        return response
+
+    def record_duration(self, seconds: float) -> None:
+        self.duration.observe(seconds)
+        elasticsearch_seconds = _elasticsearch_seconds.get()
+        if elasticsearch_seconds is not None:
+            elasticsearch_seconds[0] += seconds
+
+
+class ElasticsearchMetrics:
+    """
+    The metric children of all elasticsearch operations on one index, e.g. `metrics.search.observe(...)`.
+
+    Args:
+        index (str): label of the index, the alias the client queries
+    """
+
+    def __init__(self, index: str) -> None:
+        self.get = OperationMetrics(index, "get")
+        self.mget = OperationMetrics(index, "mget")
+        self.search = OperationMetrics(index, "search")
+        self.msearch = OperationMetrics(index, "msearch")
+        self.search_template = OperationMetrics(index, "search_template")
+        self.knn_search = OperationMetrics(index, "knn_search")
+        self.percolate = OperationMetrics(index, "percolate")
+        self.search_page = OperationMetrics(index, "search_page")
+        self.sliced_search = OperationMetrics(index, "sliced_search")
+        self.open_point_in_time = OperationMetrics(index, "open_point_in_time")
+        self.close_point_in_time = OperationMetrics(index, "close_point_in_time")
+        self.index_stats = OperationMetrics(index, "index_stats")
+
+
+_elasticsearch_metrics: dict[str, ElasticsearchMetrics] = {}
+
+
+def get_elasticsearch_metrics(index: str) -> ElasticsearchMetrics:
+    """Returns the metrics of the given index, created once per process."""
+    if index not in _elasticsearch_metrics:
+        _elasticsearch_metrics[index] = ElasticsearchMetrics(index)
+    return _elasticsearch_metrics[index]
+
+
+def count_search_hits(body: dict) -> int:
+    return len(body.get("hits", {}).get("hits", ()))
+
+
+def count_msearch_hits(body: dict) -> int:
+    return sum(count_search_hits(response) for response in body.get("responses", ()))
+
+
+def count_found_documents(body: dict) -> int:
+    return sum(1 for doc in body.get("docs", ()) if doc.get("found"))
+
+
+class StatsCollector:
+    """
+    Exposes the counters the entity caches and snapshots, single-flight groups, the resilience layer, the
+    admission control and the facet caches keep anyway.
+    They are only read when /metrics is scraped, so the hot paths don't do any extra work for them.
+    """
+
+    def collect(self) -> Iterable[CounterMetricFamily | GaugeMetricFamily | HistogramMetricFamily]:
+        cache_events = CounterMetricFamily(
+            "entity_cache_events", "Lookups and maintenance events of the entity caches", labels=["index", "event"]
+        )
+        cache_size = GaugeMetricFamily("entity_cache_size", "Documents in the entity caches", labels=["index"])
+        for index, cache in get_entity_caches().items():
+            for event, value in vars(cache.stats).items():
+                cache_events.add_metric([index, event], value)
+            cache_size.add_metric([index], len(cache))
+
+        single_flight_calls = CounterMetricFamily(
+            "single_flight_calls", "Calls of the single-flight groups by outcome", labels=["group", "outcome"]
+        )
+        for name, single_flight in get_single_flights().items():
+            for outcome, value in vars(single_flight.stats).items():
+                single_flight_calls.add_metric([name, outcome], value)
+
+        resilience_events = CounterMetricFamily(
+            "elasticsearch_resilience_events",
+            "Requests, retries, hedges, hedges that answered first or got no admission slot, timeouts and failures, "
+            "see api.lib.elasticsearch.resilience",
+            labels=["index", "operation", "event"],
+        )
+        elasticsearch_timeout = GaugeMetricFamily(
+            "elasticsearch_adaptive_timeout_seconds",
+            "Timeout the next request of an operation gets, derived from its p99",
+            labels=["index", "operation"],
+        )
+        for index, resilience in get_resiliences().items():
+            for operation, stats in resilience.stats.items():
+                for event, value in vars(stats).items():
+                    resilience_events.add_metric([index, operation, event], value)
+                elasticsearch_timeout.add_metric([index, operation], resilience.timeout(operation))
+
+        breaker = get_circuit_breaker()
+        breaker_state = GaugeMetricFamily(
+            "elasticsearch_circuit_breaker_state", "1 for the current state of the circuit breaker", labels=["state"]
+        )
+        for state in CircuitState:
+            breaker_state.add_metric([state.value], 1 if breaker.state == state else 0)
+        breaker_events = CounterMetricFamily(
+            "elasticsearch_circuit_breaker_events", "Times the breaker opened or rejected a request", labels=["event"]
+        )
+        for event, value in vars(breaker.stats).items():
+            breaker_events.add_metric([event], value)
+
+        stale_results = CounterMetricFamily(
+            "stale_results",
+            "Stale results served or missing while elasticsearch was unavailable",
+            labels=["name", "outcome"],
+        )
+        for name, results in get_all_stale_results().items():
+            for outcome, value in vars(results.stats).items():
+                stale_results.add_metric([name, outcome], value)
+
+        snapshot_events = CounterMetricFamily(
+            "entity_snapshot_events",
+            "Lookups, reloads and failed reloads of the entity snapshots",
+            labels=["index", "event"],
+        )
+        snapshot_size = GaugeMetricFamily(
+            "entity_snapshot_size", "Documents in the current entity snapshots", labels=["index"]
+        )
+        for index, store in get_snapshot_stores().items():
+            for event, value in vars(store.stats).items():
+                snapshot_events.add_metric([index, event], value)
+            snapshot_size.add_metric([index], len(store.snapshot or ()))
+
+        admission = get_admission_controller()
+        admission_events = CounterMetricFamily(
+            "admission_events",
+            "Elasticsearch requests admitted, queued, rejected with a full queue or timed out waiting, per lane",
+            labels=["lane", "event"],
+        )
+        admission_queue_depth = GaugeMetricFamily(
+            "admission_queue_depth", "Elasticsearch requests waiting for a slot", labels=["lane"]
+        )
+        admission_in_flight = GaugeMetricFamily(
+            "admission_in_flight", "Elasticsearch requests holding a slot", labels=["lane"]
+        )
+        admission_wait = HistogramMetricFamily(
+            "admission_wait_seconds", "Time elasticsearch requests waited for a slot", labels=["lane"]
+        )
+        for lane in AdmissionLane:
+            stats = admission.stats(lane)
+            for event in ("admitted", "queued", "rejected", "timed_out"):
+                admission_events.add_metric([lane.value, event], getattr(stats, event))
+            admission_queue_depth.add_metric([lane.value], admission.queue_depth(lane))
+            admission_in_flight.add_metric([lane.value], admission.in_flight(lane))
+            cumulative, buckets = 0, []
+            for bound, count in zip([*map(str, WAIT_BUCKETS), "+Inf"], stats.wait_buckets):
+                cumulative += count
+                buckets.append((bound, cumulative))
+            admission_wait.add_metric([lane.value], buckets, sum_value=stats.wait_seconds)
+
+        facet_cache_events = CounterMetricFamily(
+            "facet_cache_events", "Lookups and evictions of the facet caches of the matches", labels=["name", "event"]
+        )
+        facet_cache_size = GaugeMetricFamily("facet_cache_size", "Match sets in the facet caches", labels=["name"])
+        for name, facet_cache in get_facet_caches().items():
+            for event, value in vars(facet_cache.stats).items():
+                facet_cache_events.add_metric([name, event], value)
+            facet_cache_size.add_metric([name], len(facet_cache))
+
+        return [
+            cache_events,
+            cache_size,
+            single_flight_calls,
+            resilience_events,
+            elasticsearch_timeout,
+            breaker_state,
+            breaker_events,
+            stale_results,
+            snapshot_events,
+            snapshot_size,
+            admission_events,
+            admission_queue_depth,
+            admission_in_flight,
+            admission_wait,
+            facet_cache_events,
+            facet_cache_size,
+        ]
+
+
+REGISTRY.register(StatsCollector())
+
+
+def render_metrics() -> tuple[bytes, str]:
+    """Returns all metrics of this process in the prometheus text format together with its content type."""
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -0,0 +1,71 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+# Has to be shared by all workers, otherwise a cursor is only valid on the worker that issued it
+CURSOR_SECRET = os.getenv("CURSOR_SECRET", "").encode() or secrets.token_bytes(32)
+
+
+class InvalidCursorError(Exception):
+    """
+    Raised when a cursor was tampered with or was issued for another resource.
+    """
+
+
+def encode_cursor(payload: dict) -> str:
+    """
+    Encodes the given payload into an opaque cursor signed with CURSOR_SECRET.
+
+    Args:
+        payload (dict): json serializable state needed to fetch the next page
+
+    Returns:
+        str: url safe cursor
+    """
+    data = json.dumps(payload, separators=(",", ":")).encode()
+    signature = hmac.new(CURSOR_SECRET, data, hashlib.sha256).digest()
+    return _b64encode(data) + "." + _b64encode(signature)
+
+
+def decode_cursor(cursor: str, *, resource: str) -> dict:
+    """
+    Verifies the signature of a cursor created by `encode_cursor` and returns its payload.
+
+    Args:
+        cursor (str): the cursor sent by the client
+        resource (str): the resource the cursor has to be issued for, stored under the "resource" key
+
+    Raises:
+        InvalidCursorError: If the signature doesn't match or the cursor belongs to another resource.
+
+    Returns:
+        dict: the payload
+    """
+    try:
+        encoded_data, encoded_signature = cursor.split(".")
+        data = _b64decode(encoded_data)
+        signature = _b64decode(encoded_signature)
+    except ValueError as error:
+        raise InvalidCursorError("Malformed cursor.") from error
+
+    if not hmac.compare_digest(signature, hmac.new(CURSOR_SECRET, data, hashlib.sha256).digest()):
+        raise InvalidCursorError("Invalid cursor signature.")
+
+    payload = json.loads(data)
+    if payload.get("resource") != resource:
+        raise InvalidCursorError("Cursor was issued for another resource.")
+    return payload
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
@@ -0,0 +1,127 @@
+import json
+import os
+import time
+import uuid
+from collections import OrderedDict
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+from dotenv import load_dotenv
+from pyinstrument import Profiler
+from pyinstrument.renderers import HTMLRenderer, SpeedscopeRenderer
+from pyinstrument.session import Session
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+load_dotenv(override=True)
+# Profiling needs this flag and the PROFILING_HEADER on a request, the middleware isn't even installed without it
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").strip().lower() in ("1", "true", "yes", "on")
+PROFILING_HEADER = "x-profile"
+PROFILE_REPORT_HEADER = "x-profile-report"
+# Seconds between two samples of the python stack
+PROFILING_INTERVAL = float(os.getenv("PROFILING_INTERVAL", "0.001"))
+# Reports kept per worker, the oldest are dropped first
+PROFILE_REPORTS_MAX_SIZE = int(os.getenv("PROFILE_REPORTS_MAX_SIZE", "20"))
+
+
+@dataclass
+class ProfileReport:
+    """
+    Everything recorded for one profiled request: the python samples and the profiles of the elasticsearch
+    searches the request issued.
+    """
+
+    id: str
+    method: str
+    path: str
+    duration: float = 0.0
+    session: Session | None = None
+    elasticsearch: list[dict] = field(default_factory=list)
+
+    def add_elasticsearch_profile(self, *, index: str, took: int | None, profile: dict | None) -> None:
+        """
+        Adds the `profile` section of a search response, flattened to the timing of every query clause.
+        """
+        clauses = []
+        for shard in (profile or {}).get("shards", []):
+            for search in shard.get("searches", []):
+                for query in search.get("query", []):
+                    _flatten_clause(query, shard=shard["id"], depth=0, clauses=clauses)
+        self.elasticsearch.append({"index": index, "took_ms": took, "clauses": clauses})
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "duration_ms": round(self.duration * 1000, 3),
+            "elasticsearch": self.elasticsearch,
+            "python": json.loads(SpeedscopeRenderer().render(self.session)) if self.session is not None else None,
+        }
+
+    def to_html(self) -> str:
+        return HTMLRenderer().render(self.session) if self.session is not None else ""
+
+
+def _flatten_clause(query: dict, *, shard: str, depth: int, clauses: list[dict]) -> None:
+    clauses.append(
+        {
+            "shard": shard,
+            "depth": depth,
+            "type": query["type"],
+            "description": query["description"],
+            "time_ms": query["time_in_nanos"] / 1_000_000,
+        }
+    )
+    for child in query.get("children", []):
+        _flatten_clause(child, shard=shard, depth=depth + 1, clauses=clauses)
+
+
+_current_profile: ContextVar[ProfileReport | None] = ContextVar("current_profile", default=None)
+_profile_reports: OrderedDict[str, ProfileReport] = OrderedDict()
+
+
+def current_profile() -> ProfileReport | None:
+    """Returns the report of the request being profiled, None for all requests that aren't."""
+    return _current_profile.get()
+
+
+def get_profile_report(id: str) -> ProfileReport | None:
+    return _profile_reports.get(id)
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware that profiles requests carrying the PROFILING_HEADER with pyinstrument's sampling profiler.
+    The response links the report in the PROFILE_REPORT_HEADER, it is kept in memory of the worker.
+    Only installed when PROFILING_ENABLED, see `api.main`.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not any(name == PROFILING_HEADER.encode() for name, _ in scope["headers"]):
+            await self.app(scope, receive, send)
+            return
+
+        report = ProfileReport(id=uuid.uuid4().hex, method=scope["method"], path=scope["path"])
+        link = f"{scope.get('root_path', '')}/profiles/{report.id}".encode()
+
+        async def send_with_link(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", []), (PROFILE_REPORT_HEADER.encode(), link)]
+            await send(message)
+
+        token = _current_profile.set(report)
+        profiler = Profiler(interval=PROFILING_INTERVAL, async_mode="enabled")
+        start = time.perf_counter()
+        profiler.start()
+        try:
+            await self.app(scope, receive, send_with_link)
+        finally:
+            report.session = profiler.stop()
+            report.duration = time.perf_counter() - start
+            _current_profile.reset(token)
+            _profile_reports[report.id] = report
+            while len(_profile_reports) > PROFILE_REPORTS_MAX_SIZE:
+                _profile_reports.popitem(last=False)
@@ -0,0 +1,17 @@
+from fastapi import Response
+
+
+def json_response(body: bytes | str, response: Response) -> Response:
+    """
+    Returns an already serialized JSON body together with the headers the route set on its `response`, e.g. the
+    ETag. FastAPI passes a returned Response through as it is, so results the repositories already validated aren't
+    dumped and validated against the response_model of the route again, which then only documents the route.
+    Bodies are serialized with pydantic's `dump_json`/`model_dump_json`, which don't validate.
+
+    Args:
+        body (bytes | str): the serialized JSON
+        response (Response): the response injected into the route, its status code and headers are kept
+    """
+    rendered = Response(content=body, status_code=response.status_code or 200, media_type="application/json")
+    rendered.headers.raw.extend(response.headers.raw)
+    return rendered
@@ -0,0 +1,255 @@
+from abc import ABC, abstractmethod
+from typing import AsyncIterator
+
+from elastic_transport import ObjectApiResponse
+
+from api.lib.profiling import current_profile
+
+# Unique field that breaks ties between documents with the same score when paginating
+TIEBREAKER_FIELD = "id"
+# The only parts of a search response the matching code reads, see the filter_path of the search methods
+MATCH_HITS_FILTER_PATH = ["hits.hits._id", "hits.hits._score"]
+
+
+class SearchBackend(ABC):
+    """
+    Interface of the storage the repositories retrieve and match jobs or candidates from.
+    Queries are expressed in the elasticsearch query DSL, so every backend has to understand the subset
+    of it that the repositories build.
+
+    Args:
+        index (str): "candidates" or "jobs"
+    """
+
+    # Whether `knn_search` is implemented, so callers can reject a semantic request before preparing it
+    supports_knn_search = True
+
+    def __init__(self, index: str) -> None:
+        self.index = index
+
+    @abstractmethod
+    async def get_entity(self, *, id: int, source_includes: list[str] | None = None) -> dict:
+        """
+        Returns the document corresponding to the given document ID as dictionary.
+
+        Raises:
+            IDNotFoundError: If the ID was not found in the index.
+        """
+
+    @abstractmethod
+    async def get_entities(self, *, ids: list[int]) -> dict[int, dict]:
+        """
+        Returns the documents corresponding to the given document IDs keyed by ID, unknown IDs are omitted.
+        """
+
+    @abstractmethod
+    async def get_entity_with_version(self, *, id: int) -> tuple[dict, str]:
+        """
+        Returns the document corresponding to the given document ID together with an opaque version,
+        which changes whenever the document changes.
+
+        Raises:
+            IDNotFoundError: If the ID was not found in the index.
+        """
+
+    @abstractmethod
+    async def get_generation(self) -> str:
+        """
+        Returns an opaque version of the whole index, which changes whenever any of its documents is added,
+        changed or deleted. It may lag behind writes by a few seconds.
+        """
+
+    @abstractmethod
+    async def search(self, query: dict, return_source=False, filter_path: list[str] | None = None) -> ObjectApiResponse:
+        """
+        Executes a query on the index, return_source may also be the list of the _source fields to return.
+        With a filter_path the backend may leave out every other part of the response, e.g. MATCH_HITS_FILTER_PATH.
+        """
+
+    @abstractmethod
+    async def multi_search(
+        self, *, queries: list[dict], return_source=False, filter_path: list[str] | None = None
+    ) -> list[dict]:
+        """
+        Executes several queries on the index, failed queries contain an "error" key instead of hits.
+        The filter_path applies to every single response.
+        """
+
+    @abstractmethod
+    async def search_page(
+        self,
+        *,
+        query: dict,
+        size: int,
+        pit_id: str | None = None,
+        search_after: list | None = None,
+    ) -> dict:
+        """
+        Returns one page of the hits of the given query, sorted by descending score and ascending TIEBREAKER_FIELD.
+
+        Args:
+            query: the search request body, its "size" is overridden by `size`
+            size: number of hits per page
+            pit_id: point in time of the previous page, a new one is opened if not set
+            search_after: "sort" values of the last hit of the previous page
+
+        Returns:
+            The search response, "pit_id" holds the point in time the next page has to use.
+
+        Raises:
+            PointInTimeNotFoundError: If the point in time of the previous page expired.
+        """
+
+    @abstractmethod
+    def iter_sliced_hits(self, *, query: dict, slices: int, page_size: int) -> AsyncIterator[dict]:
+        """
+        Iterates over all hits of the given query in no particular order, fetching several slices concurrently.
+        At most a few pages per slice are held in memory, no matter how many hits there are.
+
+        Args:
+            query: the search request body, only its "query" is used
+            slices: number of slices fetched concurrently
+            page_size: number of hits fetched per request
+
+        Yields:
+            dict: hits with "_id" and "_score"
+        """
+
+    @abstractmethod
+    async def ensure_search_template(self, *, id: str, source: str) -> None:
+        """
+        Registers a mustache search template.
+
+        Raises:
+            UnsupportedSearchError: If the backend can't execute search templates.
+        """
+
+    @abstractmethod
+    async def search_template(
+        self, *, id: str, params: dict, filter_path: list[str] | None = None
+    ) -> ObjectApiResponse:
+        """
+        Executes a search template registered with `ensure_search_template` on the index.
+
+        Raises:
+            UnsupportedSearchError: If the backend can't execute search templates.
+        """
+
+    @abstractmethod
+    async def knn_search(
+        self,
+        *,
+        field: str,
+        query_vector: list[float],
+        k: int,
+        num_candidates: int,
+        filter: list[dict] | None = None,
+        source_includes: list[str] | None = None,
+    ) -> dict:
+        """
+        Returns the k documents whose vector in `field` is closest to the query vector, searched approximately
+        in the HNSW graph of the field. Only documents matching all of the filter queries are considered.
+
+        Args:
+            field: dense_vector field to search
+            query_vector: vector to find the nearest neighbours of
+            k: number of hits to return
+            num_candidates: nearest neighbours considered per shard, more improve recall and cost latency
+            filter: queries a hit has to match
+            source_includes: fields of the _source to return with every hit, none if not set
+
+        Raises:
+            UnsupportedSearchError: If the backend can't execute kNN searches.
+        """
+
+    @abstractmethod
+    async def percolate(self, *, documents: list[dict], size: int) -> list[dict]:
+        """
+        Returns the stored queries of a percolator index that match each of the given documents.
+
+        Args:
+            documents: documents to percolate, enriched like indexed documents
+            size: maximum number of matching queries returned per document, by descending score
+
+        Returns:
+            One search response per document in the same order, with the _id and _score of the matching queries
+            and their total number. Failed searches contain an "error" key instead of hits.
+
+        Raises:
+            UnsupportedSearchError: If the backend has no percolator indices.
+        """
+
+    async def search_with_bool_queries(
+        self,
+        *,
+        should_queries: list[dict] | None = None,
+        must_queries: list[dict] | None = None,
+        return_source=False,
+        size: int = 10,
+        filter_path: list[str] | None = None,
+        aggregations: dict | None = None,
+    ):
+        """
+        Builds a boolean query comprising the provided should and must sub queries.
+
+        Args:
+            should_queries: the sub-queries that are to be concatenated by the OR operator
+            must_queries: the sub-queries that are to be concatenated by the AND operator
+            return_source: whether to return the _source field of the document, or which of its fields
+            size: how many docs to returns
+            filter_path: parts of the response to return, all if not set
+            aggregations: "aggs" computed over all matching documents by the same request, e.g. the facets of
+                `api.lib.facets.build_facet_aggregations`
+
+        Returns:
+            The matching documents.
+        """
+        query = self.build_bool_query(should_queries=should_queries, must_queries=must_queries, size=size)
+        if aggregations:
+            query["aggs"] = aggregations
+
+        profile = current_profile()
+        if profile is None:
+            return await self.search(query=query, return_source=return_source, filter_path=filter_path)
+
+        # Profiled requests (see api.lib.profiling) also get the timings of every clause from elasticsearch
+        response = await self.search(
+            query={**query, "profile": True},
+            return_source=return_source,
+            filter_path=None if filter_path is None else [*filter_path, "took", "profile"],
+        )
+        profile.add_elasticsearch_profile(
+            index=self.index, took=response.body.get("took"), profile=response.body.get("profile")
+        )
+        return response
+
+    @staticmethod
+    def build_bool_query(
+        *,
+        should_queries: list[dict] | None = None,
+        must_queries: list[dict] | None = None,
+        size: int = 10,
+    ) -> dict:
+        """
+        Builds the request body of a boolean query comprising the provided should and must sub queries.
+
+        Args:
+            should_queries: the sub-queries that are to be concatenated by the OR operator
+            must_queries: the sub-queries that are to be concatenated by the AND operator
+            size: how many docs to returns
+
+        Returns:
+            The search request body.
+        """
+        if not (should_queries or must_queries):
+            raise ValueError("Either should_queries or must_queries must be set.")
+
+        return {
+            "query": {
+                "bool": {
+                    "must": must_queries or [],
+                    "should": should_queries or [],
+                }
+            },
+            "size": size,
+        }
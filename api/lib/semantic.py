@@ -0,0 +1,39 @@
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+# dense_vector field with the normalized mean embedding of the skills of a document, see seed_image/enrichment.py
+SKILL_VECTOR_FIELD = "skill_vector"
+# Nearest neighbours retrieved and reranked per semantic matching request, at least the requested limit
+SEMANTIC_RERANK_WINDOW = int(os.getenv("SEMANTIC_RERANK_WINDOW", "100"))
+# Candidates the HNSW search considers per shard, more improve the recall and cost latency
+SEMANTIC_NUM_CANDIDATES = int(os.getenv("SEMANTIC_NUM_CANDIDATES", "200"))
+# Weight of the share of exactly matching top skills when reranking, the similarity weighs 1
+SEMANTIC_OVERLAP_WEIGHT = float(os.getenv("SEMANTIC_OVERLAP_WEIGHT", "0.5"))
+# Fields every kNN hit needs for reranking
+RERANK_FIELDS = ["top_skill_ids"]
+
+
+def rerank(response: dict, top_skill_ids: list[int], limit: int) -> list[tuple[int, float]]:
+    """
+    Reranks the hits of a kNN search by their similarity plus SEMANTIC_OVERLAP_WEIGHT times the share of the
+    given top skills they have exactly, so among similar profiles the ones with the same skills come first.
+
+    Args:
+        response (dict): kNN search response whose hits include RERANK_FIELDS
+        top_skill_ids (list[int]): canonical top skills of the entity the matches are for
+        limit (int): number of hits to return
+
+    Returns:
+        list[tuple[int, float]]: (id, relevance score) of the best `limit` hits, by descending score and ascending id
+    """
+    wanted = set(top_skill_ids)
+    scored = []
+    for hit in response.get("hits", {}).get("hits", []):
+        overlap = (
+            len(wanted.intersection(hit.get("_source", {}).get("top_skill_ids", []))) / len(wanted) if wanted else 0
+        )
+        scored.append((int(hit["_id"]), hit["_score"] + SEMANTIC_OVERLAP_WEIGHT * overlap))
+    scored.sort(key=lambda hit: (-hit[1], hit[0]))
+    return scored[:limit]
@@ -0,0 +1,109 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Hashable, TypeVar
+
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+# Seconds a result is handed to identical calls that arrive after it completed, 0 only shares in-flight calls
+SINGLE_FLIGHT_REUSE_SECONDS = float(os.getenv("SINGLE_FLIGHT_REUSE_SECONDS", "0"))
+
+T = TypeVar("T")
+
+
+@dataclass
+class SingleFlightStats:
+    calls: int = 0
+    executions: int = 0
+    coalesced: int = 0
+    reused: int = 0
+    errors: int = 0
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls: the first call for a key executes, every call with the same key that
+    arrives while it is running awaits that execution and gets the same result or exception.
+
+    The execution runs in its own task, so a caller that is cancelled (e.g. the client disconnected) doesn't
+    cancel it for the others. Successful results can additionally be reused for `reuse_window` seconds.
+    Results are shared between callers and must not be mutated.
+
+    Args:
+        reuse_window (float): seconds a completed result is reused, 0 disables reuse
+    """
+
+    def __init__(self, *, reuse_window: float = 0.0) -> None:
+        self.reuse_window = reuse_window
+        self.stats = SingleFlightStats()
+        self.__in_flight: dict[Hashable, asyncio.Task] = {}
+        self.__results: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        """
+        Returns the result of `fn()`, shared with all concurrent calls of the same key.
+
+        Args:
+            key (Hashable): identifies calls that are interchangeable
+            fn: coroutine function doing the actual work, only called if no call of the key is in flight
+
+        Raises:
+            Exception: whatever the shared execution of `fn` raised
+        """
+        self.stats.calls += 1
+        reused = self.__results.get(key)
+        if reused is not None and reused[0] > time.monotonic():
+            self.stats.reused += 1
+            return reused[1]
+
+        task = self.__in_flight.get(key)
+        if task is None:
+            self.stats.executions += 1
+            task = asyncio.ensure_future(fn())
+            self.__in_flight[key] = task
+            task.add_done_callback(lambda task: self.__complete(key, task))
+        else:
+            self.stats.coalesced += 1
+
+        return await asyncio.shield(task)
+
+    def __complete(self, key: Hashable, task: asyncio.Task) -> None:
+        del self.__in_flight[key]
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            self.stats.errors += 1
+        elif self.reuse_window > 0:
+            now = time.monotonic()
+            self.__results[key] = (now + self.reuse_window, task.result())
+            self.__results.move_to_end(key)
+            # All entries live equally long, so the expired ones are at the front
+            while self.__results and next(iter(self.__results.values()))[0] <= now:
+                self.__results.popitem(last=False)
+
+    def clear(self) -> None:
+        self.__results.clear()
+
+
+_single_flights: dict[str, SingleFlight] = {}
+
+
+def get_single_flight(name: str, *, reuse_window: float = SINGLE_FLIGHT_REUSE_SECONDS) -> SingleFlight:
+    """
+    Returns the process wide single-flight group of the given name, created with `reuse_window` on first use.
+
+    Args:
+        name (str): name of the group, e.g. "matching_jobs" or "entities/jobs"
+        reuse_window (float): seconds a completed result is reused, defaults to SINGLE_FLIGHT_REUSE_SECONDS
+    """
+    if name not in _single_flights:
+        _single_flights[name] = SingleFlight(reuse_window=reuse_window)
+    return _single_flights[name]
+
+
+def get_single_flights() -> dict[str, SingleFlight]:
+    """Returns all single-flight groups that were used so far, keyed by name."""
+    return dict(_single_flights)
@@ -0,0 +1,205 @@
+import logging
+import mmap
+import os
+import struct
+import sys
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, NamedTuple
+
+import orjson
+from dotenv import load_dotenv
+
+_LOGGER = logging.getLogger(__name__)
+
+load_dotenv(override=True)
+# Directory of the snapshots the seeder writes, "<index>.snapshot", entities are only read from elasticsearch without it
+ENTITY_SNAPSHOT_DIR = os.getenv("ENTITY_SNAPSHOT_DIR")
+# Seconds between checks whether the seeder replaced a snapshot
+ENTITY_SNAPSHOT_CHECK_SECONDS = float(os.getenv("ENTITY_SNAPSHOT_CHECK_SECONDS", "5"))
+
+# File format of seed_image/snapshot.py, see there for the layout
+SNAPSHOT_MAGIC = b"ENTSNAP\x00"
+SNAPSHOT_FORMAT = 1
+NULL_INT = -(2**63)
+NULL_CODE = -1
+
+_HEADER_LENGTH = struct.Struct("<I")
+
+
+class SnapshotError(Exception):
+    """Raised when a file is not a snapshot this version of the api can read."""
+
+
+class SnapshotEntity(NamedTuple):
+    """The public fields of a document and its version, in the format of `SearchBackend.get_entity_with_version`."""
+
+    source: dict
+    version: str
+
+
+class EntitySnapshot:
+    """
+    A snapshot file mapped into memory. Nothing but the header and the string table is read when it is opened,
+    the pages of the columns are shared by all workers through the page cache.
+    A lookup reads the row of the ID from the `rows` table and the values of the row from every column.
+
+    Args:
+        path (Path): the snapshot file
+
+    Raises:
+        SnapshotError: If the file isn't a snapshot or was written in another format or byte order.
+    """
+
+    def __init__(self, path: Path) -> None:
+        with open(path, "rb") as file_pointer:
+            memory = mmap.mmap(file_pointer.fileno(), 0, access=mmap.ACCESS_READ)
+        if memory[: len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+            raise SnapshotError(f"{path} is not a snapshot.")
+        header_start = len(SNAPSHOT_MAGIC) + _HEADER_LENGTH.size
+        (header_length,) = _HEADER_LENGTH.unpack_from(memory, len(SNAPSHOT_MAGIC))
+        header = orjson.loads(memory[header_start : header_start + header_length])
+        if header["format"] != SNAPSHOT_FORMAT or header["byteorder"] != sys.byteorder:
+            raise SnapshotError(f"{path} has format {header['format']} in {header['byteorder']} byte order.")
+
+        data = memoryview(memory)[(header_start + header_length + 7) // 8 * 8 :]
+        sections = {
+            name: data[offset : offset + size].cast(typecode)
+            for name, (offset, size, typecode) in header["sections"].items()
+        }
+        string_offsets, string_data = sections["strings.offsets"], sections["strings.data"]
+        self.strings = [
+            bytes(string_data[string_offsets[number] : string_offsets[number + 1]]).decode("utf-8")
+            for number in range(header["strings"])
+        ]
+        self.version: str = header["version"]
+        self.concrete_index: str = header["concrete_index"]
+        self.fields: dict[str, str] = header["fields"]
+        self.__rows = sections["rows"]
+        self.__seq_no = sections["seq_no"]
+        self.__primary_term = sections["primary_term"]
+        # (field, kind, values, offsets) of every field, resolved once instead of on every lookup
+        self.__columns = [
+            (field, kind, sections[f"{field}.values"], sections.get(f"{field}.offsets"))
+            for field, kind in self.fields.items()
+        ]
+
+    def __len__(self) -> int:
+        return len(self.__seq_no)
+
+    def get(self, id: int) -> SnapshotEntity | None:
+        """Returns the document with the given ID, None if it isn't in the snapshot."""
+        if not 0 <= id < len(self.__rows) or (row := self.__rows[id]) < 0:
+            return None
+        strings = self.strings
+        source: dict = {}
+        for field, kind, values, offsets in self.__columns:
+            if kind == "strings":
+                source[field] = [strings[number] for number in values[offsets[row] : offsets[row + 1]]]
+            elif kind == "code":
+                source[field] = None if values[row] == NULL_CODE else strings[values[row]]
+            else:
+                source[field] = None if values[row] == NULL_INT else values[row]
+        return SnapshotEntity(source, f"{self.concrete_index}/{self.__primary_term[row]}/{self.__seq_no[row]}")
+
+
+@dataclass
+class SnapshotStats:
+    hits: int = 0
+    misses: int = 0
+    reloads: int = 0
+    errors: int = 0
+
+
+class SnapshotStore:
+    """
+    The current snapshot of one index. At most every `check_interval` seconds a lookup checks whether the file was
+    replaced and swaps to the new snapshot if its version differs, so workers pick up a new snapshot of the seeder
+    without a restart. Lookups that are still running keep the mapping of the previous snapshot alive.
+
+    Args:
+        path (Path | None): the snapshot file, None disables the store and every lookup misses
+        check_interval (float): seconds between checks of the file
+        clock (Callable[[], float]): monotonic time in seconds
+    """
+
+    def __init__(
+        self, path: Path | None, *, check_interval: float, clock: Callable[[], float] = time.monotonic
+    ) -> None:
+        self.path = path
+        self.check_interval = check_interval
+        self.stats = SnapshotStats()
+        self.__clock = clock
+        self.__snapshot: EntitySnapshot | None = None
+        self.__file_key: tuple | None = None
+        self.__next_check = float("-inf")
+
+    @property
+    def snapshot(self) -> EntitySnapshot | None:
+        """The current snapshot, None if there is none (yet)."""
+        if self.path is not None and self.__clock() >= self.__next_check:
+            self.__next_check = self.__clock() + self.check_interval
+            self.__reload()
+        return self.__snapshot
+
+    def get(self, id: int) -> SnapshotEntity | None:
+        """
+        Returns the document with the given ID from the current snapshot.
+
+        Returns:
+            SnapshotEntity | None: the document and its version, None if it has to be read from the index
+        """
+        snapshot = self.snapshot
+        if snapshot is None:
+            return None
+        entity = snapshot.get(id)
+        if entity is None:
+            self.stats.misses += 1
+        else:
+            self.stats.hits += 1
+        return entity
+
+    def __reload(self) -> None:
+        assert self.path is not None
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            self.__snapshot, self.__file_key = None, None
+            return
+        file_key = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        if file_key == self.__file_key:
+            return
+        try:
+            snapshot = EntitySnapshot(self.path)
+        except (OSError, ValueError, KeyError, SnapshotError) as error:
+            self.stats.errors += 1
+            _LOGGER.warning(f"Keeping the current snapshot, {self.path} could not be opened: {error}")
+            return
+        self.__file_key = file_key
+        if self.__snapshot is None or snapshot.version != self.__snapshot.version:
+            self.__snapshot = snapshot
+            self.stats.reloads += 1
+            _LOGGER.info(f"Opened snapshot {snapshot.version} with {len(snapshot)} documents.")
+
+
+_snapshot_stores: dict[str, SnapshotStore] = {}
+
+
+def get_snapshot_store(index: str) -> SnapshotStore:
+    """
+    Returns the process wide snapshot store of the given index, "<ENTITY_SNAPSHOT_DIR>/<index>.snapshot".
+    The store is disabled without ENTITY_SNAPSHOT_DIR.
+
+    Args:
+        index (str): name of the index, e.g. "jobs" or "candidates"
+    """
+    if index not in _snapshot_stores:
+        path = Path(ENTITY_SNAPSHOT_DIR) / f"{index}.snapshot" if ENTITY_SNAPSHOT_DIR else None
+        _snapshot_stores[index] = SnapshotStore(path, check_interval=ENTITY_SNAPSHOT_CHECK_SECONDS)
+    return _snapshot_stores[index]
+
+
+def get_snapshot_stores() -> dict[str, SnapshotStore]:
+    """Returns the snapshot stores of all indices that were used so far, keyed by index."""
+    return dict(_snapshot_stores)
@@ -0,0 +1,142 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Any
+
+import anyio.to_thread
+from dotenv import load_dotenv
+from elasticsearch import AsyncElasticsearch
+from fastapi import FastAPI
+
+from api.lib.elasticsearch.connection import ES_CONNECTIONS_PER_NODE, get_elasticsearch
+from api.lib.elasticsearch.dependencies import SEARCH_BACKEND, get_search_backend
+from api.lib.in_memory.in_memory_client import IN_MEMORY_DATA_SOURCE
+from api.lib.singleflight import get_single_flight
+from api.lib.snapshot import get_snapshot_store
+
+_LOGGER = logging.getLogger(__name__)
+
+load_dotenv(override=True)
+# Attempts to reach elasticsearch on startup, the worker starts without being ready after the last one
+STARTUP_ES_ATTEMPTS = int(os.getenv("STARTUP_ES_ATTEMPTS", "10"))
+# Wait after the first failed attempt, doubled after every further one up to STARTUP_ES_MAX_DELAY seconds
+STARTUP_ES_RETRY_DELAY = float(os.getenv("STARTUP_ES_RETRY_DELAY", "0.5"))
+STARTUP_ES_MAX_DELAY = float(os.getenv("STARTUP_ES_MAX_DELAY", "5"))
+# Connections opened on startup, so the first requests don't pay for the TCP and HTTP setup
+STARTUP_PREWARM_CONNECTIONS = int(os.getenv("STARTUP_PREWARM_CONNECTIONS", str(ES_CONNECTIONS_PER_NODE)))
+# Indices /health/ready requires, the precomputed matches and percolator indices are optional
+READY_REQUIRED_INDICES = [index for index in os.getenv("READY_REQUIRED_INDICES", "jobs,candidates").split(",") if index]
+# Timeout of the elasticsearch requests of a readiness check, and seconds its result is reused by further probes
+READY_TIMEOUT_SECONDS = float(os.getenv("READY_TIMEOUT_SECONDS", "1"))
+READY_REUSE_SECONDS = float(os.getenv("READY_REUSE_SECONDS", "1"))
+
+# Elasticsearch is only needed to serve requests if a backend reads from it
+REQUIRES_ELASTICSEARCH = SEARCH_BACKEND == "elasticsearch" or IN_MEMORY_DATA_SOURCE == "elasticsearch"
+
+_started = False
+
+
+async def wait_for_elasticsearch(
+    client: AsyncElasticsearch,
+    *,
+    attempts: int = STARTUP_ES_ATTEMPTS,
+    retry_delay: float = STARTUP_ES_RETRY_DELAY,
+    max_delay: float = STARTUP_ES_MAX_DELAY,
+) -> bool:
+    """
+    Waits until the cluster answers with a health that isn't red, with exponential backoff between attempts.
+
+    Returns:
+        bool: whether elasticsearch became available within `attempts`
+    """
+    for attempt in range(attempts):
+        if attempt:
+            await asyncio.sleep(min(max_delay, retry_delay * 2 ** (attempt - 1)))
+        try:
+            health = await client.options(request_timeout=READY_TIMEOUT_SECONDS, max_retries=0).cluster.health()
+        except Exception as error:
+            _LOGGER.info(f"Elasticsearch not reachable yet (attempt {attempt + 1}/{attempts}): {error}")
+            continue
+        if health["status"] != "red":
+            return True
+        _LOGGER.info(f"Elasticsearch cluster is red (attempt {attempt + 1}/{attempts}).")
+    return False
+
+
+async def prewarm_connections(client: AsyncElasticsearch, count: int = STARTUP_PREWARM_CONNECTIONS) -> None:
+    """Opens `count` pooled connections by sending as many requests concurrently, failed ones are ignored."""
+    await asyncio.gather(*(client.options(max_retries=0).ping() for _ in range(count)), return_exceptions=True)
+
+
+async def start(app: FastAPI) -> asyncio.Task | None:
+    """
+    Production startup of a worker, called by the lifespan of the app before it accepts requests:
+    waits for elasticsearch with bounded retries, opens the connections of the pool, loads the entity snapshots,
+    the in-memory indices and the generations of the indices the matching ETags depend on, starts the thread pool
+    of the sync dependencies and builds the OpenAPI schema. Validators of the pydantic models are compiled when they are imported, which already happened.
+
+    A worker whose elasticsearch isn't reachable within STARTUP_ES_ATTEMPTS still starts, /health/ready reports it
+    as not ready until the returned task reached elasticsearch and finished the warm-up.
+
+    Returns:
+        asyncio.Task | None: the task finishing the startup in the background, to be cancelled on shutdown
+    """
+    if REQUIRES_ELASTICSEARCH and not await wait_for_elasticsearch(get_elasticsearch()):
+        _LOGGER.error(f"Elasticsearch not reachable after {STARTUP_ES_ATTEMPTS} attempts, starting without it.")
+        return asyncio.create_task(_start_when_available(app))
+    await _warm_up(app)
+    return None
+
+
+async def _start_when_available(app: FastAPI) -> None:
+    while not await wait_for_elasticsearch(get_elasticsearch(), retry_delay=STARTUP_ES_MAX_DELAY):
+        pass
+    await _warm_up(app)
+
+
+async def _warm_up(app: FastAPI) -> None:
+    global _started
+    start_time = time.perf_counter()
+    if REQUIRES_ELASTICSEARCH:
+        await prewarm_connections(get_elasticsearch())
+    for index in ("jobs", "candidates"):
+        get_snapshot_store(index).snapshot
+        try:
+            await get_search_backend(index).get_generation()
+        except Exception as error:
+            _LOGGER.warning(f"Could not warm up index {index}: {error}")
+    # Sync dependencies run in anyio's thread pool, its backend is imported and its first thread started on first use
+    await anyio.to_thread.run_sync(lambda: None)
+    app.openapi()
+    _started = True
+    _LOGGER.info(f"Warmed up in {time.perf_counter() - start_time:.2f}s.")
+
+
+async def check_readiness() -> tuple[bool, dict[str, Any]]:
+    """
+    Whether this worker should get traffic: its startup completed and, if a backend reads from elasticsearch,
+    the cluster isn't red and the required indices exist. Concurrent probes share one check, which is
+    reused for READY_REUSE_SECONDS.
+
+    Returns:
+        tuple[bool, dict[str, Any]]: readiness and the result of every check
+    """
+    return await get_single_flight("readiness", reuse_window=READY_REUSE_SECONDS).do("readiness", _check_readiness)
+
+
+async def _check_readiness() -> tuple[bool, dict[str, Any]]:
+    checks: dict[str, Any] = {"startup": _started}
+    if REQUIRES_ELASTICSEARCH:
+        client = get_elasticsearch().options(request_timeout=READY_TIMEOUT_SECONDS, max_retries=0)
+        try:
+            health, *exists = await asyncio.gather(
+                client.cluster.health(), *(client.indices.exists(index=index) for index in READY_REQUIRED_INDICES)
+            )
+        except Exception as error:
+            checks["elasticsearch"] = f"unreachable: {error}"
+            return False, checks
+        checks["elasticsearch"] = health["status"]
+        checks["indices"] = {index: bool(found) for index, found in zip(READY_REQUIRED_INDICES, exists)}
+        return _started and health["status"] != "red" and all(exists), checks
+    return _started, checks
@@ -1,7 +1,43 @@
+import asyncio
+from contextlib import asynccontextmanager, suppress
+from typing import AsyncIterator
+
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 
+from api.lib.elasticsearch.connection import close_elasticsearch, open_elasticsearch
+from api.lib.elasticsearch.exceptions import SearchUnavailableError
+from api.lib.elasticsearch.resilience import DegradedResponseMiddleware, search_unavailable_handler
+from api.lib.metrics import MetricsMiddleware, preallocate_route_metrics
+from api.lib.profiling import PROFILING_ENABLED, ProfilingMiddleware
+from api.lib.startup import start
 from api.routes import api_router
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    """
+    Owns the elasticsearch client all requests of this worker share, its connections are closed on shutdown.
+    Requests are only accepted once the worker is warmed up, see `api.lib.startup.start`.
+    """
+    open_elasticsearch()
+    preallocate_route_metrics(app.routes)
+    background_start = await start(app)
+    yield
+    if background_start is not None:
+        background_start.cancel()
+        with suppress(asyncio.CancelledError):
+            await background_start
+    await close_elasticsearch()
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 app.include_router(api_router)
+# Elasticsearch being down or slow is answered with a 503 or 504 from every route instead of a generic 500
+app.add_exception_handler(SearchUnavailableError, search_unavailable_handler)
+app.add_middleware(DegradedResponseMiddleware)
+app.add_middleware(MetricsMiddleware)
+# Not installed at all unless enabled, so profiling costs nothing otherwise
+if PROFILING_ENABLED:
+    app.add_middleware(ProfilingMiddleware)
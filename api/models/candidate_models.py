@@ -1,8 +1,14 @@
-from typing import List
+from typing import List, Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, TypeAdapter
 
-from api.models.matching_models import BaseMatching
+from api.models.matching_models import (
+    BaseMatching,
+    BaseMatchingBatchResult,
+    BaseMatchingPage,
+    BaseMatchingWithFacets,
+    BaseMutualMatching,
+)
 
 
 class CandidatePublic(BaseModel):
@@ -16,8 +22,51 @@ class CandidatePublic(BaseModel):
     salary_expectation: int
 
 
+class CandidatePercolateRequest(BaseModel):
+    """Request body of the percolate route, candidates that aren't indexed yet, e.g. newly created ones"""
+
+    items: List[CandidatePublic] = Field(min_length=1, max_length=1000)
+
+
+class CandidateDocument(CandidatePublic):
+    """
+    The candidate as stored in the index, with the fields the seeder adds at ingest for matching,
+    see seed_image/enrichment.py.
+    """
+
+    top_skill_ids: List[int] = []
+    seniority_level: Optional[int] = None
+    skill_vector: Optional[List[float]] = None
+
+
 class MatchingCandidate(BaseMatching):
     """
     Just inheriting now cause later on we could have different looking matchings depending on
     the desired output of the apis, else we could use BaseMatching directly
     """
+
+
+# Validates and serializes lists of matches in one call into pydantic-core
+MATCHING_CANDIDATES = TypeAdapter(List[MatchingCandidate])
+
+
+class MatchingCandidateBatchResult(BaseMatchingBatchResult):
+    """Matches for one entry of a batch matching request, empty if the entry failed"""
+
+    matches: List[MatchingCandidate] = []
+
+
+class MatchingCandidatePage(BaseMatchingPage):
+    """One page of matching candidates"""
+
+    items: List[MatchingCandidate]
+
+
+class MatchingCandidatesWithFacets(BaseMatchingWithFacets):
+    """Matching candidates together with facets over all of them"""
+
+    items: List[MatchingCandidate]
+
+
+class MutualMatchingCandidate(BaseMutualMatching):
+    """A matching candidate that also ranks the origin among its own top matches"""
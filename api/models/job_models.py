@@ -1,8 +1,14 @@
-from typing import List
+from typing import List, Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, TypeAdapter
 
-from api.models.matching_models import BaseMatching
+from api.models.matching_models import (
+    BaseMatching,
+    BaseMatchingBatchResult,
+    BaseMatchingPage,
+    BaseMatchingWithFacets,
+    BaseMutualMatching,
+)
 
 
 class JobPublic(BaseModel):
@@ -16,8 +22,51 @@ class JobPublic(BaseModel):
     max_salary: int
 
 
+class JobPercolateRequest(BaseModel):
+    """Request body of the percolate route, jobs that aren't indexed yet, e.g. newly created ones"""
+
+    items: List[JobPublic] = Field(min_length=1, max_length=1000)
+
+
+class JobDocument(JobPublic):
+    """
+    The job as stored in the index, with the fields the seeder adds at ingest for matching,
+    see seed_image/enrichment.py.
+    """
+
+    top_skill_ids: List[int] = []
+    seniority_levels: List[int] = []
+    skill_vector: Optional[List[float]] = None
+
+
 class MatchingJob(BaseMatching):
     """
     Just inheriting now cause later on we could have different looking matchings depending on
     the desired output of the apis, else we could use BaseMatching directly
     """
+
+
+# Validates and serializes lists of matches in one call into pydantic-core
+MATCHING_JOBS = TypeAdapter(List[MatchingJob])
+
+
+class MatchingJobBatchResult(BaseMatchingBatchResult):
+    """Matches for one entry of a batch matching request, empty if the entry failed"""
+
+    matches: List[MatchingJob] = []
+
+
+class MatchingJobPage(BaseMatchingPage):
+    """One page of matching jobs"""
+
+    items: List[MatchingJob]
+
+
+class MatchingJobsWithFacets(BaseMatchingWithFacets):
+    """Matching jobs together with facets over all of them"""
+
+    items: List[MatchingJob]
+
+
+class MutualMatchingJob(BaseMutualMatching):
+    """A matching job that also ranks the origin among its own top matches"""
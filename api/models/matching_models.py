@@ -1,4 +1,8 @@
-from pydantic import BaseModel
+from enum import Enum
+from typing import Annotated, Dict, List, Optional, Union
+
+from fastapi import Depends, HTTPException
+from pydantic import BaseModel, ConfigDict, Field, ValidationError, field_validator, model_validator
 
 
 class BaseMatching(BaseModel):
@@ -6,3 +10,150 @@ class BaseMatching(BaseModel):
 
     id: int
     relevance_score: float
+
+
+class BaseMutualMatching(BaseMatching):
+    """A match that ranks both ways: the matched entity is in the top matches of the origin and the origin is in
+    the top `reverse_limit` matches of the matched entity. `relevance_score` combines both scores"""
+
+    forward_score: float
+    reverse_score: float
+    reverse_rank: int
+
+
+class MatchingMode(str, Enum):
+    """How the matching query is sent to elasticsearch
+    - query: the query is built in python from the validated source document
+    - lookup: only the fields needed for matching are fetched and a stored search template renders the query
+    - semantic: approximate kNN search over the skill vectors, restricted to the selected salary and seniority
+      filters, with the nearest neighbours reranked by their exactly shared top skills
+    """
+
+    QUERY = "query"
+    LOOKUP = "lookup"
+    SEMANTIC = "semantic"
+
+
+class MatchingSource(str, Enum):
+    """Where matches come from
+    - live: matching query executed on request
+    - precomputed: top matches materialized by the offline pipeline in seed_image/precompute_matches.py
+    """
+
+    LIVE = "live"
+    PRECOMPUTED = "precomputed"
+
+
+class MatchingFacet(str, Enum):
+    """Counts over all matches, not only the returned ones, computed by the same search as the matches
+    - top_skills, other_skills: matches per skill, the most frequent ones first, synonyms count as the same skill
+      and the buckets are keyed by the name of the skill dictionary
+    - seniority: matches per seniority, of the job (one of its seniorities) or of the candidate
+    - salary: matches per salary range, keyed by its lower bound, the max salary of jobs or the expected salary
+      of candidates
+    """
+
+    TOP_SKILLS = "top_skills"
+    OTHER_SKILLS = "other_skills"
+    SENIORITY = "seniority"
+    SALARY = "salary"
+
+
+class MatchingFilters(BaseModel):
+    """The filters a match has to fulfill at least one of, all of them are selected by default
+    - salary_match: the job pays at least the salary the candidate expects
+    - top_skill_match: job and candidate share at least min(2, n_query_top_skills) top skills
+    - seniority_match: the seniority of the candidate is one of the seniorities of the job
+    """
+
+    # Hashable, so the filters can be part of the key of coalesced calls
+    model_config = ConfigDict(frozen=True)
+
+    salary_match: bool = True
+    top_skill_match: bool = True
+    seniority_match: bool = True
+
+    @model_validator(mode="after")
+    def at_least_one_filter(self) -> "MatchingFilters":
+        if not (self.salary_match or self.top_skill_match or self.seniority_match):
+            raise ValueError("at least one filter has to be selected")
+        return self
+
+    @property
+    def all_selected(self) -> bool:
+        return self.salary_match and self.top_skill_match and self.seniority_match
+
+
+class BaseMatchingPage(BaseModel):
+    """One page of matches, `next_cursor` fetches the next page and is None on the last one"""
+
+    next_cursor: Optional[str] = None
+
+
+class FacetBucket(BaseModel):
+    """Number of matches with a term, or with a salary in the range starting at `key`"""
+
+    key: Union[int, str]
+    doc_count: int
+
+
+class BaseMatchingWithFacets(BaseModel):
+    """Matches together with the requested facets of all of them, keyed by MatchingFacet"""
+
+    facets: Dict[str, List[FacetBucket]]
+
+
+class MatchingBatchItem(BaseModel):
+    """A single entry of a batch matching request, the id of the entity to match, how many matches to return
+    and which filters they have to fulfill"""
+
+    id: int
+    limit: int = Field(default=10, ge=1, le=100)
+    filters: MatchingFilters = Field(default_factory=MatchingFilters)
+
+
+class MatchingBatchRequest(BaseModel):
+    """Request body of the batch matching routes"""
+
+    items: List[MatchingBatchItem] = Field(min_length=1, max_length=1000)
+
+    @field_validator("items")
+    @classmethod
+    def ids_must_be_unique(cls, items: List[MatchingBatchItem]) -> List[MatchingBatchItem]:
+        if len({item.id for item in items}) != len(items):
+            raise ValueError("ids must be unique")
+        return items
+
+
+class BaseMatchingBatchResult(BaseModel):
+    """Outcome of one entry of a batch matching request.
+    Entries fail independently, so every result carries its own status code instead of failing the whole batch.
+    """
+
+    status_code: int
+    detail: Optional[str] = None
+
+
+class PercolateResult(BaseModel):
+    """Ids of the entities whose matching query an incoming document fulfills, best matching first.
+    `total` counts all of them, `ids` only holds the first `limit`"""
+
+    ids: List[int]
+    total: int
+
+
+def get_matching_filters(
+    salary_match: bool = True,
+    top_skill_match: bool = True,
+    seniority_match: bool = True,
+) -> MatchingFilters:
+    """Reads the MatchingFilters from the query parameters of the same name"""
+    try:
+        return MatchingFilters(
+            salary_match=salary_match, top_skill_match=top_skill_match, seniority_match=seniority_match
+        )
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False, include_context=False))
+
+
+MatchingFiltersDep = Annotated[MatchingFilters, Depends(get_matching_filters)]
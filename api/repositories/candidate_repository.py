@@ -1,13 +1,77 @@
-from typing import Annotated, List
+from typing import Annotated, AsyncIterator, Dict, List, Optional, Tuple
+from urllib.parse import urlencode
 
 from fastapi import Depends, HTTPException
+from pydantic import ValidationError
 
 from api.lib.elasticsearch.dependencies import (
+    CandidateMatchesElasticsearchDep,
     CandidatesElasticsearchDep,
+    JobQueriesElasticsearchDep,
     JobsElasticsearchDep,
 )
-from api.models.candidate_models import CandidatePublic
-from api.models.job_models import MatchingJob
+from api.lib.elasticsearch.exceptions import PointInTimeNotFoundError, SearchUnavailableError, UnsupportedSearchError
+from api.lib.elasticsearch.resilience import get_stale_results
+from api.lib.enrichment import accepting_job_levels, get_enricher
+from api.lib.export import EXPORT_PAGE_SIZE, EXPORT_SLICES
+from api.lib.facets import FACET_FILTER_PATH, build_facet_aggregations, extract_facets, get_facet_cache
+from api.lib.pagination import InvalidCursorError, decode_cursor, encode_cursor
+from api.lib.profiling import current_profile
+from api.lib.search_backend import MATCH_HITS_FILTER_PATH
+from api.lib.semantic import (
+    RERANK_FIELDS,
+    SEMANTIC_NUM_CANDIDATES,
+    SEMANTIC_RERANK_WINDOW,
+    SKILL_VECTOR_FIELD,
+    rerank,
+)
+from api.lib.singleflight import get_single_flight
+from api.lib.snapshot import get_snapshot_store
+from api.models.candidate_models import CandidateDocument, CandidatePublic
+from api.models.job_models import (
+    MATCHING_JOBS,
+    MatchingJob,
+    MatchingJobBatchResult,
+    MatchingJobPage,
+    MatchingJobsWithFacets,
+)
+from api.models.matching_models import (
+    MatchingBatchItem,
+    MatchingFacet,
+    MatchingFilters,
+    MatchingMode,
+    MatchingSource,
+    PercolateResult,
+)
+
+# Same clauses as `CandidateRepository._extract_queries_from_candidate`, rendered by elasticsearch itself.
+# Unselected filters render as match_none, which keeps the JSON valid and matches nothing
+MATCHING_JOBS_TEMPLATE_ID = "matching_jobs_for_candidate"
+MATCHING_JOBS_TEMPLATE = """{
+  "size": {{size}},
+  "query": {
+    "bool": {
+      "should": [
+        {{#salary_match}}
+        {"constant_score": {"filter": {"range": {"max_salary": {"gte": {{salary_expectation}}}}}}}
+        {{/salary_match}}
+        {{^salary_match}}{"match_none": {}}{{/salary_match}},
+        {{#seniority_match}}
+        {"constant_score": {"filter": {{#toJson}}seniority_filter{{/toJson}}}}
+        {{/seniority_match}}
+        {{^seniority_match}}{"match_none": {}}{{/seniority_match}},
+        {{#top_skill_match}}
+        {"terms_set": {"top_skill_ids": {
+          "terms": {{#toJson}}top_skill_ids{{/toJson}},
+          "minimum_should_match": {{minimum_should_match}}
+        }}}
+        {{/top_skill_match}}
+        {{^top_skill_match}}{"match_none": {}}{{/top_skill_match}}
+      ]
+    }
+  }
+}"""
+MATCHING_FIELDS = ["salary_expectation", "seniority_level", "top_skill_ids"]
 
 
 class CandidateRepository:
@@ -17,18 +81,31 @@ class CandidateRepository:
         self,
         candidates_es_client: CandidatesElasticsearchDep,
         jobs_es_client: JobsElasticsearchDep,
+        candidate_matches_es_client: CandidateMatchesElasticsearchDep,
+        job_queries_es_client: JobQueriesElasticsearchDep,
     ):
         """
         Args:
             candidates_es_client (CandidatesElasticsearchDep): Elasticsearch instance that can query the candidates index
             jobs_es_client (JobsElasticsearchDep): Elasticsearch instance that can query the jobs index
+            candidate_matches_es_client (CandidateMatchesElasticsearchDep): Elasticsearch instance that can query
+                the precomputed top jobs of every candidate
+            job_queries_es_client (JobQueriesElasticsearchDep): Elasticsearch instance that can percolate
+                the stored matching queries of every job
         """
         self.candidate_es_client = candidates_es_client
         self.enquiries_es_client = jobs_es_client
+        self.candidate_matches_es_client = candidate_matches_es_client
+        self.job_queries_es_client = job_queries_es_client
+        self.matching_single_flight = get_single_flight("matching_jobs")
+        self.stale_matches = get_stale_results("matching_jobs")
+        self.facet_cache = get_facet_cache("matching_jobs")
+        self.candidate_snapshot = get_snapshot_store("candidates")
 
     async def get_candidate_by_id(self, candidate_id: int) -> CandidatePublic:
         """Returns a candidate for the given id in an api resource compatible format
         We could map the document that we retrieve from elasticsearch into its own pydantic model
+        It is read from the snapshot of the candidates when it is in there, see `api.lib.snapshot`
 
         Args:
             candidate_id (int): id of the wanted candidate
@@ -36,60 +113,532 @@ class CandidateRepository:
         Returns:
             CandidatePublic: candidate in an api compatible format
         """
+        if (snapshot_candidate := self.candidate_snapshot.get(candidate_id)) is not None:
+            return CandidatePublic.model_validate(snapshot_candidate.source)
         return CandidatePublic.model_validate(await self.candidate_es_client.get_entity(id=candidate_id))
 
-    async def get_matching_jobs_for_candidate(self, candidate_id: int, limit: int) -> List[MatchingJob]:
+    async def get_versioned_candidate_by_id(self, candidate_id: int) -> Tuple[CandidatePublic, str]:
+        """Returns a candidate for the given id like `get_candidate_by_id`, together with the version of its document
+
+        Args:
+            candidate_id (int): id of the wanted candidate
+
+        Returns:
+            Tuple[CandidatePublic, str]: candidate in an api compatible format and the version of its document
+        """
+        if (snapshot_candidate := self.candidate_snapshot.get(candidate_id)) is None:
+            candidate, version = await self.candidate_es_client.get_entity_with_version(id=candidate_id)
+        else:
+            candidate, version = snapshot_candidate
+        return CandidatePublic.model_validate(candidate), version
+
+    async def get_matching_jobs_version(self, candidate_id: int, source: MatchingSource) -> Optional[str]:
+        """Returns a version of everything the matching jobs of a candidate are computed from: the version of the candidate
+        and the generation of the jobs index, or the version of the precomputed matches of the candidate.
+        It changes whenever the matches may have changed, so it can be checked before they are computed.
+
+        Args:
+            candidate_id (int): id of the candidate we want fitting jobs for
+            source (MatchingSource): whether the matches are computed or read from the precomputed ones
+
+        Raises:
+            IDNotFoundError: if the candidate or its precomputed matches don't exist
+
+        Returns:
+            Optional[str]: the version, None while elasticsearch is unavailable and matches may be served stale
+        """
+        try:
+            if source == MatchingSource.PRECOMPUTED:
+                _, version = await self.candidate_matches_es_client.get_entity_with_version(id=candidate_id)
+                return version
+            _, version = await self.candidate_es_client.get_entity_with_version(id=candidate_id)
+            return f"{version}/{await self.enquiries_es_client.get_generation()}"
+        except SearchUnavailableError:
+            return None
+
+    async def _get_candidate_document(self, candidate_id: int) -> CandidateDocument:
+        """Returns a candidate with the enriched fields the matching queries use."""
+        return CandidateDocument.model_validate(await self.candidate_es_client.get_entity(id=candidate_id))
+
+    async def get_matching_jobs_for_candidate(
+        self,
+        candidate_id: int,
+        limit: int,
+        mode: MatchingMode = MatchingMode.QUERY,
+        source: MatchingSource = MatchingSource.LIVE,
+        filters: MatchingFilters = MatchingFilters(),
+    ) -> List[MatchingJob]:
         """Retrieves matching jobs for a given candidate_id.
-        Currently filters by salary, seniorty and top_skills of the given candidate.
-        Only one of the filters has to be fulfilled.
+        Filters by the selected ones of salary, seniorty and top_skills of the given candidate.
+        Only one of the selected filters has to be fulfilled.
 
         Args:
             candidate_id (int): id of the candidate we want fitting jobs for
             limit (int): maximum number of fitting jobs we want returned
+            mode (MatchingMode): how the matching query is built, see MatchingMode
+            source (MatchingSource): whether to run the matching query or to read the precomputed matches,
+                precomputed matches only exist for all filters selected
+            filters (MatchingFilters): filters of which a job has to fulfill at least one
 
         Raises:
             HTTPException: raises a 500 in case that querying or formatting goes wrong
+            SearchUnavailableError: if elasticsearch is unavailable and there is no earlier result of the request
 
         Returns:
             List[MatchingJob]: a list of matching jobs
         """
-        candidate = await self.get_candidate_by_id(candidate_id)
+        # A profiled request runs its own search, so the profile shows its own elasticsearch timings
+        if current_profile() is not None:
+            return await self._get_matching_jobs_for_candidate(candidate_id, limit, mode, source, filters)
+        # Identical concurrent requests, e.g. for a popular candidate, share one search
+        # While elasticsearch is unavailable the last result of the same request is served, marked as degraded
+        key = (candidate_id, limit, mode, source, filters)
+        return await self.stale_matches.get(
+            key,
+            fetch=lambda: self.matching_single_flight.do(
+                key, lambda: self._get_matching_jobs_for_candidate(candidate_id, limit, mode, source, filters)
+            ),
+        )
+
+    async def _get_matching_jobs_for_candidate(
+        self,
+        candidate_id: int,
+        limit: int,
+        mode: MatchingMode,
+        source: MatchingSource,
+        filters: MatchingFilters,
+    ) -> List[MatchingJob]:
+        if source == MatchingSource.PRECOMPUTED:
+            return await self._get_precomputed_matching_jobs_for_candidate(candidate_id, limit)
+        if mode == MatchingMode.LOOKUP:
+            return await self._get_matching_jobs_for_candidate_by_template(candidate_id, limit, filters)
+        if mode == MatchingMode.SEMANTIC:
+            return await self._get_semantic_matching_jobs_for_candidate(candidate_id, limit, filters)
+
+        candidate = await self._get_candidate_document(candidate_id)
 
         try:
             jobs = await self.enquiries_es_client.search_with_bool_queries(
-                should_queries=self._extract_queries_from_candidate(candidate),
+                should_queries=self._extract_queries_from_candidate(candidate, filters),
                 size=limit,
+                filter_path=MATCH_HITS_FILTER_PATH,
             )
             return self._extract_jobs_from_es_response(jobs.body)
+        except SearchUnavailableError:
+            raise
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Error fetching jobs: {str(e)}")
 
-    def _extract_queries_from_candidate(self, candidate: CandidatePublic) -> List[dict]:
-        """Extracts all relevant query components for our elasticsearch query from the candidate object.
-        Currently returns the following filters:
+    async def get_matching_jobs_with_facets_for_candidate(
+        self,
+        candidate_id: int,
+        limit: int,
+        facets: List[MatchingFacet],
+        version: Optional[str],
+        filters: MatchingFilters = MatchingFilters(),
+    ) -> MatchingJobsWithFacets:
+        """Retrieves matching jobs for a given candidate_id like `get_matching_jobs_for_candidate` with live matches
+        of the query mode, together with the given facets over all matching jobs. The facets are aggregated by the
+        search that finds the matches and cached per version, so a request for cached facets only runs the
+        search of the matches, which is shared with requests without facets. On a miss identical concurrent requests
+        share one search too.
+
+        Args:
+            candidate_id (int): id of the candidate we want fitting jobs for
+            limit (int): maximum number of fitting jobs we want returned, the facets count all of them
+            facets (List[MatchingFacet]): facets to return
+            version (Optional[str]): version of the matches from `get_matching_jobs_version`, None doesn't cache
+            filters (MatchingFilters): filters of which a job has to fulfill at least one
+
+        Raises:
+            HTTPException: raises a 500 in case that querying or formatting goes wrong
+            SearchUnavailableError: if elasticsearch is unavailable and there is no earlier result of the request
+
+        Returns:
+            MatchingJobsWithFacets: the matching jobs and the buckets of every facet
+        """
+        facet_names = tuple(sorted({facet.value for facet in facets}))
+        key = (candidate_id, version, filters, facet_names)
+        cached = None if version is None else self.facet_cache.get(key)
+        if cached is not None:
+            jobs = await self.get_matching_jobs_for_candidate(candidate_id, limit, filters=filters)
+            return MatchingJobsWithFacets(items=jobs, facets=cached)
+
+        async def fetch() -> MatchingJobsWithFacets:
+            matches = await self._get_matching_jobs_with_facets_for_candidate(candidate_id, limit, facet_names, filters)
+            # Only fresh facets are cached, stale results served while elasticsearch is unavailable aren't
+            if version is not None:
+                self.facet_cache.put(key, matches.facets)
+            return matches
+
+        # A profiled request runs its own search, so the profile shows its own elasticsearch timings
+        if current_profile() is not None:
+            return await fetch()
+        # Coalesced and served stale like `get_matching_jobs_for_candidate`, keyed apart from the matches without facets
+        matches_key = ("facets", candidate_id, limit, filters, facet_names)
+        return await self.stale_matches.get(
+            matches_key, fetch=lambda: self.matching_single_flight.do(matches_key, fetch)
+        )
+
+    async def _get_matching_jobs_with_facets_for_candidate(
+        self,
+        candidate_id: int,
+        limit: int,
+        facet_names: Tuple[str, ...],
+        filters: MatchingFilters,
+    ) -> MatchingJobsWithFacets:
+        candidate = await self._get_candidate_document(candidate_id)
+        try:
+            response = await self.enquiries_es_client.search_with_bool_queries(
+                should_queries=self._extract_queries_from_candidate(candidate, filters),
+                size=limit,
+                filter_path=[*MATCH_HITS_FILTER_PATH, *FACET_FILTER_PATH],
+                aggregations=build_facet_aggregations("jobs", facet_names),
+            )
+            jobs = self._extract_jobs_from_es_response(response.body)
+            facet_buckets = extract_facets(response.body, facet_names)
+        except SearchUnavailableError:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error fetching jobs: {str(e)}")
+        return MatchingJobsWithFacets(items=jobs, facets=facet_buckets)
+
+    async def get_matching_jobs_page_for_candidate(
+        self,
+        candidate_id: int,
+        limit: int,
+        cursor: Optional[str] = None,
+        filters: MatchingFilters = MatchingFilters(),
+    ) -> MatchingJobPage:
+        """Retrieves one page of matching jobs for a given candidate_id, with the same filters as
+        `get_matching_jobs_for_candidate`. Pages are fetched with search_after on a point in time, so walking
+        deep into the matches stays cheap and consistent.
+
+        Args:
+            candidate_id (int): id of the candidate we want fitting jobs for
+            limit (int): number of jobs per page
+            cursor (Optional[str]): next_cursor of the previous page, None for the first page
+            filters (MatchingFilters): filters of which a job has to fulfill at least one
+
+        Raises:
+            InvalidCursorError: if the cursor is invalid or belongs to another candidate or other filters, or expired
+            HTTPException: raises a 500 in case that querying or formatting goes wrong
+
+        Returns:
+            MatchingJobPage: the jobs of this page and the cursor of the next one
+        """
+        resource = f"candidates/{candidate_id}/jobs?{urlencode(filters.model_dump())}"
+        state = decode_cursor(cursor, resource=resource) if cursor else {}
+        candidate = await self._get_candidate_document(candidate_id)
+
+        try:
+            response = await self.enquiries_es_client.search_page(
+                query=self.enquiries_es_client.build_bool_query(
+                    should_queries=self._extract_queries_from_candidate(candidate, filters)
+                ),
+                size=limit,
+                pit_id=state.get("pit_id"),
+                search_after=state.get("search_after"),
+            )
+            hits = response["hits"]["hits"]
+            next_cursor = None
+            if len(hits) == limit:
+                next_cursor = encode_cursor(
+                    {"resource": resource, "pit_id": response["pit_id"], "search_after": hits[-1]["sort"]}
+                )
+            return MatchingJobPage(items=self._extract_jobs_from_es_response(response), next_cursor=next_cursor)
+        except PointInTimeNotFoundError as e:
+            raise InvalidCursorError("The cursor expired, request the first page again.") from e
+        except SearchUnavailableError:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error fetching jobs: {str(e)}")
+
+    async def export_matching_jobs_for_candidate(
+        self, candidate_id: int, filters: MatchingFilters = MatchingFilters()
+    ) -> AsyncIterator[dict]:
+        """Returns an iterator over all matching jobs for a given candidate_id, not only the top ones.
+        The candidate is fetched right away so a missing id raises before anything is streamed,
+        the jobs are fetched with several concurrent slices while iterating.
+
+        Args:
+            candidate_id (int): id of the candidate we want all fitting jobs for
+            filters (MatchingFilters): filters of which a job has to fulfill at least one
+
+        Returns:
+            AsyncIterator[dict]: {"id", "relevance_score"} rows in no particular order
+        """
+        candidate = await self._get_candidate_document(candidate_id)
+        return self._iter_matching_jobs(candidate, filters)
+
+    async def _iter_matching_jobs(self, candidate: CandidateDocument, filters: MatchingFilters) -> AsyncIterator[dict]:
+        query = self.enquiries_es_client.build_bool_query(
+            should_queries=self._extract_queries_from_candidate(candidate, filters)
+        )
+        async for hit in self.enquiries_es_client.iter_sliced_hits(
+            query=query, slices=EXPORT_SLICES, page_size=EXPORT_PAGE_SIZE
+        ):
+            yield {"id": int(hit["_id"]), "relevance_score": hit["_score"]}
+
+    async def _get_precomputed_matching_jobs_for_candidate(self, candidate_id: int, limit: int) -> List[MatchingJob]:
+        """Retrieves the precomputed matching jobs of a candidate with a single key lookup.
+        The matches are ordered by relevance already, so the first `limit` ones are returned.
+
+        Args:
+            candidate_id (int): id of the candidate we want fitting jobs for
+            limit (int): maximum number of fitting jobs we want returned
+
+        Returns:
+            List[MatchingJob]: a list of matching jobs
+        """
+        matches = await self.candidate_matches_es_client.get_entity(id=candidate_id)
+        # The matches were written by the precompute pipeline in this shape, so they are not validated again
+        return [MatchingJob.model_construct(**match) for match in matches["matches"][:limit]]
+
+    async def _get_matching_jobs_for_candidate_by_template(
+        self, candidate_id: int, limit: int, filters: MatchingFilters
+    ) -> List[MatchingJob]:
+        """Retrieves matching jobs with the stored search template.
+        Only the fields needed for matching are fetched and they are passed on without model validation,
+        the query itself is rendered by elasticsearch.
+
+        Args:
+            candidate_id (int): id of the candidate we want fitting jobs for
+            limit (int): maximum number of fitting jobs we want returned
+            filters (MatchingFilters): filters of which a job has to fulfill at least one
+
+        Raises:
+            HTTPException: raises a 500 in case that querying or formatting goes wrong
+            UnsupportedSearchError: if the search backend can't execute search templates
+
+        Returns:
+            List[MatchingJob]: a list of matching jobs
+        """
+        candidate = await self.candidate_es_client.get_entity(id=candidate_id, source_includes=MATCHING_FIELDS)
+        await self.enquiries_es_client.ensure_search_template(
+            id=MATCHING_JOBS_TEMPLATE_ID, source=MATCHING_JOBS_TEMPLATE
+        )
+
+        top_skill_ids = candidate.get("top_skill_ids", [])
+        seniority_filter = self._seniority_filter(candidate.get("seniority_level"))
+
+        try:
+            jobs = await self.enquiries_es_client.search_template(
+                id=MATCHING_JOBS_TEMPLATE_ID,
+                params={
+                    **candidate,
+                    **filters.model_dump(),
+                    "seniority_match": filters.seniority_match and seniority_filter is not None,
+                    "seniority_filter": seniority_filter,
+                    "top_skill_ids": top_skill_ids,
+                    "minimum_should_match": min(2, len(top_skill_ids)),
+                    "size": limit,
+                },
+                filter_path=MATCH_HITS_FILTER_PATH,
+            )
+            return self._extract_jobs_from_es_response(jobs.body)
+        except SearchUnavailableError:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error fetching jobs: {str(e)}")
+
+    async def _get_semantic_matching_jobs_for_candidate(
+        self, candidate_id: int, limit: int, filters: MatchingFilters
+    ) -> List[MatchingJob]:
+        """Retrieves the jobs whose skills are most similar to the ones of the candidate.
+        The nearest neighbours of the skill vector of the candidate among the jobs that fulfill all selected
+        salary and seniority filters are searched in the HNSW graph and reranked, see `api.lib.semantic.rerank`.
+        Similar skills count even if no skill is shared exactly, e.g. React and Vue.
+
+        Args:
+            candidate_id (int): id of the candidate we want fitting jobs for
+            limit (int): maximum number of fitting jobs we want returned
+            filters (MatchingFilters): salary and seniority filters the jobs have to fulfill
+
+        Raises:
+            HTTPException: raises a 500 in case that querying or formatting goes wrong
+            UnsupportedSearchError: if the search backend can't execute kNN searches or the documents have no
+                skill vectors
+
+        Returns:
+            List[MatchingJob]: a list of matching jobs, empty if the candidate has no skills
+        """
+        if not self.enquiries_es_client.supports_knn_search:
+            raise UnsupportedSearchError("The search backend doesn't support kNN searches.")
+        candidate = await self._get_candidate_document(candidate_id)
+        if candidate.skill_vector is None:
+            if candidate.top_skills or candidate.other_skills:
+                raise UnsupportedSearchError("There are no skill vectors, the skill embeddings weren't computed.")
+            return []
+        window = max(limit, SEMANTIC_RERANK_WINDOW)
+
+        try:
+            response = await self.enquiries_es_client.knn_search(
+                field=SKILL_VECTOR_FIELD,
+                query_vector=candidate.skill_vector,
+                k=window,
+                num_candidates=max(window, SEMANTIC_NUM_CANDIDATES),
+                filter=self._extract_filters_from_candidate(candidate, filters),
+                source_includes=RERANK_FIELDS,
+            )
+            return [
+                MatchingJob.model_construct(id=id, relevance_score=score)
+                for id, score in rerank(response, candidate.top_skill_ids, limit)
+            ]
+        except (UnsupportedSearchError, SearchUnavailableError):
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error fetching jobs: {str(e)}")
+
+    async def get_matching_jobs_for_candidates(
+        self, items: List[MatchingBatchItem]
+    ) -> Dict[int, MatchingJobBatchResult]:
+        """Retrieves matching jobs for many candidates at once.
+        Fetches all candidates with a single mget and runs all matching queries with a single msearch,
+        so the number of elasticsearch round trips doesn't depend on the number of candidates.
+
+        Args:
+            items (List[MatchingBatchItem]): ids of the candidates we want fitting jobs for and their limits
+
+        Returns:
+            Dict[int, MatchingJobBatchResult]: matching jobs keyed by candidate id,
+                entries of unknown candidates carry a 404 instead of failing the whole batch
+        """
+        candidates = await self.candidate_es_client.get_entities(ids=[item.id for item in items])
+
+        results: Dict[int, MatchingJobBatchResult] = {}
+        queries = {}
+        for item in items:
+            if item.id not in candidates:
+                results[item.id] = MatchingJobBatchResult(status_code=404, detail=f"Candidate {item.id} not found")
+                continue
+            try:
+                candidate = CandidateDocument.model_validate(candidates[item.id])
+            except ValidationError as e:
+                results[item.id] = MatchingJobBatchResult(status_code=500, detail=f"Invalid candidate: {str(e)}")
+                continue
+            queries[item.id] = self.enquiries_es_client.build_bool_query(
+                should_queries=self._extract_queries_from_candidate(candidate, item.filters),
+                size=item.limit,
+            )
+
+        responses = await self.enquiries_es_client.multi_search(
+            queries=list(queries.values()), filter_path=MATCH_HITS_FILTER_PATH
+        )
+        for candidate_id, response in zip(queries.keys(), responses):
+            if "error" in response:
+                results[candidate_id] = MatchingJobBatchResult(
+                    status_code=response.get("status", 500), detail=f"Error fetching jobs: {response['error']}"
+                )
+            else:
+                results[candidate_id] = MatchingJobBatchResult(
+                    status_code=200, matches=self._extract_jobs_from_es_response(response)
+                )
+
+        return {item.id: results[item.id] for item in items}
+
+    async def percolate_candidates(self, candidates: List[CandidatePublic], limit: int) -> List[PercolateResult]:
+        """Finds the jobs that the given candidates match, e.g. to notify them about a new candidate, without running
+        a matching query per candidate. The candidates are enriched like indexed ones and percolated against the stored
+        matching queries of all jobs with one msearch, see seed_image/percolator.py.
+
+        Args:
+            candidates (List[CandidatePublic]): candidates that don't have to be indexed
+            limit (int): maximum number of job ids returned per candidate
+
+        Raises:
+            HTTPException: raises a 500 in case that querying or formatting goes wrong
+            UnsupportedSearchError: if the search backend has no percolator indices
+
+        Returns:
+            List[PercolateResult]: the ids of the jobs each candidate matches, in the order of the candidates
+        """
+        enricher = get_enricher()
+        documents = [enricher.enrich(candidate.model_dump()) for candidate in candidates]
+
+        try:
+            responses = await self.job_queries_es_client.percolate(documents=documents, size=limit)
+        except (UnsupportedSearchError, SearchUnavailableError):
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error percolating candidates: {str(e)}")
+
+        results = []
+        for response in responses:
+            if "error" in response:
+                raise HTTPException(status_code=500, detail=f"Error percolating candidates: {response['error']}")
+            hits = response.get("hits", {})
+            results.append(
+                PercolateResult(
+                    ids=[int(hit["_id"]) for hit in hits.get("hits", [])], total=hits.get("total", {}).get("value", 0)
+                )
+            )
+        return results
+
+    def _extract_queries_from_candidate(
+        self, candidate: CandidateDocument, filters: MatchingFilters = MatchingFilters()
+    ) -> List[dict]:
+        """Extracts the query components of the selected filters for our elasticsearch query from the candidate object.
+        Salary and seniority are wrapped in constant_score, so they run in filter context, where elasticsearch
+        caches them across requests. Each still adds a flat 1.0 to the score of a job fulfilling it, so jobs
+        fulfilling more filters rank higher like before, and the precomputed matches reproduce it. Only the top
+        skills add a BM25 relevance.
+        Skills and seniorities are compared by the ids and levels added at ingest, so synonyms match and the
+        seniority matches by range, see api.lib.enrichment.
+        Possibly returns the following filters:
             - salary_match_query
             - seniority_match_query
             - top_skills_query
 
         Args:
-            candidate (CandidatePublic): candidate from which the information for the queries will be extracted
+            candidate (CandidateDocument): candidate from which the information for the queries will be extracted
+            filters (MatchingFilters): which of the filters to return
 
         Returns:
             List[dict]: A list of queries that can be used for a should or must query.
                 Could also be done as a named dict or tuple if wanted
         """
-        salary_match_query = {"range": {"max_salary": {"gte": candidate.salary_expectation}}}
-        seniority_match_query = {"term": {"seniorities": candidate.seniority}}
-        top_skill_match_query = {
-            "terms_set": {
-                "top_skills": {
-                    "terms": candidate.top_skills,
-                    "minimum_should_match": min(2, len(candidate.top_skills)),
-                },
-            },
-        }
+        queries = []
+        if filters.salary_match:
+            queries.append(
+                {"constant_score": {"filter": {"range": {"max_salary": {"gte": candidate.salary_expectation}}}}}
+            )
+        if filters.seniority_match:
+            seniority_filter = self._seniority_filter(candidate.seniority_level)
+            # A candidate without a known seniority matches no job by seniority
+            queries.append(
+                {"match_none": {}} if seniority_filter is None else {"constant_score": {"filter": seniority_filter}}
+            )
+        if filters.top_skill_match:
+            queries.append(
+                {
+                    "terms_set": {
+                        "top_skill_ids": {
+                            "terms": candidate.top_skill_ids,
+                            "minimum_should_match": min(2, len(candidate.top_skill_ids)),
+                        },
+                    },
+                }
+            )
+
+        return queries
+
+    def _extract_filters_from_candidate(self, candidate: CandidateDocument, filters: MatchingFilters) -> List[dict]:
+        """Returns the selected salary and seniority filters as queries a job has to match all of,
+        for the semantic mode where the skills are compared by similarity instead."""
+        queries = []
+        if filters.salary_match:
+            queries.append({"range": {"max_salary": {"gte": candidate.salary_expectation}}})
+        if filters.seniority_match:
+            queries.append(self._seniority_filter(candidate.seniority_level) or {"match_none": {}})
+        return queries
 
-        return [salary_match_query, seniority_match_query, top_skill_match_query]
+    @staticmethod
+    def _seniority_filter(seniority_level: Optional[int]) -> Optional[dict]:
+        """Returns the filter for the jobs that accept a candidate of the given seniority level, if it has one."""
+        if seniority_level is None:
+            return None
+        return {"range": {"seniority_levels": accepting_job_levels(seniority_level)}}
 
     def _extract_jobs_from_es_response(self, response: dict) -> List[MatchingJob]:
         """Extracts jobs from a elasticsearch response.
@@ -102,16 +651,17 @@ class CandidateRepository:
         """
         hits = response.get("hits", {}).get("hits", [])
 
-        return [
-            MatchingJob.model_validate({"id": job.get("_id"), "relevance_score": job.get("_score")}) for job in hits
-        ]
+        # One validation of the whole list in pydantic-core is faster than a model_construct per hit
+        return MATCHING_JOBS.validate_python([{"id": hit["_id"], "relevance_score": hit["_score"]} for hit in hits])
 
 
 def get_candidate_repository(
     candidates_es_client: CandidatesElasticsearchDep,
     jobs_es_client: JobsElasticsearchDep,
+    candidate_matches_es_client: CandidateMatchesElasticsearchDep,
+    job_queries_es_client: JobQueriesElasticsearchDep,
 ) -> CandidateRepository:
-    return CandidateRepository(candidates_es_client, jobs_es_client)
+    return CandidateRepository(candidates_es_client, jobs_es_client, candidate_matches_es_client, job_queries_es_client)
 
 
 CandidateRepositoryDep = Annotated[CandidateRepository, Depends(get_candidate_repository)]
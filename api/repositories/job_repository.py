@@ -1,13 +1,77 @@
-from typing import Annotated, List
+from typing import Annotated, AsyncIterator, Dict, List, Optional, Tuple
+from urllib.parse import urlencode
 
 from fastapi import Depends, HTTPException
+from pydantic import ValidationError
 
 from api.lib.elasticsearch.dependencies import (
+    CandidateQueriesElasticsearchDep,
     CandidatesElasticsearchDep,
+    JobMatchesElasticsearchDep,
     JobsElasticsearchDep,
 )
-from api.models.candidate_models import MatchingCandidate
-from api.models.job_models import JobPublic
+from api.lib.elasticsearch.exceptions import PointInTimeNotFoundError, SearchUnavailableError, UnsupportedSearchError
+from api.lib.elasticsearch.resilience import get_stale_results
+from api.lib.enrichment import accepted_candidate_levels, get_enricher
+from api.lib.export import EXPORT_PAGE_SIZE, EXPORT_SLICES
+from api.lib.facets import FACET_FILTER_PATH, build_facet_aggregations, extract_facets, get_facet_cache
+from api.lib.pagination import InvalidCursorError, decode_cursor, encode_cursor
+from api.lib.profiling import current_profile
+from api.lib.search_backend import MATCH_HITS_FILTER_PATH
+from api.lib.semantic import (
+    RERANK_FIELDS,
+    SEMANTIC_NUM_CANDIDATES,
+    SEMANTIC_RERANK_WINDOW,
+    SKILL_VECTOR_FIELD,
+    rerank,
+)
+from api.lib.singleflight import get_single_flight
+from api.lib.snapshot import get_snapshot_store
+from api.models.candidate_models import (
+    MATCHING_CANDIDATES,
+    MatchingCandidate,
+    MatchingCandidateBatchResult,
+    MatchingCandidatePage,
+    MatchingCandidatesWithFacets,
+)
+from api.models.job_models import JobDocument, JobPublic
+from api.models.matching_models import (
+    MatchingBatchItem,
+    MatchingFacet,
+    MatchingFilters,
+    MatchingMode,
+    MatchingSource,
+    PercolateResult,
+)
+
+# Same clauses as `JobRepository._extract_queries_from_job`, rendered by elasticsearch itself.
+# Unselected filters render as match_none, which keeps the JSON valid and matches nothing
+MATCHING_CANDIDATES_TEMPLATE_ID = "matching_candidates_for_job"
+MATCHING_CANDIDATES_TEMPLATE = """{
+  "size": {{size}},
+  "query": {
+    "bool": {
+      "should": [
+        {{#salary_match}}
+        {"constant_score": {"filter": {"range": {"salary_expectation": {"lte": {{max_salary}}}}}}}
+        {{/salary_match}}
+        {{^salary_match}}{"match_none": {}}{{/salary_match}},
+        {{#seniority_match}}
+        {"constant_score": {"filter": {{#toJson}}seniority_filter{{/toJson}}}}
+        {{/seniority_match}}
+        {{^seniority_match}}{"match_none": {}}{{/seniority_match}},
+        {{#top_skill_match}}
+        {"terms_set": {"top_skill_ids": {
+          "terms": {{#toJson}}top_skill_ids{{/toJson}},
+          "minimum_should_match": {{minimum_should_match}}
+        }}}
+        {{/top_skill_match}}
+        {{^top_skill_match}}{"match_none": {}}{{/top_skill_match}}
+      ]
+    }
+  }
+}"""
+MATCHING_FIELDS = ["max_salary", "seniority_levels", "top_skill_ids"]
 
 
 class JobRepository:
@@ -17,13 +81,22 @@ class JobRepository:
         self,
         candidates_es_client: CandidatesElasticsearchDep,
         jobs_es_client: JobsElasticsearchDep,
+        job_matches_es_client: JobMatchesElasticsearchDep,
+        candidate_queries_es_client: CandidateQueriesElasticsearchDep,
     ):
         self.candidate_es_client = candidates_es_client
         self.enquiries_es_client = jobs_es_client
+        self.job_matches_es_client = job_matches_es_client
+        self.candidate_queries_es_client = candidate_queries_es_client
+        self.matching_single_flight = get_single_flight("matching_candidates")
+        self.stale_matches = get_stale_results("matching_candidates")
+        self.facet_cache = get_facet_cache("matching_candidates")
+        self.job_snapshot = get_snapshot_store("jobs")
 
     async def get_job_by_id(self, job_id: int) -> JobPublic:
         """Returns a job for the given id in an api resource compatible format
         We could map the document that we retrieve from elasticsearch into its own pydantic model
+        It is read from the snapshot of the jobs when it is in there, see `api.lib.snapshot`
 
         Args:
             job_id (int): id of the wanted job
@@ -31,57 +104,535 @@ class JobRepository:
         Returns:
             JobPublic: job in an api compatible format
         """
+        if (snapshot_job := self.job_snapshot.get(job_id)) is not None:
+            return JobPublic.model_validate(snapshot_job.source)
         return JobPublic.model_validate(await self.enquiries_es_client.get_entity(id=job_id))
 
-    async def get_matching_candidates_for_job(self, job_id: int, limit: int) -> List[MatchingCandidate]:
+    async def get_versioned_job_by_id(self, job_id: int) -> Tuple[JobPublic, str]:
+        """Returns a job for the given id like `get_job_by_id`, together with the version of its document
+
+        Args:
+            job_id (int): id of the wanted job
+
+        Returns:
+            Tuple[JobPublic, str]: job in an api compatible format and the version of its document
+        """
+        if (snapshot_job := self.job_snapshot.get(job_id)) is None:
+            job, version = await self.enquiries_es_client.get_entity_with_version(id=job_id)
+        else:
+            job, version = snapshot_job
+        return JobPublic.model_validate(job), version
+
+    async def get_matching_candidates_version(self, job_id: int, source: MatchingSource) -> Optional[str]:
+        """Returns a version of everything the matching candidates of a job are computed from: the version of the job
+        and the generation of the candidates index, or the version of the precomputed matches of the job.
+        It changes whenever the matches may have changed, so it can be checked before they are computed.
+
+        Args:
+            job_id (int): id of the job we want fitting candidates for
+            source (MatchingSource): whether the matches are computed or read from the precomputed ones
+
+        Raises:
+            IDNotFoundError: if the job or its precomputed matches don't exist
+
+        Returns:
+            Optional[str]: the version, None while elasticsearch is unavailable and matches may be served stale
+        """
+        try:
+            if source == MatchingSource.PRECOMPUTED:
+                _, version = await self.job_matches_es_client.get_entity_with_version(id=job_id)
+                return version
+            _, version = await self.enquiries_es_client.get_entity_with_version(id=job_id)
+            return f"{version}/{await self.candidate_es_client.get_generation()}"
+        except SearchUnavailableError:
+            return None
+
+    async def _get_job_document(self, job_id: int) -> JobDocument:
+        """Returns a job with the enriched fields the matching queries use."""
+        return JobDocument.model_validate(await self.enquiries_es_client.get_entity(id=job_id))
+
+    async def get_matching_candidates_for_job(
+        self,
+        job_id: int,
+        limit: int,
+        mode: MatchingMode = MatchingMode.QUERY,
+        source: MatchingSource = MatchingSource.LIVE,
+        filters: MatchingFilters = MatchingFilters(),
+    ) -> List[MatchingCandidate]:
         """Retrieves matching candidates for a given job_id.
-        Currently filters by salary, seniorty and top_skills of the given job.
-        Only one of the filters has to be fulfilled.
+        Filters by the selected ones of salary, seniorty and top_skills of the given job.
+        Only one of the selected filters has to be fulfilled.
 
         Args:
             job_id (int): id of the job we want fitting candidates for
             limit (int): maximum number of fitting candidates we want returned
+            mode (MatchingMode): how the matching query is built, see MatchingMode
+            source (MatchingSource): whether to run the matching query or to read the precomputed matches,
+                precomputed matches only exist for all filters selected
+            filters (MatchingFilters): filters of which a candidate has to fulfill at least one
 
         Raises:
             HTTPException: raises a 500 in case that querying or formatting goes wrong
+            SearchUnavailableError: if elasticsearch is unavailable and there is no earlier result of the request
 
         Returns:
             List[MatchingCandidate]: a list of matching candidates
         """
-        job = await self.get_job_by_id(job_id)
+        # A profiled request runs its own search, so the profile shows its own elasticsearch timings
+        if current_profile() is not None:
+            return await self._get_matching_candidates_for_job(job_id, limit, mode, source, filters)
+        # Identical concurrent requests, e.g. for a popular job, share one search
+        # While elasticsearch is unavailable the last result of the same request is served, marked as degraded
+        key = (job_id, limit, mode, source, filters)
+        return await self.stale_matches.get(
+            key,
+            fetch=lambda: self.matching_single_flight.do(
+                key, lambda: self._get_matching_candidates_for_job(job_id, limit, mode, source, filters)
+            ),
+        )
+
+    async def _get_matching_candidates_for_job(
+        self,
+        job_id: int,
+        limit: int,
+        mode: MatchingMode,
+        source: MatchingSource,
+        filters: MatchingFilters,
+    ) -> List[MatchingCandidate]:
+        if source == MatchingSource.PRECOMPUTED:
+            return await self._get_precomputed_matching_candidates_for_job(job_id, limit)
+        if mode == MatchingMode.LOOKUP:
+            return await self._get_matching_candidates_for_job_by_template(job_id, limit, filters)
+        if mode == MatchingMode.SEMANTIC:
+            return await self._get_semantic_matching_candidates_for_job(job_id, limit, filters)
+
+        job = await self._get_job_document(job_id)
 
         try:
             jobs = await self.candidate_es_client.search_with_bool_queries(
-                should_queries=self._extract_queries_from_job(job),
+                should_queries=self._extract_queries_from_job(job, filters),
                 size=limit,
+                filter_path=MATCH_HITS_FILTER_PATH,
             )
             return self._extract_candidates_from_es_response(jobs.body)
+        except SearchUnavailableError:
+            raise
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Error fetching jobs: {str(e)}")
 
-    def _extract_queries_from_job(self, job: JobPublic):
-        """Extracts all relevant query components for our elasticsearch query from the job object.
-        Currently returns the following filters:
+    async def get_matching_candidates_with_facets_for_job(
+        self,
+        job_id: int,
+        limit: int,
+        facets: List[MatchingFacet],
+        version: Optional[str],
+        filters: MatchingFilters = MatchingFilters(),
+    ) -> MatchingCandidatesWithFacets:
+        """Retrieves matching candidates for a given job_id like `get_matching_candidates_for_job` with live matches
+        of the query mode, together with the given facets over all matching candidates. The facets are aggregated by
+        the search that finds the matches and cached per version, so a request for cached facets only runs the
+        search of the matches, which is shared with requests without facets. On a miss identical concurrent requests
+        share one search too.
+
+        Args:
+            job_id (int): id of the job we want fitting candidates for
+            limit (int): maximum number of fitting candidates we want returned, the facets count all of them
+            facets (List[MatchingFacet]): facets to return
+            version (Optional[str]): version of the matches from `get_matching_candidates_version`, None doesn't cache
+            filters (MatchingFilters): filters of which a candidate has to fulfill at least one
+
+        Raises:
+            HTTPException: raises a 500 in case that querying or formatting goes wrong
+            SearchUnavailableError: if elasticsearch is unavailable and there is no earlier result of the request
+
+        Returns:
+            MatchingCandidatesWithFacets: the matching candidates and the buckets of every facet
+        """
+        facet_names = tuple(sorted({facet.value for facet in facets}))
+        key = (job_id, version, filters, facet_names)
+        cached = None if version is None else self.facet_cache.get(key)
+        if cached is not None:
+            candidates = await self.get_matching_candidates_for_job(job_id, limit, filters=filters)
+            return MatchingCandidatesWithFacets(items=candidates, facets=cached)
+
+        async def fetch() -> MatchingCandidatesWithFacets:
+            matches = await self._get_matching_candidates_with_facets_for_job(job_id, limit, facet_names, filters)
+            # Only fresh facets are cached, stale results served while elasticsearch is unavailable aren't
+            if version is not None:
+                self.facet_cache.put(key, matches.facets)
+            return matches
+
+        # A profiled request runs its own search, so the profile shows its own elasticsearch timings
+        if current_profile() is not None:
+            return await fetch()
+        # Coalesced and served stale like `get_matching_candidates_for_job`, keyed apart from the matches without facets
+        matches_key = ("facets", job_id, limit, filters, facet_names)
+        return await self.stale_matches.get(
+            matches_key, fetch=lambda: self.matching_single_flight.do(matches_key, fetch)
+        )
+
+    async def _get_matching_candidates_with_facets_for_job(
+        self,
+        job_id: int,
+        limit: int,
+        facet_names: Tuple[str, ...],
+        filters: MatchingFilters,
+    ) -> MatchingCandidatesWithFacets:
+        job = await self._get_job_document(job_id)
+        try:
+            response = await self.candidate_es_client.search_with_bool_queries(
+                should_queries=self._extract_queries_from_job(job, filters),
+                size=limit,
+                filter_path=[*MATCH_HITS_FILTER_PATH, *FACET_FILTER_PATH],
+                aggregations=build_facet_aggregations("candidates", facet_names),
+            )
+            candidates = self._extract_candidates_from_es_response(response.body)
+            facet_buckets = extract_facets(response.body, facet_names)
+        except SearchUnavailableError:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error fetching candidates: {str(e)}")
+        return MatchingCandidatesWithFacets(items=candidates, facets=facet_buckets)
+
+    async def get_matching_candidates_page_for_job(
+        self,
+        job_id: int,
+        limit: int,
+        cursor: Optional[str] = None,
+        filters: MatchingFilters = MatchingFilters(),
+    ) -> MatchingCandidatePage:
+        """Retrieves one page of matching candidates for a given job_id, with the same filters as
+        `get_matching_candidates_for_job`. Pages are fetched with search_after on a point in time, so walking
+        deep into the matches stays cheap and consistent.
+
+        Args:
+            job_id (int): id of the job we want fitting candidates for
+            limit (int): number of candidates per page
+            cursor (Optional[str]): next_cursor of the previous page, None for the first page
+            filters (MatchingFilters): filters of which a candidate has to fulfill at least one
+
+        Raises:
+            InvalidCursorError: if the cursor is invalid or belongs to another job or other filters, or expired
+            HTTPException: raises a 500 in case that querying or formatting goes wrong
+
+        Returns:
+            MatchingCandidatePage: the candidates of this page and the cursor of the next one
+        """
+        resource = f"jobs/{job_id}/candidates?{urlencode(filters.model_dump())}"
+        state = decode_cursor(cursor, resource=resource) if cursor else {}
+        job = await self._get_job_document(job_id)
+
+        try:
+            response = await self.candidate_es_client.search_page(
+                query=self.candidate_es_client.build_bool_query(
+                    should_queries=self._extract_queries_from_job(job, filters)
+                ),
+                size=limit,
+                pit_id=state.get("pit_id"),
+                search_after=state.get("search_after"),
+            )
+            hits = response["hits"]["hits"]
+            next_cursor = None
+            if len(hits) == limit:
+                next_cursor = encode_cursor(
+                    {"resource": resource, "pit_id": response["pit_id"], "search_after": hits[-1]["sort"]}
+                )
+            return MatchingCandidatePage(
+                items=self._extract_candidates_from_es_response(response), next_cursor=next_cursor
+            )
+        except PointInTimeNotFoundError as e:
+            raise InvalidCursorError("The cursor expired, request the first page again.") from e
+        except SearchUnavailableError:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error fetching candidates: {str(e)}")
+
+    async def export_matching_candidates_for_job(
+        self, job_id: int, filters: MatchingFilters = MatchingFilters()
+    ) -> AsyncIterator[dict]:
+        """Returns an iterator over all matching candidates for a given job_id, not only the top ones.
+        The job is fetched right away so a missing id raises before anything is streamed,
+        the candidates are fetched with several concurrent slices while iterating.
+
+        Args:
+            job_id (int): id of the job we want all fitting candidates for
+            filters (MatchingFilters): filters of which a candidate has to fulfill at least one
+
+        Returns:
+            AsyncIterator[dict]: {"id", "relevance_score"} rows in no particular order
+        """
+        job = await self._get_job_document(job_id)
+        return self._iter_matching_candidates(job, filters)
+
+    async def _iter_matching_candidates(self, job: JobDocument, filters: MatchingFilters) -> AsyncIterator[dict]:
+        query = self.candidate_es_client.build_bool_query(should_queries=self._extract_queries_from_job(job, filters))
+        async for hit in self.candidate_es_client.iter_sliced_hits(
+            query=query, slices=EXPORT_SLICES, page_size=EXPORT_PAGE_SIZE
+        ):
+            yield {"id": int(hit["_id"]), "relevance_score": hit["_score"]}
+
+    async def _get_precomputed_matching_candidates_for_job(self, job_id: int, limit: int) -> List[MatchingCandidate]:
+        """Retrieves the precomputed matching candidates of a job with a single key lookup.
+        The matches are ordered by relevance already, so the first `limit` ones are returned.
+
+        Args:
+            job_id (int): id of the job we want fitting candidates for
+            limit (int): maximum number of fitting candidates we want returned
+
+        Returns:
+            List[MatchingCandidate]: a list of matching candidates
+        """
+        matches = await self.job_matches_es_client.get_entity(id=job_id)
+        # The matches were written by the precompute pipeline in this shape, so they are not validated again
+        return [MatchingCandidate.model_construct(**match) for match in matches["matches"][:limit]]
+
+    async def _get_matching_candidates_for_job_by_template(
+        self, job_id: int, limit: int, filters: MatchingFilters
+    ) -> List[MatchingCandidate]:
+        """Retrieves matching candidates with the stored search template.
+        Only the fields needed for matching are fetched and they are passed on without model validation,
+        the query itself is rendered by elasticsearch.
+
+        Args:
+            job_id (int): id of the job we want fitting candidates for
+            limit (int): maximum number of fitting candidates we want returned
+            filters (MatchingFilters): filters of which a candidate has to fulfill at least one
+
+        Raises:
+            HTTPException: raises a 500 in case that querying or formatting goes wrong
+            UnsupportedSearchError: if the search backend can't execute search templates
+
+        Returns:
+            List[MatchingCandidate]: a list of matching candidates
+        """
+        job = await self.enquiries_es_client.get_entity(id=job_id, source_includes=MATCHING_FIELDS)
+        await self.candidate_es_client.ensure_search_template(
+            id=MATCHING_CANDIDATES_TEMPLATE_ID, source=MATCHING_CANDIDATES_TEMPLATE
+        )
+
+        top_skill_ids = job.get("top_skill_ids", [])
+        seniority_filter = self._seniority_filter(job.get("seniority_levels", []))
+
+        try:
+            candidates = await self.candidate_es_client.search_template(
+                id=MATCHING_CANDIDATES_TEMPLATE_ID,
+                params={
+                    **job,
+                    **filters.model_dump(),
+                    "seniority_match": filters.seniority_match and seniority_filter is not None,
+                    "seniority_filter": seniority_filter,
+                    "top_skill_ids": top_skill_ids,
+                    "minimum_should_match": min(2, len(top_skill_ids)),
+                    "size": limit,
+                },
+                filter_path=MATCH_HITS_FILTER_PATH,
+            )
+            return self._extract_candidates_from_es_response(candidates.body)
+        except SearchUnavailableError:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error fetching candidates: {str(e)}")
+
+    async def _get_semantic_matching_candidates_for_job(
+        self, job_id: int, limit: int, filters: MatchingFilters
+    ) -> List[MatchingCandidate]:
+        """Retrieves the candidates whose skills are most similar to the ones of the job.
+        The nearest neighbours of the skill vector of the job among the candidates that fulfill all selected
+        salary and seniority filters are searched in the HNSW graph and reranked, see `api.lib.semantic.rerank`.
+        Similar skills count even if no skill is shared exactly, e.g. React and Vue.
+
+        Args:
+            job_id (int): id of the job we want fitting candidates for
+            limit (int): maximum number of fitting candidates we want returned
+            filters (MatchingFilters): salary and seniority filters the candidates have to fulfill
+
+        Raises:
+            HTTPException: raises a 500 in case that querying or formatting goes wrong
+            UnsupportedSearchError: if the search backend can't execute kNN searches or the documents have no
+                skill vectors
+
+        Returns:
+            List[MatchingCandidate]: a list of matching candidates, empty if the job has no skills
+        """
+        if not self.candidate_es_client.supports_knn_search:
+            raise UnsupportedSearchError("The search backend doesn't support kNN searches.")
+        job = await self._get_job_document(job_id)
+        if job.skill_vector is None:
+            if job.top_skills or job.other_skills:
+                raise UnsupportedSearchError("There are no skill vectors, the skill embeddings weren't computed.")
+            return []
+        window = max(limit, SEMANTIC_RERANK_WINDOW)
+
+        try:
+            response = await self.candidate_es_client.knn_search(
+                field=SKILL_VECTOR_FIELD,
+                query_vector=job.skill_vector,
+                k=window,
+                num_candidates=max(window, SEMANTIC_NUM_CANDIDATES),
+                filter=self._extract_filters_from_job(job, filters),
+                source_includes=RERANK_FIELDS,
+            )
+            return [
+                MatchingCandidate.model_construct(id=id, relevance_score=score)
+                for id, score in rerank(response, job.top_skill_ids, limit)
+            ]
+        except (UnsupportedSearchError, SearchUnavailableError):
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error fetching candidates: {str(e)}")
+
+    async def get_matching_candidates_for_jobs(
+        self, items: List[MatchingBatchItem]
+    ) -> Dict[int, MatchingCandidateBatchResult]:
+        """Retrieves matching candidates for many jobs at once.
+        Fetches all jobs with a single mget and runs all matching queries with a single msearch,
+        so the number of elasticsearch round trips doesn't depend on the number of jobs.
+
+        Args:
+            items (List[MatchingBatchItem]): ids of the jobs we want fitting candidates for and their limits
+
+        Returns:
+            Dict[int, MatchingCandidateBatchResult]: matching candidates keyed by job id,
+                entries of unknown jobs carry a 404 instead of failing the whole batch
+        """
+        jobs = await self.enquiries_es_client.get_entities(ids=[item.id for item in items])
+
+        results: Dict[int, MatchingCandidateBatchResult] = {}
+        queries = {}
+        for item in items:
+            if item.id not in jobs:
+                results[item.id] = MatchingCandidateBatchResult(status_code=404, detail=f"Job {item.id} not found")
+                continue
+            try:
+                job = JobDocument.model_validate(jobs[item.id])
+            except ValidationError as e:
+                results[item.id] = MatchingCandidateBatchResult(status_code=500, detail=f"Invalid job: {str(e)}")
+                continue
+            queries[item.id] = self.candidate_es_client.build_bool_query(
+                should_queries=self._extract_queries_from_job(job, item.filters),
+                size=item.limit,
+            )
+
+        responses = await self.candidate_es_client.multi_search(
+            queries=list(queries.values()), filter_path=MATCH_HITS_FILTER_PATH
+        )
+        for job_id, response in zip(queries.keys(), responses):
+            if "error" in response:
+                results[job_id] = MatchingCandidateBatchResult(
+                    status_code=response.get("status", 500), detail=f"Error fetching candidates: {response['error']}"
+                )
+            else:
+                results[job_id] = MatchingCandidateBatchResult(
+                    status_code=200, matches=self._extract_candidates_from_es_response(response)
+                )
+
+        return {item.id: results[item.id] for item in items}
+
+    async def percolate_jobs(self, jobs: List[JobPublic], limit: int) -> List[PercolateResult]:
+        """Finds the candidates that the given jobs match, e.g. to notify them about a new job, without running
+        a matching query per job. The jobs are enriched like indexed ones and percolated against the stored
+        matching queries of all candidates with one msearch, see seed_image/percolator.py.
+
+        Args:
+            jobs (List[JobPublic]): jobs that don't have to be indexed
+            limit (int): maximum number of candidate ids returned per job
+
+        Raises:
+            HTTPException: raises a 500 in case that querying or formatting goes wrong
+            UnsupportedSearchError: if the search backend has no percolator indices
+
+        Returns:
+            List[PercolateResult]: the ids of the candidates each job matches, in the order of the jobs
+        """
+        enricher = get_enricher()
+        documents = [enricher.enrich(job.model_dump()) for job in jobs]
+
+        try:
+            responses = await self.candidate_queries_es_client.percolate(documents=documents, size=limit)
+        except (UnsupportedSearchError, SearchUnavailableError):
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error percolating jobs: {str(e)}")
+
+        results = []
+        for response in responses:
+            if "error" in response:
+                raise HTTPException(status_code=500, detail=f"Error percolating jobs: {response['error']}")
+            hits = response.get("hits", {})
+            results.append(
+                PercolateResult(
+                    ids=[int(hit["_id"]) for hit in hits.get("hits", [])], total=hits.get("total", {}).get("value", 0)
+                )
+            )
+        return results
+
+    def _extract_queries_from_job(self, job: JobDocument, filters: MatchingFilters = MatchingFilters()):
+        """Extracts the query components of the selected filters for our elasticsearch query from the job object.
+        Salary and seniority are wrapped in constant_score, so they run in filter context, where elasticsearch
+        caches them across requests. Each still adds a flat 1.0 to the score of a candidate fulfilling it, so
+        candidates fulfilling more filters rank higher like before, and the precomputed matches reproduce it. Only
+        the top skills add a BM25 relevance.
+        Skills and seniorities are compared by the ids and levels added at ingest, so synonyms match and the
+        seniority matches by range, see api.lib.enrichment.
+        Possibly returns the following filters:
             - salary_match_query
             - seniority_match_query
             - top_skills_query
 
         Args:
-            job (JobPublic): job from which the information for the queries will be extracted
+            job (JobDocument): job from which the information for the queries will be extracted
+            filters (MatchingFilters): which of the filters to return
 
         Returns:
             List[dict]: A list of queries that can be used for a should or must query.
                 Could also be done as a named dict or tuple if wanted
         """
-        salary_match_query = {"range": {"salary_expectation": {"lte": job.max_salary}}}
-        seniority_match_query = {"terms": {"seniority": job.seniorities}}
-        top_skill_match_query = {
-            "terms_set": {
-                "top_skills": {"terms": job.top_skills, "minimum_should_match": min(2, len(job.top_skills))},
-            },
-        }
+        queries = []
+        if filters.salary_match:
+            queries.append({"constant_score": {"filter": {"range": {"salary_expectation": {"lte": job.max_salary}}}}})
+        if filters.seniority_match:
+            seniority_filter = self._seniority_filter(job.seniority_levels)
+            # A job without a known seniority matches no candidate by seniority
+            queries.append(
+                {"match_none": {}} if seniority_filter is None else {"constant_score": {"filter": seniority_filter}}
+            )
+        if filters.top_skill_match:
+            queries.append(
+                {
+                    "terms_set": {
+                        "top_skill_ids": {
+                            "terms": job.top_skill_ids,
+                            "minimum_should_match": min(2, len(job.top_skill_ids)),
+                        },
+                    },
+                }
+            )
+
+        return queries
 
-        return [salary_match_query, seniority_match_query, top_skill_match_query]
+    def _extract_filters_from_job(self, job: JobDocument, filters: MatchingFilters) -> List[dict]:
+        """Returns the selected salary and seniority filters as queries a candidate has to match all of,
+        for the semantic mode where the skills are compared by similarity instead."""
+        queries = []
+        if filters.salary_match:
+            queries.append({"range": {"salary_expectation": {"lte": job.max_salary}}})
+        if filters.seniority_match:
+            queries.append(self._seniority_filter(job.seniority_levels) or {"match_none": {}})
+        return queries
+
+    @staticmethod
+    def _seniority_filter(seniority_levels: List[int]) -> Optional[dict]:
+        """Returns the filter for the candidates a job of the given seniority levels accepts, if it has any."""
+        if not seniority_levels:
+            return None
+        return {
+            "bool": {
+                "should": [
+                    {"range": {"seniority_level": accepted_candidate_levels(seniority_level)}}
+                    for seniority_level in seniority_levels
+                ]
+            }
+        }
 
     def _extract_candidates_from_es_response(self, response: dict) -> List[MatchingCandidate]:
         """Extracts candidates from a elasticsearch response.
@@ -94,17 +645,19 @@ class JobRepository:
         """
         hits = response.get("hits", {}).get("hits", [])
 
-        return [
-            MatchingCandidate.model_validate({"id": job.get("_id"), "relevance_score": job.get("_score")})
-            for job in hits
-        ]
+        # One validation of the whole list in pydantic-core is faster than a model_construct per hit
+        return MATCHING_CANDIDATES.validate_python(
+            [{"id": hit["_id"], "relevance_score": hit["_score"]} for hit in hits]
+        )
 
 
 def get_job_repository(
     candidates_es_client: CandidatesElasticsearchDep,
     jobs_es_client: JobsElasticsearchDep,
+    job_matches_es_client: JobMatchesElasticsearchDep,
+    candidate_queries_es_client: CandidateQueriesElasticsearchDep,
 ) -> JobRepository:
-    return JobRepository(candidates_es_client, jobs_es_client)
+    return JobRepository(candidates_es_client, jobs_es_client, job_matches_es_client, candidate_queries_es_client)
 
 
 JobRepositoryDep = Annotated[JobRepository, Depends(get_job_repository)]
@@ -0,0 +1,178 @@
+import math
+from typing import Annotated, Callable, List
+
+from fastapi import Depends, HTTPException
+
+from api.lib.elasticsearch.exceptions import SearchUnavailableError
+from api.lib.search_backend import MATCH_HITS_FILTER_PATH, SearchBackend
+from api.models.candidate_models import CandidateDocument, MutualMatchingCandidate
+from api.models.job_models import JobDocument, MutualMatchingJob
+from api.models.matching_models import MatchingFilters
+from api.repositories.candidate_repository import MATCHING_FIELDS as CANDIDATE_MATCHING_FIELDS
+from api.repositories.candidate_repository import CandidateRepositoryDep
+from api.repositories.job_repository import MATCHING_FIELDS as JOB_MATCHING_FIELDS
+from api.repositories.job_repository import JobRepositoryDep
+
+
+class MutualMatchingRepository:
+    """
+    Finds matches that rank each other highly: the top matches of an entity, restricted to the ones that rank the
+    entity among their own top matches. It takes three elasticsearch round trips no matter how many matches are
+    checked, one for the entity, one for its top matches and one msearch with the reverse query of every match.
+    """
+
+    def __init__(self, candidate_repository: CandidateRepositoryDep, job_repository: JobRepositoryDep):
+        """
+        Args:
+            candidate_repository (CandidateRepositoryDep): builds the queries for the jobs of a candidate
+            job_repository (JobRepositoryDep): builds the queries for the candidates of a job
+        """
+        self.candidate_repository = candidate_repository
+        self.job_repository = job_repository
+
+    async def get_mutual_jobs_for_candidate(
+        self,
+        candidate_id: int,
+        limit: int,
+        reverse_limit: int,
+        filters: MatchingFilters = MatchingFilters(),
+    ) -> List[MutualMatchingJob]:
+        """Retrieves the jobs among the top `limit` matching jobs of a candidate that have the candidate among
+        their top `reverse_limit` matching candidates. Both directions use the same filters.
+
+        Args:
+            candidate_id (int): id of the candidate we want mutually fitting jobs for
+            limit (int): number of top matching jobs that are checked
+            reverse_limit (int): how far down in the matching candidates of a job the candidate may rank
+            filters (MatchingFilters): filters of which a match has to fulfill at least one, in both directions
+
+        Raises:
+            IDNotFoundError: if the candidate doesn't exist
+            HTTPException: raises a 500 in case that querying or formatting goes wrong
+
+        Returns:
+            List[MutualMatchingJob]: the mutually matching jobs by descending combined score
+        """
+        candidate = await self.candidate_repository._get_candidate_document(candidate_id)
+        matches = await self._get_mutual_matches(
+            origin_id=candidate_id,
+            forward_es_client=self.candidate_repository.enquiries_es_client,
+            forward_queries=self.candidate_repository._extract_queries_from_candidate(candidate, filters),
+            forward_fields=JOB_MATCHING_FIELDS,
+            reverse_es_client=self.candidate_repository.candidate_es_client,
+            reverse_queries=lambda source: self.job_repository._extract_queries_from_job(
+                JobDocument.model_construct(**source), filters
+            ),
+            limit=limit,
+            reverse_limit=reverse_limit,
+        )
+        return [MutualMatchingJob.model_construct(**match) for match in matches]
+
+    async def get_mutual_candidates_for_job(
+        self,
+        job_id: int,
+        limit: int,
+        reverse_limit: int,
+        filters: MatchingFilters = MatchingFilters(),
+    ) -> List[MutualMatchingCandidate]:
+        """Retrieves the candidates among the top `limit` matching candidates of a job that have the job among
+        their top `reverse_limit` matching jobs. Both directions use the same filters.
+
+        Args:
+            job_id (int): id of the job we want mutually fitting candidates for
+            limit (int): number of top matching candidates that are checked
+            reverse_limit (int): how far down in the matching jobs of a candidate the job may rank
+            filters (MatchingFilters): filters of which a match has to fulfill at least one, in both directions
+
+        Raises:
+            IDNotFoundError: if the job doesn't exist
+            HTTPException: raises a 500 in case that querying or formatting goes wrong
+
+        Returns:
+            List[MutualMatchingCandidate]: the mutually matching candidates by descending combined score
+        """
+        job = await self.job_repository._get_job_document(job_id)
+        matches = await self._get_mutual_matches(
+            origin_id=job_id,
+            forward_es_client=self.job_repository.candidate_es_client,
+            forward_queries=self.job_repository._extract_queries_from_job(job, filters),
+            forward_fields=CANDIDATE_MATCHING_FIELDS,
+            reverse_es_client=self.job_repository.enquiries_es_client,
+            reverse_queries=lambda source: self.candidate_repository._extract_queries_from_candidate(
+                CandidateDocument.model_construct(**source), filters
+            ),
+            limit=limit,
+            reverse_limit=reverse_limit,
+        )
+        return [MutualMatchingCandidate.model_construct(**match) for match in matches]
+
+    async def _get_mutual_matches(
+        self,
+        *,
+        origin_id: int,
+        forward_es_client: SearchBackend,
+        forward_queries: List[dict],
+        forward_fields: List[str],
+        reverse_es_client: SearchBackend,
+        reverse_queries: Callable[[dict], List[dict]],
+        limit: int,
+        reverse_limit: int,
+    ) -> List[dict]:
+        """Runs the forward search and the reverse searches of all its hits and keeps the mutual matches.
+        The forward hits only carry the fields the reverse queries are built from, which were validated at ingest,
+        so they aren't validated again. The combined score is the geometric mean of both scores, so a match that
+        ranks high in one direction only can't outweigh one that ranks well in both.
+
+        Returns:
+            List[dict]: fields of the mutual matching models, by descending combined score and ascending id
+        """
+        try:
+            forward = await forward_es_client.search_with_bool_queries(
+                should_queries=forward_queries,
+                size=limit,
+                return_source=forward_fields,
+                filter_path=[*MATCH_HITS_FILTER_PATH, "hits.hits._source"],
+            )
+            hits = forward.body.get("hits", {}).get("hits", [])
+            responses = await reverse_es_client.multi_search(
+                queries=[
+                    reverse_es_client.build_bool_query(
+                        should_queries=reverse_queries(hit.get("_source", {})), size=reverse_limit
+                    )
+                    for hit in hits
+                ],
+                filter_path=MATCH_HITS_FILTER_PATH,
+            )
+        except SearchUnavailableError:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error fetching mutual matches: {str(e)}")
+
+        matches = []
+        for hit, response in zip(hits, responses):
+            if "error" in response:
+                raise HTTPException(status_code=500, detail=f"Error fetching mutual matches: {response['error']}")
+            for rank, reverse_hit in enumerate(response.get("hits", {}).get("hits", []), start=1):
+                if int(reverse_hit["_id"]) == origin_id:
+                    matches.append(
+                        {
+                            "id": int(hit["_id"]),
+                            "relevance_score": math.sqrt(hit["_score"] * reverse_hit["_score"]),
+                            "forward_score": hit["_score"],
+                            "reverse_score": reverse_hit["_score"],
+                            "reverse_rank": rank,
+                        }
+                    )
+                    break
+
+        matches.sort(key=lambda match: (-match["relevance_score"], match["id"]))
+        return matches
+
+
+def get_mutual_matching_repository(
+    candidate_repository: CandidateRepositoryDep, job_repository: JobRepositoryDep
+) -> MutualMatchingRepository:
+    return MutualMatchingRepository(candidate_repository, job_repository)
+
+
+MutualMatchingRepositoryDep = Annotated[MutualMatchingRepository, Depends(get_mutual_matching_repository)]
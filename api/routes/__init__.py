@@ -1,7 +1,10 @@
 from fastapi import APIRouter
 
-from api.routes import candidates, jobs
+from api.routes import candidates, health, jobs, metrics, profiles
 
 api_router = APIRouter()
 api_router.include_router(candidates.router)
+api_router.include_router(health.router)
 api_router.include_router(jobs.router)
+api_router.include_router(metrics.router)
+api_router.include_router(profiles.router)
@@ -1,55 +1,276 @@
-from typing import Annotated, List
+from typing import Annotated, Dict, List, Optional, Union
 
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, Header, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
 
-from api.lib.elasticsearch.exceptions import IDNotFoundError
-from api.models.candidate_models import CandidatePublic
-from api.models.job_models import MatchingJob
+from api.lib.elasticsearch.admission import AdmissionLane, admission_lane
+from api.lib.elasticsearch.exceptions import IDNotFoundError, UnsupportedSearchError
+from api.lib.export import streaming_export_response
+from api.lib.http_cache import (
+    ENTITY_CACHE_CONTROL,
+    MATCHES_CACHE_CONTROL,
+    is_not_modified,
+    make_etag,
+    not_modified_response,
+    set_cache_headers,
+)
+from api.lib.pagination import InvalidCursorError
+from api.lib.rendering import json_response
+from api.models.candidate_models import CandidatePercolateRequest, CandidatePublic
+from api.models.job_models import (
+    MATCHING_JOBS,
+    MatchingJob,
+    MatchingJobBatchResult,
+    MatchingJobPage,
+    MatchingJobsWithFacets,
+    MutualMatchingJob,
+)
+from api.models.matching_models import (
+    MatchingBatchRequest,
+    MatchingFacet,
+    MatchingFiltersDep,
+    MatchingMode,
+    MatchingSource,
+    PercolateResult,
+)
 from api.repositories.candidate_repository import CandidateRepositoryDep
+from api.repositories.mutual_repository import MutualMatchingRepositoryDep
 
 router = APIRouter(prefix="/candidates", tags=["candidates"])
 
 
-@router.get("/{id}", response_model=CandidatePublic)
-async def get_candidate_by_id(id: int, candidate_repository: CandidateRepositoryDep) -> CandidatePublic:
+@router.post(
+    "/matches/jobs",
+    response_model=Dict[int, MatchingJobBatchResult],
+    dependencies=[admission_lane(AdmissionLane.BATCH)],
+)
+async def get_jobs_for_candidates(
+    batch: MatchingBatchRequest,
+    candidate_repository: CandidateRepositoryDep,
+) -> Dict[int, MatchingJobBatchResult]:
+    """Returns matching jobs for many candidates in one call
+
+    Args:
+        batch (MatchingBatchRequest): candidate ids we want jobs for together with their limits
+        candidate_repository (CandidateRepositoryDep): Provides functionality to interact with the candidates index
+
+    Returns:
+        Dict[int, MatchingJobBatchResult]: Matching jobs keyed by candidate id, each with its own status code
+    """
+    return await candidate_repository.get_matching_jobs_for_candidates(batch.items)
+
+
+@router.post("/percolate", response_model=List[PercolateResult], dependencies=[admission_lane(AdmissionLane.BATCH)])
+async def percolate_candidates(
+    body: CandidatePercolateRequest,
+    candidate_repository: CandidateRepositoryDep,
+    limit: Annotated[int, Query(ge=1, le=10000)] = 100,
+) -> List[PercolateResult]:
+    """Returns the jobs that match each of the given candidates, which don't have to be indexed yet
+
+    Args:
+        body (CandidatePercolateRequest): the candidates to find matching jobs for
+        candidate_repository (CandidateRepositoryDep): Provides functionality to interact with the candidates index
+        limit (int): maximum number of job ids returned per candidate
+
+    Raises:
+        HTTPException: Throws a 400 if the search backend has no percolator indices
+
+    Returns:
+        List[PercolateResult]: Ids and total number of the matching jobs, in the order of the given candidates
+    """
+    try:
+        return await candidate_repository.percolate_candidates(body.items, limit)
+    except UnsupportedSearchError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.get(
+    "/{id}",
+    response_model=CandidatePublic,
+    responses={304: {"description": "Not modified"}},
+    dependencies=[admission_lane(AdmissionLane.INTERACTIVE)],
+)
+async def get_candidate_by_id(
+    id: int,
+    candidate_repository: CandidateRepositoryDep,
+    response: Response,
+    if_none_match: Annotated[Optional[str], Header()] = None,
+) -> Union[CandidatePublic, Response]:
     """Retrieves a candidate by a given id
 
     Args:
         id (int): candidate id we want to retrieve a candidate for
         candidate_repository (CandidateRepositoryDep): Provides functionality to interact with the candidates index
+        response (Response): gets the ETag and Cache-Control headers
+        if_none_match (Optional[str]): ETags of the versions the client already has
 
     Raises:
         HTTPException: Throws a 404 if entity is not found
 
     Returns:
-        CandidatePublic: Currently same fields as the document in the elasticsearch index
+        Union[CandidatePublic, Response]: Currently same fields as the document in the elasticsearch index,
+            a 304 without body if the client already has the current version
     """
     try:
-        return await candidate_repository.get_candidate_by_id(id)
+        candidate, version = await candidate_repository.get_versioned_candidate_by_id(id)
     except IDNotFoundError:
         raise HTTPException(status_code=404)
 
+    etag = make_etag(version)
+    if is_not_modified(if_none_match, etag):
+        return not_modified_response(etag, ENTITY_CACHE_CONTROL)
+    set_cache_headers(response, etag, ENTITY_CACHE_CONTROL)
+    return candidate
+
 
-@router.get("/{id}/jobs", response_model=List[MatchingJob])
+@router.get(
+    "/{id}/jobs",
+    response_model=Union[List[MatchingJob], MatchingJobPage, MatchingJobsWithFacets],
+    responses={304: {"description": "Not modified"}},
+    dependencies=[admission_lane(AdmissionLane.MATCH)],
+)
 async def get_jobs_for_candidate(
     id: int,
     candidate_repository: CandidateRepositoryDep,
+    filters: MatchingFiltersDep,
+    response: Response,
     limit: Annotated[int, Query(ge=1, le=100)] = 10,
-) -> List[MatchingJob]:
+    mode: MatchingMode = MatchingMode.QUERY,
+    source: MatchingSource = MatchingSource.LIVE,
+    paginate: bool = False,
+    cursor: Optional[str] = None,
+    facets: Annotated[Optional[List[MatchingFacet]], Query()] = None,
+    if_none_match: Annotated[Optional[str], Header()] = None,
+) -> Union[List[MatchingJob], MatchingJobPage, MatchingJobsWithFacets, Response]:
     """Returns a list of matchings jobs for the given candidate
 
     Args:
         id (int): candidate id we want to retrieve a candidate for
         candidate_repository (CandidateRepositoryDep): Provides functionality to interact with the candidates index
         limit (int): maximum number of jobs we want returned
+        mode (MatchingMode): query builds the query in the api, lookup uses a stored search template,
+            semantic ranks by the similarity of the skills with a kNN search
+        source (MatchingSource): live runs the matching query, precomputed reads the materialized top matches
+        paginate (bool): return the first page of a paginated result with a next_cursor instead of a plain list,
+            only for live matches of the query mode
+        cursor (Optional[str]): next_cursor of the previous page, implies paginate
+        facets (Optional[List[MatchingFacet]]): facets over all matches to return together with them, only for live
+            matches of the query mode without pagination
+        filters (MatchingFilters): salary_match, top_skill_match and seniority_match, a match has to fulfill at least
+            one of the selected ones
+        response (Response): gets the ETag and Cache-Control headers, pages aren't cached
+        if_none_match (Optional[str]): ETags of the results the client already has
+
+    Raises:
+        HTTPException: Throws a 404 if entity is not found, a 400 if the search backend doesn't support the mode,
+            the cursor is invalid, precomputed matches are requested with only some of the filters or facets are
+            requested for other matches than live ones of the query mode without pagination, or pagination for other
+            matches than live ones of the query mode
+
+    Returns:
+        Union[List[MatchingJob], MatchingJobPage, MatchingJobsWithFacets, Response]: List of matchings jobs, or a page of them when paginating,
+            together with the facets if requested, a 304 without body if the client already has the current matches
+    """
+    if source == MatchingSource.PRECOMPUTED and not filters.all_selected:
+        raise HTTPException(status_code=400, detail="Precomputed matches are only available with all filters selected")
+    if facets and (mode != MatchingMode.QUERY or source != MatchingSource.LIVE or paginate or cursor):
+        raise HTTPException(
+            status_code=400, detail="Facets are only available for live matches of the query mode without pagination"
+        )
+    if (paginate or cursor) and (mode != MatchingMode.QUERY or source != MatchingSource.LIVE):
+        raise HTTPException(status_code=400, detail="Pagination is only available for live matches of the query mode")
+
+    try:
+        if paginate or cursor:
+            # Every page opens or continues a point in time, a cached page could carry an expired cursor
+            set_cache_headers(response, None, MATCHES_CACHE_CONTROL)
+            page = await candidate_repository.get_matching_jobs_page_for_candidate(id, limit, cursor, filters)
+            return json_response(page.model_dump_json(), response)
+
+        # The version is checked before matching, so a revalidation that is still current doesn't search at all
+        version = await candidate_repository.get_matching_jobs_version(id, source)
+        etag = None if version is None else make_etag(version, limit, mode, source, filters.model_dump(), facets)
+        if etag is not None and is_not_modified(if_none_match, etag):
+            return not_modified_response(etag, MATCHES_CACHE_CONTROL)
+        set_cache_headers(response, etag, MATCHES_CACHE_CONTROL)
+        if facets:
+            with_facets = await candidate_repository.get_matching_jobs_with_facets_for_candidate(
+                id, limit, facets, version, filters
+            )
+            return json_response(with_facets.model_dump_json(), response)
+        matches = await candidate_repository.get_matching_jobs_for_candidate(id, limit, mode, source, filters)
+        return json_response(MATCHING_JOBS.dump_json(matches), response)
+    except IDNotFoundError:
+        raise HTTPException(status_code=404)
+    except (UnsupportedSearchError, InvalidCursorError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.get(
+    "/{id}/mutual-jobs",
+    response_model=List[MutualMatchingJob],
+    dependencies=[admission_lane(AdmissionLane.MATCH)],
+)
+async def get_mutual_jobs_for_candidate(
+    id: int,
+    mutual_matching_repository: MutualMatchingRepositoryDep,
+    filters: MatchingFiltersDep,
+    limit: Annotated[int, Query(ge=1, le=100)] = 10,
+    reverse_limit: Annotated[int, Query(ge=1, le=100)] = 20,
+) -> List[MutualMatchingJob]:
+    """Returns the jobs that fit the candidate and that the candidate fits as well
+
+    Args:
+        id (int): candidate id we want mutually matching jobs for
+        mutual_matching_repository (MutualMatchingRepositoryDep): Matches candidates and jobs in both directions
+        limit (int): how many of the top matching jobs are checked, the maximum number of jobs returned
+        reverse_limit (int): the candidate has to be among this many top matching candidates of a job
+        filters (MatchingFilters): a match has to fulfill at least one of the selected filters, in both directions
+
+    Raises:
+        HTTPException: Throws a 404 if entity is not found
+
+    Returns:
+        List[MutualMatchingJob]: Mutually matching jobs ordered by their combined score
+    """
+    try:
+        return await mutual_matching_repository.get_mutual_jobs_for_candidate(id, limit, reverse_limit, filters)
+    except IDNotFoundError:
+        raise HTTPException(status_code=404)
+
+
+@router.get(
+    "/{id}/jobs/export",
+    response_class=StreamingResponse,
+    responses={200: {"content": {"application/x-ndjson": {}, "text/csv": {}}}},
+    dependencies=[admission_lane(AdmissionLane.EXPORT)],
+)
+async def export_jobs_for_candidate(
+    id: int,
+    candidate_repository: CandidateRepositoryDep,
+    filters: MatchingFiltersDep,
+    accept: Annotated[Optional[str], Header()] = None,
+) -> StreamingResponse:
+    """Streams all matching jobs for the given candidate as NDJSON, or as CSV if the client accepts text/csv
+
+    Args:
+        id (int): candidate id we want all matching jobs for
+        candidate_repository (CandidateRepositoryDep): Provides functionality to interact with the candidates index
+        accept (Optional[str]): Accept header, selects the export format
+        filters (MatchingFilters): a match has to fulfill at least one of the selected filters
 
     Raises:
         HTTPException: Throws a 404 if entity is not found
 
     Returns:
-        List[MatchingJob]: List of matchings jobs
+        StreamingResponse: One {"id", "relevance_score"} row per matching job, in no particular order
     """
     try:
-        return await candidate_repository.get_matching_jobs_for_candidate(id, limit)
+        matches = await candidate_repository.export_matching_jobs_for_candidate(id, filters)
     except IDNotFoundError:
         raise HTTPException(status_code=404)
+
+    return streaming_export_response(
+        matches, fields=["id", "relevance_score"], accept=accept, filename=f"candidate_{id}_jobs"
+    )
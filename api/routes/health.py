@@ -0,0 +1,29 @@
+from fastapi import APIRouter
+from fastapi.responses import ORJSONResponse
+
+from api.lib.startup import check_readiness
+
+router = APIRouter(prefix="/health", tags=["health"])
+
+
+@router.get("/live", include_in_schema=False)
+async def get_liveness() -> ORJSONResponse:
+    """Answers as long as the worker's event loop runs, a failing liveness probe means the worker has to be restarted
+
+    Returns:
+        ORJSONResponse: always 200
+    """
+    return ORJSONResponse({"status": "live"})
+
+
+@router.get("/ready", include_in_schema=False)
+async def get_readiness() -> ORJSONResponse:
+    """Whether the worker should get traffic: it is warmed up, elasticsearch isn't red and the indices exist
+
+    Returns:
+        ORJSONResponse: 200 when ready, 503 otherwise, with the result of every check
+    """
+    ready, checks = await check_readiness()
+    return ORJSONResponse(
+        {"status": "ready" if ready else "not_ready", "checks": checks}, status_code=200 if ready else 503
+    )
@@ -0,0 +1,16 @@
+from fastapi import APIRouter, Response
+
+from api.lib.metrics import render_metrics
+
+router = APIRouter(tags=["metrics"])
+
+
+@router.get("/metrics", include_in_schema=False)
+async def get_metrics() -> Response:
+    """Exposes the metrics of this worker in the prometheus text format
+
+    Returns:
+        Response: all metrics of the process, see api.lib.metrics
+    """
+    content, content_type = render_metrics()
+    return Response(content=content, media_type=content_type)
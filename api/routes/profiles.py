@@ -0,0 +1,31 @@
+from typing import Literal
+
+from fastapi import APIRouter, HTTPException, Response
+from fastapi.responses import HTMLResponse, ORJSONResponse
+
+from api.lib.profiling import get_profile_report
+
+router = APIRouter(prefix="/profiles", tags=["profiles"])
+
+
+@router.get("/{id}", include_in_schema=False)
+async def get_profile(id: str, format: Literal["json", "html"] = "json") -> Response:
+    """Returns the report of a profiled request, linked in its X-Profile-Report header
+
+    Args:
+        id (str): id of the report
+        format (str): "json" for the python samples in the speedscope format together with the per clause
+            elasticsearch timings, "html" for pyinstrument's interactive view of the python samples
+
+    Raises:
+        HTTPException: Throws a 404 if the report doesn't exist (anymore) in this worker
+
+    Returns:
+        Response: the report
+    """
+    report = get_profile_report(id)
+    if report is None:
+        raise HTTPException(status_code=404)
+    if format == "html":
+        return HTMLResponse(report.to_html())
+    return ORJSONResponse(report.to_dict())
@@ -0,0 +1,102 @@
+import asyncio
+
+import pytest
+from fastapi import FastAPI
+from httpx import ASGITransport, AsyncClient
+
+from api.lib.elasticsearch.admission import AdmissionController, AdmissionLane, LaneBudget, admission_lane
+from api.lib.elasticsearch.exceptions import SearchOverloadedError, SearchUnavailableError
+from api.lib.elasticsearch.resilience import search_unavailable_handler
+
+pytestmark = pytest.mark.anyio
+
+
+def controller(max_concurrency: int, **budgets: LaneBudget) -> AdmissionController:
+    default = LaneBudget(concurrency=max_concurrency, queue_size=10, max_wait=1)
+    return AdmissionController(
+        max_concurrency=max_concurrency,
+        budgets={lane: budgets.get(lane.name.lower(), default) for lane in AdmissionLane},
+    )
+
+
+async def hold(admission: AdmissionController, lane: AdmissionLane, release: asyncio.Event, order: list) -> None:
+    async with admission.admit(lane):
+        order.append(lane)
+        await release.wait()
+
+
+async def test_lane_budget_bounds_concurrency():
+    admission = controller(4, export=LaneBudget(concurrency=1, queue_size=10, max_wait=1))
+    release, order = asyncio.Event(), []
+
+    tasks = [asyncio.create_task(hold(admission, AdmissionLane.EXPORT, release, order)) for _ in range(2)]
+    tasks.append(asyncio.create_task(hold(admission, AdmissionLane.INTERACTIVE, release, order)))
+    await asyncio.sleep(0)
+
+    assert admission.in_flight(AdmissionLane.EXPORT) == 1
+    assert admission.queue_depth(AdmissionLane.EXPORT) == 1
+    assert admission.in_flight(AdmissionLane.INTERACTIVE) == 1
+    release.set()
+    await asyncio.gather(*tasks)
+    assert admission.active == 0
+    assert admission.stats(AdmissionLane.EXPORT).queued == 1
+
+
+async def test_free_slot_goes_to_lane_of_higher_priority():
+    admission = controller(1)
+    release, order = asyncio.Event(), []
+
+    tasks = [asyncio.create_task(hold(admission, AdmissionLane.BATCH, release, order))]
+    await asyncio.sleep(0)
+    for lane in (AdmissionLane.EXPORT, AdmissionLane.MATCH, AdmissionLane.INTERACTIVE):
+        tasks.append(asyncio.create_task(hold(admission, lane, release, order)))
+    await asyncio.sleep(0)
+    release.set()
+    await asyncio.gather(*tasks)
+
+    assert order == [AdmissionLane.BATCH, AdmissionLane.INTERACTIVE, AdmissionLane.MATCH, AdmissionLane.EXPORT]
+
+
+async def test_sheds_load_when_queue_is_full_or_wait_exceeds_deadline():
+    admission = controller(1, match=LaneBudget(concurrency=1, queue_size=1, max_wait=0.05))
+    release, order = asyncio.Event(), []
+    holder = asyncio.create_task(hold(admission, AdmissionLane.MATCH, release, order))
+    await asyncio.sleep(0)
+
+    waiter = asyncio.create_task(hold(admission, AdmissionLane.MATCH, release, order))
+    await asyncio.sleep(0)
+    with pytest.raises(SearchOverloadedError):
+        async with admission.admit(AdmissionLane.MATCH):
+            pass
+    with pytest.raises(SearchOverloadedError) as error:
+        await waiter
+    release.set()
+    await holder
+
+    assert error.value.retry_after == 0.05
+    stats = admission.stats(AdmissionLane.MATCH)
+    assert (stats.admitted, stats.rejected, stats.timed_out) == (1, 1, 1)
+    assert admission.queue_depth(AdmissionLane.MATCH) == 0 and admission.active == 0
+
+
+async def test_route_lane_and_overload_response():
+    admission = controller(1)
+    app = FastAPI()
+    app.add_exception_handler(SearchUnavailableError, search_unavailable_handler)
+
+    @app.get("/lookup", dependencies=[admission_lane(AdmissionLane.INTERACTIVE)])
+    async def lookup():
+        async with admission.admit():
+            return admission.in_flight(AdmissionLane.INTERACTIVE)
+
+    @app.get("/overloaded")
+    async def overloaded():
+        raise SearchOverloadedError("busy", retry_after=2)
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        lookup_response = await client.get("/lookup")
+        overloaded_response = await client.get("/overloaded")
+
+    assert lookup_response.json() == 1
+    assert overloaded_response.status_code == 429
+    assert overloaded_response.headers["retry-after"] == "2"
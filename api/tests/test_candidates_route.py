@@ -1,9 +1,26 @@
+import json
+
 import pytest
 from httpx import AsyncClient
 
+from api.lib.elasticsearch.dependencies import (
+    get_candidate_matches_elasticsearch_client,
+    get_jobs_elasticsearch_client,
+)
 from api.lib.elasticsearch.elastic_search_client import ElasticsearchClient
-from api.models.candidate_models import CandidatePublic
-from api.models.job_models import JobPublic, MatchingJob
+from api.lib.elasticsearch.exceptions import PointInTimeNotFoundError
+from api.lib.in_memory import InMemorySearchClient
+from api.main import app
+from api.models.candidate_models import CandidateDocument, CandidatePublic
+from api.models.job_models import JobDocument, JobPublic, MatchingJob
+
+
+class ExpiredPointInTimeClient(InMemorySearchClient):
+    """Answers every page like elasticsearch does once the point in time of the cursor outlived its keep alive"""
+
+    async def search_page(self, **kwargs) -> dict:
+        raise PointInTimeNotFoundError("The point in time of the page on 'jobs' expired.")
+
 
 existing_candidate_id = 201
 non_existing_candidate_id = 99999
@@ -26,13 +43,27 @@ class TestGetCandidateById:
         response = await client.get(f"/candidates/{non_existing_candidate_id}")
         assert response.status_code == 404
 
+    async def test_get_candidate_by_id_not_modified(self, client: AsyncClient):
+        response = await client.get(f"/candidates/{existing_candidate_id}")
+        etag = response.headers["etag"]
+        assert response.headers["cache-control"].startswith("public")
+
+        not_modified = await client.get(f"/candidates/{existing_candidate_id}", headers={"If-None-Match": etag})
+        assert not_modified.status_code == 304
+        assert not_modified.content == b""
+        assert not_modified.headers["etag"] == etag
+
+        other = await client.get(f"/candidates/{existing_candidate_id + 1}", headers={"If-None-Match": etag})
+        assert other.status_code == 200
+        assert other.headers["etag"] != etag
+
 
 class TestGetMatchingJobsForCandidate:
     async def test_get_matching_jobs_fulfills_at_least_one_filter(
         self, client: AsyncClient, candidates_es_client: ElasticsearchClient, jobs_es_client: ElasticsearchClient
     ):
         # Setup
-        candidate = CandidatePublic.model_validate(await candidates_es_client.get_entity(id=existing_candidate_id))
+        candidate = CandidateDocument.model_validate(await candidates_es_client.get_entity(id=existing_candidate_id))
         limit = 15
 
         # Asserting that we succesfully retrieve jobs and that the number of jobs is correct
@@ -43,16 +74,287 @@ class TestGetMatchingJobsForCandidate:
 
         for matching_job in matching_jobs:
             matching_job = MatchingJob.model_validate(matching_job)
-            job = JobPublic.model_validate(await jobs_es_client.get_entity(id=matching_job.id))
+            job = JobDocument.model_validate(await jobs_es_client.get_entity(id=matching_job.id))
 
             # All possible conditions
             salary_match = candidate.salary_expectation <= job.max_salary
             seniority_match = candidate.seniority in job.seniorities
-            top_skills_match = len(set(candidate.top_skills) & set(job.top_skills)) >= min(2, len(candidate.top_skills))
+            top_skills_match = len(set(candidate.top_skill_ids) & set(job.top_skill_ids)) >= min(
+                2, len(candidate.top_skill_ids)
+            )
 
             # At least one has to be true
             assert salary_match or seniority_match or top_skills_match
 
+    async def test_get_matching_lookup_mode_matches_query_mode(self, client: AsyncClient):
+        query_response = await client.get(f"/candidates/{existing_candidate_id}/jobs?limit=20&mode=query")
+        lookup_response = await client.get(f"/candidates/{existing_candidate_id}/jobs?limit=20&mode=lookup")
+
+        assert lookup_response.status_code == 200
+        assert lookup_response.json() == query_response.json()
+
+    async def test_get_matching_lookup_mode_not_found(self, client: AsyncClient):
+        response = await client.get(f"/candidates/{non_existing_candidate_id}/jobs?mode=lookup")
+        assert response.status_code == 404
+
+    async def test_get_matching_semantic_mode_fulfills_all_filters(
+        self, client: AsyncClient, candidates_es_client: ElasticsearchClient, jobs_es_client: ElasticsearchClient
+    ):
+        candidate = CandidateDocument.model_validate(await candidates_es_client.get_entity(id=existing_candidate_id))
+
+        response = await client.get(f"/candidates/{existing_candidate_id}/jobs?limit=10&mode=semantic")
+        assert response.status_code == 200
+        matching_jobs = response.json()
+        assert 0 < len(matching_jobs) <= 10
+
+        scores = [match["relevance_score"] for match in matching_jobs]
+        assert scores == sorted(scores, reverse=True)
+        for matching_job in matching_jobs:
+            job = JobDocument.model_validate(await jobs_es_client.get_entity(id=matching_job["id"]))
+            assert candidate.salary_expectation <= job.max_salary
+            assert candidate.seniority_level in job.seniority_levels
+
+    async def test_get_matching_semantic_mode_on_in_memory_backend(self, client: AsyncClient):
+        app.dependency_overrides[get_jobs_elasticsearch_client] = lambda: InMemorySearchClient("jobs")
+        try:
+            response = await client.get(f"/candidates/{existing_candidate_id}/jobs?mode=semantic")
+        finally:
+            del app.dependency_overrides[get_jobs_elasticsearch_client]
+        assert response.status_code == 400
+
+    async def test_get_matching_semantic_mode_not_found(self, client: AsyncClient):
+        response = await client.get(f"/candidates/{non_existing_candidate_id}/jobs?mode=semantic")
+        assert response.status_code == 404
+
+    async def test_get_matching_precomputed_source(self, client: AsyncClient):
+        live_response = await client.get(f"/candidates/{existing_candidate_id}/jobs?limit=5")
+        precomputed_response = await client.get(f"/candidates/{existing_candidate_id}/jobs?limit=5&source=precomputed")
+
+        assert precomputed_response.status_code == 200
+        precomputed_scores = [match["relevance_score"] for match in precomputed_response.json()]
+        live_scores = [match["relevance_score"] for match in live_response.json()]
+        assert precomputed_scores == pytest.approx(live_scores, rel=1e-4)
+
+    async def test_get_matching_precomputed_source_not_found(self, client: AsyncClient):
+        response = await client.get(f"/candidates/{non_existing_candidate_id}/jobs?source=precomputed")
+        assert response.status_code == 404
+
+    async def test_get_matching_precomputed_source_without_in_memory_data(self, client: AsyncClient):
+        # The seed data has no precomputed matches, the in memory backend can't serve them
+        app.dependency_overrides[get_candidate_matches_elasticsearch_client] = lambda: InMemorySearchClient(
+            "matches_candidates"
+        )
+        try:
+            response = await client.get(f"/candidates/{existing_candidate_id}/jobs?source=precomputed")
+        finally:
+            del app.dependency_overrides[get_candidate_matches_elasticsearch_client]
+        assert response.status_code == 400
+
+    async def test_get_matching_paginated(self, client: AsyncClient):
+        first_page = (await client.get(f"/candidates/{existing_candidate_id}/jobs?limit=5&paginate=true")).json()
+        second_page = (
+            await client.get(
+                f"/candidates/{existing_candidate_id}/jobs", params={"limit": 5, "cursor": first_page["next_cursor"]}
+            )
+        ).json()
+
+        first_ids = [match["id"] for match in first_page["items"]]
+        second_ids = [match["id"] for match in second_page["items"]]
+        assert len(first_ids) == len(second_ids) == 5
+        assert not set(first_ids) & set(second_ids)
+        assert first_page["items"][-1]["relevance_score"] >= second_page["items"][0]["relevance_score"]
+
+    async def test_get_matching_page_with_expired_cursor(self, client: AsyncClient):
+        first_page = (await client.get(f"/candidates/{existing_candidate_id}/jobs?limit=5&paginate=true")).json()
+        app.dependency_overrides[get_jobs_elasticsearch_client] = lambda: ExpiredPointInTimeClient("jobs")
+        try:
+            response = await client.get(
+                f"/candidates/{existing_candidate_id}/jobs", params={"limit": 5, "cursor": first_page["next_cursor"]}
+            )
+        finally:
+            del app.dependency_overrides[get_jobs_elasticsearch_client]
+
+        assert response.status_code == 400
+        assert "expired" in response.json()["detail"]
+
+    async def test_get_matching_not_modified(self, client: AsyncClient):
+        response = await client.get(f"/candidates/{existing_candidate_id}/jobs?limit=5")
+        etag = response.headers["etag"]
+
+        not_modified = await client.get(
+            f"/candidates/{existing_candidate_id}/jobs?limit=5", headers={"If-None-Match": etag}
+        )
+        assert not_modified.status_code == 304
+        assert not_modified.content == b""
+
+        for params in ("limit=6", "limit=5&salary_match=false"):
+            changed = await client.get(
+                f"/candidates/{existing_candidate_id}/jobs?{params}", headers={"If-None-Match": etag}
+            )
+            assert changed.status_code == 200
+            assert changed.headers["etag"] != etag
+
+    async def test_get_matching_paginated_is_not_cached(self, client: AsyncClient):
+        response = await client.get(f"/candidates/{existing_candidate_id}/jobs?limit=5&paginate=true")
+        assert response.headers["cache-control"] == "no-store"
+        assert "etag" not in response.headers
+
+    async def test_get_matching_paginated_invalid_cursor(self, client: AsyncClient):
+        first_page = (await client.get(f"/candidates/{existing_candidate_id}/jobs?limit=5&paginate=true")).json()
+
+        response = await client.get(
+            f"/candidates/{non_existing_candidate_id}/jobs", params={"cursor": first_page["next_cursor"]}
+        )
+        assert response.status_code == 400
+
+    async def test_get_matching_with_facets(self, client: AsyncClient):
+        matches = (await client.get(f"/candidates/{existing_candidate_id}/jobs?limit=5")).json()
+
+        response = await client.get(
+            f"/candidates/{existing_candidate_id}/jobs", params={"limit": 5, "facets": ["seniority", "salary"]}
+        )
+
+        assert response.status_code == 200
+        assert response.json()["items"] == matches
+        facets = response.json()["facets"]
+        assert set(facets) == {"seniority", "salary"}
+        assert sum(bucket["doc_count"] for bucket in facets["salary"]) >= len(matches)
+        assert all(bucket["key"] % 10000 == 0 for bucket in facets["salary"])
+        assert all(bucket["key"] == bucket["key"].lower() for bucket in facets["seniority"])
+
+    async def test_get_matching_with_facets_and_pagination(self, client: AsyncClient):
+        response = await client.get(f"/candidates/{existing_candidate_id}/jobs?facets=top_skills&paginate=true")
+        assert response.status_code == 400
+
+    async def test_get_matching_jobs_with_selected_filters_only(
+        self, client: AsyncClient, candidates_es_client: ElasticsearchClient, jobs_es_client: ElasticsearchClient
+    ):
+        candidate = CandidatePublic.model_validate(await candidates_es_client.get_entity(id=existing_candidate_id))
+
+        response = await client.get(
+            f"/candidates/{existing_candidate_id}/jobs?limit=10&top_skill_match=false&seniority_match=false"
+        )
+        assert response.status_code == 200
+
+        for matching_job in response.json():
+            job = JobPublic.model_validate(await jobs_es_client.get_entity(id=matching_job["id"]))
+            assert candidate.salary_expectation <= job.max_salary
+
+    async def test_get_matching_without_filters(self, client: AsyncClient):
+        response = await client.get(
+            f"/candidates/{existing_candidate_id}/jobs?salary_match=false&top_skill_match=false&seniority_match=false"
+        )
+        assert response.status_code == 422
+
+    async def test_get_matching_precomputed_source_with_selected_filters(self, client: AsyncClient):
+        response = await client.get(f"/candidates/{existing_candidate_id}/jobs?source=precomputed&salary_match=false")
+        assert response.status_code == 400
+
     async def test_get_matching_jobs_for_candidate_not_found(self, client: AsyncClient):
         response = await client.get(f"/candidates/{non_existing_candidate_id}/jobs")
         assert response.status_code == 404
+
+
+class TestGetMutualJobsForCandidate:
+    async def test_get_mutual_jobs_rank_each_other(self, client: AsyncClient):
+        response = await client.get(f"/candidates/{existing_candidate_id}/mutual-jobs?limit=20&reverse_limit=20")
+        assert response.status_code == 200
+        mutual_jobs = response.json()
+
+        forward_ids = [
+            match["id"] for match in (await client.get(f"/candidates/{existing_candidate_id}/jobs?limit=20")).json()
+        ]
+        scores = [match["relevance_score"] for match in mutual_jobs]
+        assert scores == sorted(scores, reverse=True)
+        for mutual_job in mutual_jobs:
+            assert mutual_job["id"] in forward_ids
+            reverse_ids = [
+                match["id"] for match in (await client.get(f"/jobs/{mutual_job['id']}/candidates?limit=20")).json()
+            ]
+            assert existing_candidate_id in reverse_ids
+            assert mutual_job["relevance_score"] == pytest.approx(
+                (mutual_job["forward_score"] * mutual_job["reverse_score"]) ** 0.5
+            )
+
+    async def test_get_mutual_jobs_not_found(self, client: AsyncClient):
+        response = await client.get(f"/candidates/{non_existing_candidate_id}/mutual-jobs")
+        assert response.status_code == 404
+
+
+class TestPercolateCandidates:
+    async def test_percolate_candidates_returns_matching_jobs(
+        self, client: AsyncClient, candidates_es_client: ElasticsearchClient, jobs_es_client: ElasticsearchClient
+    ):
+        candidate = CandidateDocument.model_validate(await candidates_es_client.get_entity(id=existing_candidate_id))
+        new_candidate = CandidatePublic.model_validate(candidate.model_dump()).model_dump()
+
+        response = await client.post("/candidates/percolate?limit=10", json={"items": [new_candidate]})
+        assert response.status_code == 200
+        (result,) = response.json()
+        assert 0 < len(result["ids"]) <= 10 <= result["total"]
+
+        for job_id in result["ids"]:
+            job = JobDocument.model_validate(await jobs_es_client.get_entity(id=job_id))
+            # The stored query of the job, so the top skills are compared from the side of the job
+            salary_match = candidate.salary_expectation <= job.max_salary
+            seniority_match = candidate.seniority_level in job.seniority_levels
+            top_skills_match = len(set(candidate.top_skill_ids) & set(job.top_skill_ids)) >= min(
+                2, len(job.top_skill_ids)
+            )
+            assert salary_match or seniority_match or top_skills_match
+
+    async def test_percolate_candidates_without_candidates(self, client: AsyncClient):
+        response = await client.post("/candidates/percolate", json={"items": []})
+        assert response.status_code == 422
+
+
+class TestGetMatchingJobsForCandidates:
+    async def test_get_matching_jobs_for_candidates(self, client: AsyncClient):
+        response = await client.post(
+            "/candidates/matches/jobs",
+            json={"items": [{"id": existing_candidate_id, "limit": 5}, {"id": non_existing_candidate_id}]},
+        )
+        assert response.status_code == 200
+        results = response.json()
+
+        assert results[str(existing_candidate_id)]["status_code"] == 200
+        assert len(results[str(existing_candidate_id)]["matches"]) == 5
+        assert results[str(non_existing_candidate_id)]["status_code"] == 404
+        assert results[str(non_existing_candidate_id)]["matches"] == []
+
+    async def test_get_matching_jobs_for_candidates_matches_single_route(self, client: AsyncClient):
+        single_response = await client.get(f"/candidates/{existing_candidate_id}/jobs?limit=10")
+        batch_response = await client.post("/candidates/matches/jobs", json={"items": [{"id": existing_candidate_id}]})
+
+        assert batch_response.json()[str(existing_candidate_id)]["matches"] == single_response.json()
+
+    async def test_get_matching_jobs_for_candidates_duplicate_ids(self, client: AsyncClient):
+        response = await client.post(
+            "/candidates/matches/jobs", json={"items": [{"id": existing_candidate_id}, {"id": existing_candidate_id}]}
+        )
+        assert response.status_code == 422
+
+
+class TestExportMatchingJobsForCandidate:
+    async def test_export_matching_jobs_as_ndjson(self, client: AsyncClient):
+        response = await client.get(f"/candidates/{existing_candidate_id}/jobs/export")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+
+        rows = [json.loads(line) for line in response.text.splitlines()]
+        top_matches = (await client.get(f"/candidates/{existing_candidate_id}/jobs?limit=10")).json()
+        assert len({row["id"] for row in rows}) == len(rows)
+        assert {match["id"] for match in top_matches} <= {row["id"] for row in rows}
+
+    async def test_export_matching_jobs_as_csv(self, client: AsyncClient):
+        response = await client.get(f"/candidates/{existing_candidate_id}/jobs/export", headers={"Accept": "text/csv"})
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/csv")
+
+        lines = response.text.splitlines()
+        assert lines[0] == "id,relevance_score"
+        assert len(lines) > 1
+
+    async def test_export_matching_jobs_not_found(self, client: AsyncClient):
+        response = await client.get(f"/candidates/{non_existing_candidate_id}/jobs/export")
+        assert response.status_code == 404
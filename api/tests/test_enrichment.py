@@ -0,0 +1,113 @@
+import copy
+import importlib.util
+import json
+from pathlib import Path
+
+import pytest
+
+from api.lib import enrichment
+from api.lib.enrichment import UNKNOWN_SKILL_ID_OFFSET, Enricher, accepted_candidate_levels, accepting_job_levels
+
+SEED_IMAGE_PATH = Path(__file__).parents[2] / "seed_image"
+
+
+class TestEnricher:
+    def test_synonyms_share_an_id(self):
+        enricher = Enricher()
+
+        assert enricher.skill_id("Softwareentwicklung") == enricher.skill_id("Software Development")
+        assert enricher.skill_id(" software  DEVELOPMENT ") == enricher.skill_id("Software Development")
+        assert enricher.skill_id("Golang") == enricher.skill_id("Go")
+        assert enricher.skill_id("Python") != enricher.skill_id("Java")
+
+    def test_unknown_skill_gets_a_stable_id(self):
+        enricher = Enricher()
+
+        skill_id = enricher.skill_id("Some Skill Nobody Has")
+        assert skill_id >= UNKNOWN_SKILL_ID_OFFSET
+        assert skill_id == Enricher().skill_id("some skill nobody has")
+
+    def test_enrich_adds_ids_and_levels(self):
+        job = Enricher().enrich(
+            {"top_skills": ["Go", "Golang", "Python"], "other_skills": [], "seniorities": ["senior", "junior", "x"]}
+        )
+
+        assert len(job["top_skill_ids"]) == 2
+        assert job["other_skill_ids"] == []
+        assert job["seniority_levels"] == [1, 3]
+
+    def test_partial_document_only_gets_its_fields(self):
+        assert Enricher().enrich({"seniority": "midlevel"}) == {"seniority": "midlevel", "seniority_level": 2}
+
+
+def load_seed_enrichment():
+    """Imports seed_image/enrichment.py, the enrichment of the seeder, which isn't part of the api package."""
+    pytest.importorskip("numpy")
+    spec = importlib.util.spec_from_file_location("seed_enrichment", SEED_IMAGE_PATH / "enrichment.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class TestEnrichmentParity:
+    """The api enriches like the seeder, else queries built from api-side ids or levels silently match wrongly."""
+
+    def test_constants_match_seeder(self):
+        seed_enrichment = load_seed_enrichment()
+
+        assert enrichment.SENIORITY_LEVELS == seed_enrichment.SENIORITY_LEVELS
+        assert enrichment.UNKNOWN_SKILL_ID_OFFSET == seed_enrichment.UNKNOWN_SKILL_ID_OFFSET
+        assert enrichment.SKILL_ID_FIELDS == seed_enrichment.SKILL_ID_FIELDS
+        assert enrichment.SENIORITY_LEVELS_BELOW == seed_enrichment.SENIORITY_LEVELS_BELOW
+        assert enrichment.SENIORITY_LEVELS_ABOVE == seed_enrichment.SENIORITY_LEVELS_ABOVE
+
+    @pytest.mark.parametrize("index", ["jobs", "candidates"])
+    def test_seed_data_is_enriched_like_by_seeder(self, index: str, tmp_path: Path):
+        seed_enrichment = load_seed_enrichment()
+        # Skill vectors only exist on the seeder side
+        seed_enricher = seed_enrichment.Enricher(embeddings_path=tmp_path / "missing.npz")
+        enricher = Enricher()
+
+        with open(SEED_IMAGE_PATH / "data" / f"{index}.json", encoding="utf-8") as file_pointer:
+            sources = [action["_source"] for action in json.load(file_pointer)]
+        for source in [*sources, {"top_skills": ["Some Skill Nobody Has", "golang"], "seniority": " Senior "}]:
+            assert enricher.enrich(copy.deepcopy(source)) == seed_enricher.enrich(copy.deepcopy(source))
+
+    def test_seniority_ranges_match_seeder(self):
+        seed_enrichment = load_seed_enrichment()
+        levels = list(enrichment.SENIORITY_LEVELS.values())
+
+        for job_level in levels:
+            for candidate_level in levels:
+                accepts = seed_enrichment.accepts(job_level, candidate_level)
+                job_range = accepting_job_levels(candidate_level)
+                candidate_range = accepted_candidate_levels(job_level)
+                assert accepts == (job_range["gte"] <= job_level <= job_range["lte"])
+                assert accepts == (candidate_range["gte"] <= candidate_level <= candidate_range["lte"])
+
+
+class TestSeedSkillVectors:
+    @pytest.fixture
+    def seed_enricher(self, tmp_path):
+        seed_enrichment = load_seed_enrichment()
+        np = pytest.importorskip("numpy")
+        enricher = seed_enrichment.Enricher(embeddings_path=tmp_path / "missing.npz")
+        skill_ids = [enricher.skill_id(skill) for skill in ["Python", "Java", "Go"]]
+        np.savez(tmp_path / "skill_embeddings.npz", ids=skill_ids, vectors=np.eye(3, dtype=np.float32))
+        return seed_enrichment.Enricher(embeddings_path=tmp_path / "skill_embeddings.npz")
+
+    def test_update_of_other_skills_recomputes_the_vector_with_the_stored_top_skills(self, seed_enricher):
+        stored = seed_enricher.enrich({"top_skills": ["Python"], "other_skills": ["Java"]})
+
+        update = seed_enricher.enrich({"other_skills": ["Go"]}, {"top_skills": ["Python"], "other_skills": ["Java"]})
+
+        expected = seed_enricher.enrich({"top_skills": ["Python"], "other_skills": ["Go"]})
+        assert update["skill_vector"] == pytest.approx(expected["skill_vector"])
+        assert update["skill_vector"] != pytest.approx(stored["skill_vector"])
+        assert update["other_skill_ids"] == expected["other_skill_ids"]
+        assert "top_skill_ids" not in update
+
+    def test_update_without_embedded_skills_removes_the_vector(self, seed_enricher):
+        update = seed_enricher.enrich({"top_skills": ["Cobol"]}, {"other_skills": []})
+
+        assert update["skill_vector"] is None
@@ -0,0 +1,71 @@
+import pytest
+
+from api.lib.elasticsearch.entity_cache import CachedEntity, EntityCache
+
+pytestmark = pytest.mark.anyio
+
+
+def loader(entity: CachedEntity | None, calls: list[str], name: str):
+    async def load():
+        calls.append(name)
+        return entity
+
+    return load
+
+
+class TestEntityCache:
+    async def test_get_caches_entity(self):
+        cache = EntityCache(max_size=10, ttl=60)
+        calls = []
+        entity = CachedEntity(source={"seniority": "senior"}, seq_no=1, primary_term=1)
+
+        for _ in range(3):
+            result = await cache.get(
+                1, fetch=loader(entity, calls, "fetch"), fetch_version=loader(None, calls, "version")
+            )
+            assert result.source == {"seniority": "senior"}
+
+        assert calls == ["fetch"]
+        assert (cache.stats.misses, cache.stats.hits) == (1, 2)
+
+    async def test_lru_eviction(self):
+        cache = EntityCache(max_size=2, ttl=60)
+        for id in (1, 2, 3):
+            cache.put(id, CachedEntity(source={}, seq_no=id, primary_term=1))
+
+        assert cache.peek(1) is None
+        assert cache.peek(3) is not None
+        assert cache.stats.evictions == 1
+
+    async def test_stale_entry_is_revalidated_by_version(self):
+        cache = EntityCache(max_size=10, ttl=0)
+        calls = []
+        entity = CachedEntity(source={"max_salary": 1}, seq_no=1, primary_term=1)
+        await cache.get(1, fetch=loader(entity, calls, "fetch"), fetch_version=loader(None, calls, "version"))
+
+        unchanged = CachedEntity(source={}, seq_no=1, primary_term=1)
+        await cache.get(1, fetch=loader(entity, calls, "fetch"), fetch_version=loader(unchanged, calls, "version"))
+        assert calls == ["fetch", "version"]
+        assert cache.stats.revalidations == 1
+
+        changed = CachedEntity(source={"max_salary": 2}, seq_no=2, primary_term=1)
+        result = await cache.get(
+            1, fetch=loader(changed, calls, "fetch"), fetch_version=loader(changed, calls, "version")
+        )
+        assert calls == ["fetch", "version", "version", "fetch"]
+        assert result.source == {"max_salary": 2}
+        assert cache.stats.invalidations == 1
+
+    async def test_entry_of_previous_index_version_is_invalidated(self):
+        cache = EntityCache(max_size=10, ttl=0)
+        calls = []
+        entity = CachedEntity(source={"max_salary": 1}, seq_no=1, primary_term=1, index="jobs_v1")
+        await cache.get(1, fetch=loader(entity, calls, "fetch"), fetch_version=loader(None, calls, "version"))
+
+        # Same sequence number, but read through the alias after it was swapped to a new version
+        reindexed = CachedEntity(source={"max_salary": 2}, seq_no=1, primary_term=1, index="jobs_v2")
+        result = await cache.get(
+            1, fetch=loader(reindexed, calls, "fetch"), fetch_version=loader(reindexed, calls, "version")
+        )
+        assert calls == ["fetch", "version", "fetch"]
+        assert result.source == {"max_salary": 2}
@@ -0,0 +1,52 @@
+from api.lib.enrichment import get_enricher
+from api.lib.facets import FacetCache, build_facet_aggregations, extract_facets
+
+
+class TestFacets:
+    def test_build_facet_aggregations_uses_fields_of_index(self):
+        aggregations = build_facet_aggregations("candidates", ["seniority", "salary"])
+
+        assert aggregations["seniority"]["terms"]["field"] == "seniority"
+        assert aggregations["salary"]["histogram"]["field"] == "salary_expectation"
+        assert build_facet_aggregations("jobs", ["seniority"])["seniority"]["terms"]["field"] == "seniorities"
+
+    def test_extract_facets_from_filtered_response(self):
+        response = {
+            "hits": {"hits": []},
+            "aggregations": {"salary": {"buckets": [{"key": 50000.0, "doc_count": 3}]}},
+        }
+
+        assert extract_facets(response, ["salary", "top_skills"]) == {
+            "salary": [{"key": 50000, "doc_count": 3}],
+            "top_skills": [],
+        }
+
+    def test_skills_are_aggregated_by_id_and_keyed_by_name(self):
+        enricher = get_enricher()
+        unknown_skill_id = enricher.skill_id("not a skill of the dictionary")
+        response = {
+            "aggregations": {
+                "top_skills": {
+                    "buckets": [
+                        {"key": enricher.skill_id("Abnahme Test"), "doc_count": 2},
+                        {"key": unknown_skill_id, "doc_count": 1},
+                    ]
+                }
+            }
+        }
+
+        assert build_facet_aggregations("jobs", ["top_skills"])["top_skills"]["terms"]["field"] == "top_skill_ids"
+        assert extract_facets(response, ["top_skills"]) == {
+            "top_skills": [{"key": "Acceptance Testing", "doc_count": 2}, {"key": unknown_skill_id, "doc_count": 1}]
+        }
+
+    def test_cache_evicts_least_recently_used(self):
+        cache = FacetCache(max_size=2)
+        cache.put("a", {"salary": []})
+        cache.put("b", {"salary": []})
+        assert cache.get("a") is not None
+        cache.put("c", {"salary": []})
+
+        assert cache.get("b") is None
+        assert cache.get("a") is not None
+        assert (cache.stats.hits, cache.stats.misses, cache.stats.evictions) == (2, 1, 1)
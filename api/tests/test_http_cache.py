@@ -0,0 +1,21 @@
+from api.lib.http_cache import is_not_modified, make_etag
+
+
+class TestHttpCache:
+    def test_etag_is_strong_and_depends_on_all_parts(self):
+        etag = make_etag("jobs_v3/1/42", 10, {"salary_match": True})
+
+        assert etag.startswith('"') and etag.endswith('"')
+        assert etag == make_etag("jobs_v3/1/42", 10, {"salary_match": True})
+        assert etag != make_etag("jobs_v3/1/43", 10, {"salary_match": True})
+        assert etag != make_etag("jobs_v3/1/42", 10, {"salary_match": False})
+
+    def test_if_none_match_lists_wildcard_and_weak_tags(self):
+        etag = make_etag("version")
+
+        assert is_not_modified(etag, etag)
+        assert is_not_modified(f'"other", {etag}', etag)
+        assert is_not_modified(f"W/{etag}", etag)
+        assert is_not_modified("*", etag)
+        assert not is_not_modified('"other"', etag)
+        assert not is_not_modified(None, etag)
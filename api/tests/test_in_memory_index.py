@@ -0,0 +1,102 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from api.lib.enrichment import Enricher
+from api.lib.in_memory.in_memory_index import InMemoryIndex
+
+DATA_PATH = Path(__file__).parents[2] / "seed_image" / "data"
+
+
+@pytest.fixture(scope="module")
+def jobs_index() -> InMemoryIndex:
+    with open(DATA_PATH / "jobs.json", encoding="utf-8") as file_pointer:
+        return InMemoryIndex({action["_id"]: action["_source"] for action in json.load(file_pointer)})
+
+
+class TestInMemoryIndex:
+    def test_matching_reproduces_or_semantics(self, jobs_index: InMemoryIndex):
+        candidate = {"top_skills": ["Python", "AWS", "Docker"], "seniority": "junior", "salary_expectation": 55000}
+        query = {
+            "bool": {
+                "should": [
+                    {"range": {"max_salary": {"gte": candidate["salary_expectation"]}}},
+                    {"term": {"seniorities": candidate["seniority"]}},
+                    {"terms_set": {"top_skills": {"terms": candidate["top_skills"], "minimum_should_match": 2}}},
+                ]
+            }
+        }
+
+        total, hits = jobs_index.search(query, size=len(jobs_index))
+
+        expected_ids = set()
+        for id, job in zip(jobs_index.ids, jobs_index.sources):
+            top_skills = {skill.lower() for skill in job["top_skills"]}
+            if (
+                job["max_salary"] >= candidate["salary_expectation"]
+                or candidate["seniority"] in job["seniorities"]
+                or len(top_skills & {skill.lower() for skill in candidate["top_skills"]}) >= 2
+            ):
+                expected_ids.add(id)
+        assert total == len(expected_ids)
+        assert {id for id, _ in hits} == expected_ids
+
+    def test_scores_sum_matching_clauses(self, jobs_index: InMemoryIndex):
+        salary_query = {"range": {"max_salary": {"gte": 100000}}}
+        skill_query = {"terms_set": {"top_skills": {"terms": ["python", "django"], "minimum_should_match": 1}}}
+
+        _, hits = jobs_index.search({"bool": {"should": [salary_query, skill_query]}}, size=len(jobs_index))
+        scores = [score for _, score in hits]
+
+        assert scores == sorted(scores, reverse=True)
+        assert all(score >= 1.0 for score in scores)
+        assert scores[0] > 1.0
+
+    def test_filter_context_does_not_score(self, jobs_index: InMemoryIndex):
+        _, hits = jobs_index.search({"bool": {"filter": [{"terms": {"seniorities": ["JUNIOR"]}}]}}, size=5)
+
+        assert len(hits) == 5
+        assert all(score == 0.0 for _, score in hits)
+
+    def test_match_none(self, jobs_index: InMemoryIndex):
+        total, hits = jobs_index.search({"bool": {"should": [{"match_none": {}}]}})
+
+        assert total == 0
+        assert hits == []
+
+    def test_aggregate_counts_matching_documents(self, jobs_index: InMemoryIndex):
+        query = {"range": {"max_salary": {"gte": 90000}}}
+        aggregations = {
+            "seniority": {"terms": {"field": "seniorities", "size": 2}},
+            "salary": {"histogram": {"field": "max_salary", "interval": 10000, "min_doc_count": 1}},
+        }
+
+        result = jobs_index.aggregate(query, aggregations)
+
+        matching = [job for job in jobs_index.sources if job["max_salary"] >= 90000]
+        assert sum(bucket["doc_count"] for bucket in result["salary"]["buckets"]) == len(matching)
+        assert result["salary"]["buckets"][0]["key"] == 90000.0
+        seniorities = [bucket["key"] for bucket in result["seniority"]["buckets"]]
+        assert len(seniorities) == 2
+        for bucket in result["seniority"]["buckets"]:
+            assert bucket["doc_count"] == sum(
+                bucket["key"] in {seniority.lower() for seniority in job["seniorities"]} for job in matching
+            )
+
+    def test_aggregate_counts_numeric_terms(self):
+        with open(DATA_PATH / "jobs.json", encoding="utf-8") as file_pointer:
+            enricher = Enricher()
+            index = InMemoryIndex(
+                {action["_id"]: enricher.enrich(action["_source"]) for action in json.load(file_pointer)}
+            )
+        query = {"range": {"max_salary": {"gte": 90000}}}
+
+        result = index.aggregate(query, {"top_skills": {"terms": {"field": "top_skill_ids", "size": 5}}})
+
+        buckets = result["top_skills"]["buckets"]
+        assert len(buckets) == 5
+        assert [bucket["doc_count"] for bucket in buckets] == sorted((b["doc_count"] for b in buckets), reverse=True)
+        matching = [job for job in index.sources if job["max_salary"] >= 90000]
+        for bucket in buckets:
+            assert bucket["doc_count"] == sum(bucket["key"] in job["top_skill_ids"] for job in matching)
@@ -1,9 +1,13 @@
+import json
+
 import pytest
 from httpx import AsyncClient
 
 from api.lib.elasticsearch.elastic_search_client import ElasticsearchClient
-from api.models.candidate_models import CandidatePublic, MatchingCandidate
-from api.models.job_models import JobPublic
+from api.lib.enrichment import get_enricher
+from api.lib.singleflight import get_single_flight
+from api.models.candidate_models import CandidateDocument, CandidatePublic, MatchingCandidate
+from api.models.job_models import JobDocument, JobPublic
 
 existing_job_id = 1
 non_existing_job_id = 99999
@@ -40,6 +44,20 @@ class TestGetJobById:
         response = await client.get(f"/jobs/{non_existing_job_id}")
         assert response.status_code == 404
 
+    async def test_get_job_by_id_not_modified(self, client: AsyncClient):
+        response = await client.get(f"/jobs/{existing_job_id}")
+        etag = response.headers["etag"]
+        assert response.headers["cache-control"].startswith("public")
+
+        not_modified = await client.get(f"/jobs/{existing_job_id}", headers={"If-None-Match": etag})
+        assert not_modified.status_code == 304
+        assert not_modified.content == b""
+        assert not_modified.headers["etag"] == etag
+
+        other = await client.get(f"/jobs/{existing_job_id + 1}", headers={"If-None-Match": etag})
+        assert other.status_code == 200
+        assert other.headers["etag"] != etag
+
 
 class TestGetMatchingCandidatesForJob:
     async def test_get_matching_jobs_fulfills_at_least_one_filter(
@@ -52,7 +70,7 @@ class TestGetMatchingCandidatesForJob:
             - Test behaviour when
         """
         # Setup
-        job = JobPublic.model_validate(await jobs_es_client.get_entity(id=existing_job_id))
+        job = JobDocument.model_validate(await jobs_es_client.get_entity(id=existing_job_id))
         limit = 15
 
         # Asserting that we succesfully retrieve candidates and that the number of candidates is correct
@@ -63,16 +81,263 @@ class TestGetMatchingCandidatesForJob:
 
         for matching_candidate in matching_candidates:
             matching_candidate = MatchingCandidate.model_validate(matching_candidate)
-            candidate = CandidatePublic.model_validate(await candidates_es_client.get_entity(id=matching_candidate.id))
+            candidate = CandidateDocument.model_validate(
+                await candidates_es_client.get_entity(id=matching_candidate.id)
+            )
 
             # All possible conditions
             salary_match = candidate.salary_expectation <= job.max_salary
             seniority_match = candidate.seniority in job.seniorities
-            top_skills_match = len(set(candidate.top_skills) & set(job.top_skills)) >= min(2, len(candidate.top_skills))
+            top_skills_match = len(set(candidate.top_skill_ids) & set(job.top_skill_ids)) >= min(
+                2, len(job.top_skill_ids)
+            )
 
             # At least one has to be true
             assert salary_match or seniority_match or top_skills_match
 
+    async def test_get_matching_lookup_mode_matches_query_mode(self, client: AsyncClient):
+        query_response = await client.get(f"/jobs/{existing_job_id}/candidates?limit=20&mode=query")
+        lookup_response = await client.get(f"/jobs/{existing_job_id}/candidates?limit=20&mode=lookup")
+
+        assert lookup_response.status_code == 200
+        assert lookup_response.json() == query_response.json()
+
+    async def test_get_matching_lookup_mode_not_found(self, client: AsyncClient):
+        response = await client.get(f"/jobs/{non_existing_job_id}/candidates?mode=lookup")
+        assert response.status_code == 404
+
+    async def test_get_matching_semantic_mode_fulfills_all_filters(
+        self, client: AsyncClient, candidates_es_client: ElasticsearchClient, jobs_es_client: ElasticsearchClient
+    ):
+        job = JobDocument.model_validate(await jobs_es_client.get_entity(id=existing_job_id))
+
+        response = await client.get(f"/jobs/{existing_job_id}/candidates?limit=10&mode=semantic")
+        assert response.status_code == 200
+        matching_candidates = response.json()
+        assert 0 < len(matching_candidates) <= 10
+
+        scores = [match["relevance_score"] for match in matching_candidates]
+        assert scores == sorted(scores, reverse=True)
+        for matching_candidate in matching_candidates:
+            candidate = CandidateDocument.model_validate(
+                await candidates_es_client.get_entity(id=matching_candidate["id"])
+            )
+            assert candidate.salary_expectation <= job.max_salary
+            assert candidate.seniority_level in job.seniority_levels
+
+    async def test_get_matching_semantic_mode_not_found(self, client: AsyncClient):
+        response = await client.get(f"/jobs/{non_existing_job_id}/candidates?mode=semantic")
+        assert response.status_code == 404
+
+    async def test_get_matching_precomputed_source(self, client: AsyncClient):
+        live_response = await client.get(f"/jobs/{existing_job_id}/candidates?limit=5")
+        precomputed_response = await client.get(f"/jobs/{existing_job_id}/candidates?limit=5&source=precomputed")
+
+        assert precomputed_response.status_code == 200
+        precomputed_scores = [match["relevance_score"] for match in precomputed_response.json()]
+        live_scores = [match["relevance_score"] for match in live_response.json()]
+        assert precomputed_scores == pytest.approx(live_scores, rel=1e-4)
+
+    async def test_get_matching_precomputed_source_not_found(self, client: AsyncClient):
+        response = await client.get(f"/jobs/{non_existing_job_id}/candidates?source=precomputed")
+        assert response.status_code == 404
+
+    async def test_get_matching_paginated(self, client: AsyncClient):
+        first_page = (await client.get(f"/jobs/{existing_job_id}/candidates?limit=5&paginate=true")).json()
+        second_page = (
+            await client.get(
+                f"/jobs/{existing_job_id}/candidates", params={"limit": 5, "cursor": first_page["next_cursor"]}
+            )
+        ).json()
+
+        first_ids = [match["id"] for match in first_page["items"]]
+        second_ids = [match["id"] for match in second_page["items"]]
+        assert len(first_ids) == len(second_ids) == 5
+        assert not set(first_ids) & set(second_ids)
+        assert first_page["items"][-1]["relevance_score"] >= second_page["items"][0]["relevance_score"]
+
+    async def test_get_matching_not_modified(self, client: AsyncClient):
+        response = await client.get(f"/jobs/{existing_job_id}/candidates?limit=5")
+        etag = response.headers["etag"]
+
+        not_modified = await client.get(f"/jobs/{existing_job_id}/candidates?limit=5", headers={"If-None-Match": etag})
+        assert not_modified.status_code == 304
+        assert not_modified.content == b""
+
+        for params in ("limit=6", "limit=5&salary_match=false"):
+            changed = await client.get(f"/jobs/{existing_job_id}/candidates?{params}", headers={"If-None-Match": etag})
+            assert changed.status_code == 200
+            assert changed.headers["etag"] != etag
+
+    async def test_get_matching_paginated_is_not_cached(self, client: AsyncClient):
+        response = await client.get(f"/jobs/{existing_job_id}/candidates?limit=5&paginate=true")
+        assert response.headers["cache-control"] == "no-store"
+        assert "etag" not in response.headers
+
+    @pytest.mark.parametrize("mode", ["lookup", "semantic"])
+    async def test_get_matching_paginated_only_in_query_mode(self, client: AsyncClient, mode: str):
+        response = await client.get(f"/jobs/{existing_job_id}/candidates", params={"paginate": True, "mode": mode})
+
+        assert response.status_code == 400
+
+    async def test_get_matching_paginated_invalid_cursor(self, client: AsyncClient):
+        first_page = (await client.get(f"/jobs/{existing_job_id}/candidates?limit=5&paginate=true")).json()
+
+        response = await client.get(
+            f"/jobs/{non_existing_job_id}/candidates", params={"cursor": first_page["next_cursor"]}
+        )
+        assert response.status_code == 400
+
+    async def test_get_matching_with_facets(self, client: AsyncClient):
+        params = {"limit": 5, "facets": ["top_skills", "other_skills"]}
+        response = await client.get(f"/jobs/{existing_job_id}/candidates", params=params)
+
+        assert response.status_code == 200
+        facets = response.json()["facets"]
+        assert set(facets) == {"top_skills", "other_skills"}
+        counts = [bucket["doc_count"] for bucket in facets["top_skills"]]
+        assert counts == sorted(counts, reverse=True)
+        # Skills are counted per skill id, synonyms share the bucket of the name of the skill dictionary
+        skill_names = set(get_enricher().skill_names.values())
+        assert facets["top_skills"] and facets["other_skills"]
+        assert all(bucket["key"] in skill_names for bucket in facets["top_skills"] + facets["other_skills"])
+        cached = await client.get(f"/jobs/{existing_job_id}/candidates", params=params)
+        assert cached.json() == response.json()
+
+    async def test_get_matching_with_facets_is_coalesced(self, client: AsyncClient):
+        single_flight = get_single_flight("matching_candidates")
+        calls = single_flight.stats.calls
+
+        response = await client.get(f"/jobs/{existing_job_id}/candidates", params={"limit": 3, "facets": ["salary"]})
+
+        assert response.status_code == 200
+        assert single_flight.stats.calls == calls + 1
+
+    async def test_get_matching_candidates_with_selected_filters_only(
+        self, client: AsyncClient, candidates_es_client: ElasticsearchClient, jobs_es_client: ElasticsearchClient
+    ):
+        job = JobPublic.model_validate(await jobs_es_client.get_entity(id=existing_job_id))
+
+        response = await client.get(
+            f"/jobs/{existing_job_id}/candidates?limit=10&salary_match=false&top_skill_match=false"
+        )
+        assert response.status_code == 200
+
+        for matching_candidate in response.json():
+            candidate = CandidatePublic.model_validate(
+                await candidates_es_client.get_entity(id=matching_candidate["id"])
+            )
+            assert candidate.seniority in job.seniorities
+
+    async def test_get_matching_without_filters(self, client: AsyncClient):
+        response = await client.get(
+            f"/jobs/{existing_job_id}/candidates?salary_match=false&top_skill_match=false&seniority_match=false"
+        )
+        assert response.status_code == 422
+
+    async def test_get_matching_precomputed_source_with_selected_filters(self, client: AsyncClient):
+        response = await client.get(f"/jobs/{existing_job_id}/candidates?source=precomputed&salary_match=false")
+        assert response.status_code == 400
+
     async def test_get_matching_jobs_for_candidate_not_found(self, client: AsyncClient):
         response = await client.get(f"/jobs/{non_existing_job_id}/candidates")
         assert response.status_code == 404
+
+
+class TestGetMutualCandidatesForJob:
+    async def test_get_mutual_candidates_rank_each_other(self, client: AsyncClient):
+        response = await client.get(f"/jobs/{existing_job_id}/mutual-candidates?limit=20&reverse_limit=20")
+        assert response.status_code == 200
+        mutual_candidates = response.json()
+
+        forward_ids = [
+            match["id"] for match in (await client.get(f"/jobs/{existing_job_id}/candidates?limit=20")).json()
+        ]
+        scores = [match["relevance_score"] for match in mutual_candidates]
+        assert scores == sorted(scores, reverse=True)
+        for mutual_candidate in mutual_candidates:
+            assert mutual_candidate["id"] in forward_ids
+            reverse_ids = [
+                match["id"]
+                for match in (await client.get(f"/candidates/{mutual_candidate['id']}/jobs?limit=20")).json()
+            ]
+            assert existing_job_id in reverse_ids
+            assert 1 <= mutual_candidate["reverse_rank"] <= 20
+
+    async def test_get_mutual_candidates_not_found(self, client: AsyncClient):
+        response = await client.get(f"/jobs/{non_existing_job_id}/mutual-candidates")
+        assert response.status_code == 404
+
+
+class TestPercolateJobs:
+    async def test_percolate_jobs_returns_matching_candidates(
+        self, client: AsyncClient, candidates_es_client: ElasticsearchClient, jobs_es_client: ElasticsearchClient
+    ):
+        job = JobDocument.model_validate(await jobs_es_client.get_entity(id=existing_job_id))
+        new_job = JobPublic.model_validate(job.model_dump()).model_dump()
+
+        response = await client.post("/jobs/percolate?limit=10", json={"items": [new_job, new_job]})
+        assert response.status_code == 200
+        first, second = response.json()
+        assert first == second
+        assert 0 < len(first["ids"]) <= 10 <= first["total"]
+
+        for candidate_id in first["ids"]:
+            candidate = CandidateDocument.model_validate(await candidates_es_client.get_entity(id=candidate_id))
+            # The stored query of the candidate, so the top skills are compared from the side of the candidate
+            salary_match = candidate.salary_expectation <= job.max_salary
+            seniority_match = candidate.seniority_level in job.seniority_levels
+            top_skills_match = len(set(candidate.top_skill_ids) & set(job.top_skill_ids)) >= min(
+                2, len(candidate.top_skill_ids)
+            )
+            assert salary_match or seniority_match or top_skills_match
+
+    async def test_percolate_jobs_without_jobs(self, client: AsyncClient):
+        response = await client.post("/jobs/percolate", json={"items": []})
+        assert response.status_code == 422
+
+
+class TestGetMatchingCandidatesForJobs:
+    async def test_get_matching_candidates_for_jobs(self, client: AsyncClient):
+        response = await client.post(
+            "/jobs/matches/candidates",
+            json={"items": [{"id": existing_job_id, "limit": 5}, {"id": non_existing_job_id}]},
+        )
+        assert response.status_code == 200
+        results = response.json()
+
+        assert results[str(existing_job_id)]["status_code"] == 200
+        assert len(results[str(existing_job_id)]["matches"]) == 5
+        assert results[str(non_existing_job_id)]["status_code"] == 404
+        assert results[str(non_existing_job_id)]["matches"] == []
+
+    async def test_get_matching_candidates_for_jobs_matches_single_route(self, client: AsyncClient):
+        single_response = await client.get(f"/jobs/{existing_job_id}/candidates?limit=10")
+        batch_response = await client.post("/jobs/matches/candidates", json={"items": [{"id": existing_job_id}]})
+
+        assert batch_response.json()[str(existing_job_id)]["matches"] == single_response.json()
+
+
+class TestExportMatchingCandidatesForJob:
+    async def test_export_matching_candidates_as_ndjson(self, client: AsyncClient):
+        response = await client.get(f"/jobs/{existing_job_id}/candidates/export")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+
+        rows = [json.loads(line) for line in response.text.splitlines()]
+        top_matches = (await client.get(f"/jobs/{existing_job_id}/candidates?limit=10")).json()
+        assert len({row["id"] for row in rows}) == len(rows)
+        assert {match["id"] for match in top_matches} <= {row["id"] for row in rows}
+
+    async def test_export_matching_candidates_as_csv(self, client: AsyncClient):
+        response = await client.get(f"/jobs/{existing_job_id}/candidates/export", headers={"Accept": "text/csv"})
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/csv")
+
+        lines = response.text.splitlines()
+        assert lines[0] == "id,relevance_score"
+        assert len(lines) > 1
+
+    async def test_export_matching_candidates_not_found(self, client: AsyncClient):
+        response = await client.get(f"/jobs/{non_existing_job_id}/candidates/export")
+        assert response.status_code == 404
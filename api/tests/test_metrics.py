@@ -0,0 +1,51 @@
+import pytest
+from elastic_transport import ApiResponseMeta, HttpHeaders, NodeConfig, ObjectApiResponse
+from prometheus_client import REGISTRY
+
+from api.lib.metrics import OperationMetrics, count_search_hits
+
+pytestmark = pytest.mark.anyio
+
+
+def sample(name: str, **labels: str) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+async def response(body: dict) -> ObjectApiResponse:
+    meta = ApiResponseMeta(
+        status=200, http_version="1.1", headers=HttpHeaders(), duration=0.0, node=NodeConfig("http", "localhost", 9200)
+    )
+    return ObjectApiResponse(body=body, meta=meta)
+
+
+async def failure() -> ObjectApiResponse:
+    raise ConnectionError()
+
+
+class TestMetrics:
+    async def test_metrics_route_exposes_request_metrics(self, client):
+        labels = {"method": "GET", "route": "<unmatched>", "status": "4xx"}
+        before = sample("http_request_duration_seconds_count", **labels)
+
+        await client.get("/unknown")
+        response = await client.get("/metrics")
+
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+        assert "http_request_duration_seconds_bucket" in response.text
+        assert sample("http_request_duration_seconds_count", **labels) == before + 1
+
+    async def test_operation_records_took_hits_and_errors(self):
+        labels = {"index": "test_metrics", "operation": "search"}
+        operation = OperationMetrics(**labels)
+
+        await operation.observe(
+            response({"took": 5, "hits": {"hits": [{"_id": "1"}, {"_id": "2"}]}}), count_search_hits
+        )
+        with pytest.raises(ConnectionError):
+            await operation.observe(failure())
+
+        assert sample("elasticsearch_request_duration_seconds_count", **labels) == 2
+        assert sample("elasticsearch_took_seconds_sum", **labels) == pytest.approx(0.005)
+        assert sample("elasticsearch_hits_sum", **labels) == 2
+        assert sample("elasticsearch_errors_total", **labels) == 1
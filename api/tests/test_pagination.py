@@ -0,0 +1,23 @@
+import pytest
+
+from api.lib.pagination import InvalidCursorError, decode_cursor, encode_cursor
+
+
+class TestCursor:
+    def test_roundtrip(self):
+        payload = {"resource": "jobs/1/candidates", "pit_id": "abc", "search_after": [1.5, 42]}
+
+        assert decode_cursor(encode_cursor(payload), resource="jobs/1/candidates") == payload
+
+    def test_tampered_cursor(self):
+        data, signature = encode_cursor({"resource": "jobs/1/candidates", "search_after": [1.5, 42]}).split(".")
+        tampered = encode_cursor({"resource": "jobs/1/candidates", "search_after": [9.9, 1]}).split(".")[0]
+
+        with pytest.raises(InvalidCursorError):
+            decode_cursor(f"{tampered}.{signature}", resource="jobs/1/candidates")
+
+    def test_cursor_of_other_resource(self):
+        cursor = encode_cursor({"resource": "jobs/1/candidates"})
+
+        with pytest.raises(InvalidCursorError):
+            decode_cursor(cursor, resource="jobs/2/candidates")
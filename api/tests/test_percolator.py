@@ -0,0 +1,49 @@
+import json
+import sys
+from pathlib import Path
+
+import pytest
+from pydantic import ValidationError
+
+from api.lib.enrichment import Enricher
+from api.models.candidate_models import CandidateDocument
+from api.models.job_models import JobDocument
+from api.repositories.candidate_repository import CandidateRepository
+from api.repositories.job_repository import JobRepository
+
+SEED_IMAGE_PATH = Path(__file__).parents[2] / "seed_image"
+sys.path.insert(0, str(SEED_IMAGE_PATH))
+percolator = pytest.importorskip("percolator")
+
+
+def _documents(index_name: str, *extra_documents: dict) -> list[dict]:
+    """The enriched seed documents of the index and the given ones"""
+    with open(SEED_IMAGE_PATH / "data" / f"{index_name}.json", encoding="utf-8") as file_pointer:
+        documents = [action["_source"] for action in json.load(file_pointer)]
+    enricher = Enricher()
+    return [enricher.enrich(document) for document in [*documents, *extra_documents]]
+
+
+class TestStoredQueries:
+    """The seeder stores the matching queries in the percolator indices, they have to match the live ones"""
+
+    def test_candidate_query_matches_repository(self):
+        repository = CandidateRepository(None, None, None, None)
+        unknown_seniority = {"top_skills": [], "other_skills": [], "seniority": "unknown", "salary_expectation": 1}
+        for candidate in _documents("candidates", unknown_seniority):
+            try:
+                document = CandidateDocument.model_validate(candidate)
+            except ValidationError:
+                # Candidates the API can't match at all, e.g. without a salary expectation, match no job by salary
+                if candidate["salary_expectation"] is None:
+                    assert percolator.candidate_query(candidate)["bool"]["should"][0] == {"match_none": {}}
+                continue
+            queries = repository._extract_queries_from_candidate(document)
+            assert percolator.candidate_query(candidate) == {"bool": {"should": queries}}
+
+    def test_job_query_matches_repository(self):
+        repository = JobRepository(None, None, None, None)
+        without_seniorities = {"top_skills": ["Go"], "other_skills": [], "seniorities": [], "max_salary": 1}
+        for job in _documents("jobs", without_seniorities):
+            queries = repository._extract_queries_from_job(JobDocument.model_validate(job))
+            assert percolator.job_query(job) == {"bool": {"should": queries}}
@@ -0,0 +1,45 @@
+import pytest
+from httpx import ASGITransport, AsyncClient
+from starlette.responses import PlainTextResponse
+
+from api.lib.profiling import ProfileReport, ProfilingMiddleware, current_profile, get_profile_report
+
+pytestmark = pytest.mark.anyio
+
+
+async def endpoint(scope, receive, send):
+    await PlainTextResponse("profiled" if current_profile() is not None else "not profiled")(scope, receive, send)
+
+
+class TestProfiling:
+    async def test_only_requests_with_header_are_profiled(self):
+        async with AsyncClient(transport=ASGITransport(app=ProfilingMiddleware(endpoint)), base_url="http://t") as c:
+            response = await c.get("/")
+            assert response.text == "not profiled"
+            assert "x-profile-report" not in response.headers
+
+            response = await c.get("/", headers={"X-Profile": "1"})
+            assert response.text == "profiled"
+
+        report = get_profile_report(response.headers["x-profile-report"].rsplit("/", 1)[-1])
+        assert report is not None
+        assert report.to_dict()["python"]["profiles"]
+
+    async def test_elasticsearch_profile_is_flattened_per_clause(self):
+        report = ProfileReport(id="1", method="GET", path="/")
+        query = {
+            "type": "BooleanQuery",
+            "description": "top_skills:python max_salary:[100 TO *]",
+            "time_in_nanos": 3_000_000,
+            "children": [{"type": "CoveringQuery", "description": "top_skills:python", "time_in_nanos": 1_000_000}],
+        }
+        report.add_elasticsearch_profile(
+            index="jobs", took=4, profile={"shards": [{"id": "0", "searches": [{"query": [query]}]}]}
+        )
+
+        (search,) = report.elasticsearch
+        assert search["took_ms"] == 4
+        assert [(clause["type"], clause["depth"], clause["time_ms"]) for clause in search["clauses"]] == [
+            ("BooleanQuery", 0, 3.0),
+            ("CoveringQuery", 1, 1.0),
+        ]
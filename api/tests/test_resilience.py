@@ -0,0 +1,343 @@
+import asyncio
+from dataclasses import replace
+
+import pytest
+from elastic_transport import ApiResponseMeta, ConnectionError, HttpHeaders, NodeConfig, ObjectApiResponse
+from elasticsearch import ApiError, NotFoundError
+from fastapi import FastAPI
+from httpx import ASGITransport, AsyncClient
+
+from api.lib.elasticsearch import resilience
+from api.lib.elasticsearch.admission import AdmissionController, AdmissionLane, LaneBudget
+from api.lib.elasticsearch.exceptions import SearchOverloadedError, SearchTimeoutError, SearchUnavailableError
+from api.lib.elasticsearch.resilience import (
+    CircuitBreaker,
+    CircuitState,
+    DegradedResponseMiddleware,
+    ElasticsearchResilience,
+    LatencyWindow,
+    StaleResults,
+    search_unavailable_handler,
+)
+
+pytestmark = pytest.mark.anyio
+
+META = ApiResponseMeta(
+    status=200, http_version="1.1", headers=HttpHeaders(), duration=0.0, node=NodeConfig("http", "localhost", 9200)
+)
+
+
+class FakeElasticsearch:
+    """Stands in for the shared client, the requests of the tests are sent by their `send` functions"""
+
+    def options(self, **options) -> "FakeElasticsearch":
+        return self
+
+
+def index_resilience_of(breaker: CircuitBreaker) -> ElasticsearchResilience:
+    return ElasticsearchResilience("test_resilience", breaker, client=FakeElasticsearch)
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def warmed_up(operation: str, seconds: float, breaker: CircuitBreaker | None = None) -> ElasticsearchResilience:
+    index_resilience = index_resilience_of(breaker or CircuitBreaker(failure_threshold=5, reset_timeout=10))
+    for _ in range(resilience.ES_LATENCY_MIN_SAMPLES):
+        index_resilience.latencies(operation).record(seconds)
+    return index_resilience
+
+
+def admission_controller(max_concurrency: int) -> AdmissionController:
+    budget = LaneBudget(concurrency=max_concurrency, queue_size=10, max_wait=1)
+    return AdmissionController(max_concurrency=max_concurrency, budgets={lane: budget for lane in AdmissionLane})
+
+
+def answer_after(seconds: float, preferences: list, error: Exception | None = None):
+    async def send(client, preference):
+        preferences.append(preference)
+        await asyncio.sleep(seconds)
+        if error is not None:
+            raise error
+        return ObjectApiResponse(body={"preference": preference}, meta=META)
+
+    return send
+
+
+def not_found() -> NotFoundError:
+    return NotFoundError(message="not_found", meta=META, body={})
+
+
+def overloaded() -> ApiError:
+    return ApiError(message="es_rejected_execution_exception", meta=replace(META, status=429), body={})
+
+
+class TestLatencyWindow:
+    def test_percentiles_of_kept_durations(self):
+        latencies = LatencyWindow(100)
+        for milliseconds in range(1, 101):
+            latencies.record(milliseconds / 1000)
+
+        assert latencies.percentile(0.5) == 0.05
+        assert latencies.percentile(0.95) == 0.095
+        assert latencies.percentile(1) == 0.1
+
+    def test_window_only_keeps_latest_durations(self):
+        latencies = LatencyWindow(10)
+        for seconds in [5.0] * 10 + [1.0] * 10:
+            latencies.record(seconds)
+
+        assert len(latencies) == 10
+        assert latencies.percentile(0.99) == 1.0
+
+
+class TestCircuitBreaker:
+    def test_opens_after_consecutive_failures(self):
+        breaker = CircuitBreaker(failure_threshold=3, reset_timeout=10, clock=Clock())
+
+        breaker.record_failure()
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        breaker.record_failure()
+        assert breaker.state == CircuitState.CLOSED
+
+        breaker.record_failure()
+        assert breaker.state == CircuitState.OPEN
+        assert not breaker.allow()
+        assert breaker.retry_after == 10
+
+    def test_probe_after_reset_timeout_closes_or_reopens(self):
+        clock = Clock()
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10, clock=clock)
+        breaker.record_failure()
+
+        clock.now = 10
+        assert breaker.allow()
+        assert breaker.state == CircuitState.HALF_OPEN
+        # Only the probe is let through until it finished or the next reset timeout passed
+        assert not breaker.allow()
+        breaker.record_failure()
+        assert breaker.state == CircuitState.OPEN
+
+        clock.now = 20
+        assert breaker.allow()
+        breaker.record_success()
+        assert breaker.state == CircuitState.CLOSED
+        assert breaker.allow()
+        assert (breaker.stats.opened, breaker.stats.rejected) == (2, 1)
+
+
+class TestElasticsearchResilience:
+    async def test_slow_request_is_hedged_and_first_answer_wins(self):
+        index_resilience = warmed_up("search", 0.01)
+        preferences = []
+        calls = 0
+
+        async def send(client, preference):
+            nonlocal calls
+            calls += 1
+            return await answer_after(1 if calls == 1 else 0, preferences)(client, preference)
+
+        response = await index_resilience.call("search", send)
+
+        assert preferences[0] is None and preferences[1] is not None
+        assert response.body["preference"] == preferences[1]
+        assert (index_resilience.stats["search"].hedged, index_resilience.stats["search"].hedge_wins) == (1, 1)
+
+    async def test_hedge_holds_an_admission_slot_of_its_own(self, monkeypatch):
+        admission = admission_controller(2)
+        monkeypatch.setattr(resilience, "get_admission_controller", lambda: admission)
+        in_flight = []
+
+        async def send(client, preference):
+            in_flight.append(admission.active)
+            await asyncio.sleep(1 if preference is None else 0)
+            return ObjectApiResponse(body={}, meta=META)
+
+        await warmed_up("search", 0.01).call("search", send)
+        await asyncio.sleep(0)
+
+        assert in_flight == [1, 2]
+        assert admission.active == 0
+
+    async def test_hedge_is_dropped_without_a_free_admission_slot(self, monkeypatch):
+        admission = admission_controller(1)
+        monkeypatch.setattr(resilience, "get_admission_controller", lambda: admission)
+        index_resilience = warmed_up("search", 0.01)
+        preferences = []
+
+        await index_resilience.call("search", answer_after(0.05, preferences))
+
+        assert preferences == [None]
+        assert index_resilience.stats["search"].hedges_not_admitted == 1
+
+    async def test_fast_request_and_cold_operation_are_not_hedged(self):
+        preferences = []
+
+        await warmed_up("search", 0.5).call("search", answer_after(0.01, preferences))
+        await warmed_up("get", 0.01).call("search", answer_after(0.05, preferences))
+
+        assert preferences == [None, None]
+
+    async def test_hedge_answers_when_primary_fails(self):
+        index_resilience = warmed_up("search", 0.01)
+        preferences = []
+
+        async def send(client, preference):
+            if preference is None:
+                return await answer_after(0.05, preferences, ConnectionError("down"))(client, preference)
+            return await answer_after(0.1, preferences)(client, preference)
+
+        response = await index_resilience.call("search", send)
+
+        assert response.body["preference"] == preferences[1]
+        assert index_resilience.breaker.state == CircuitState.CLOSED
+
+    async def test_timeout_follows_p99(self, monkeypatch):
+        monkeypatch.setattr(resilience, "ES_MIN_TIMEOUT", 0.01)
+        index_resilience = warmed_up("search", 0.02)
+
+        assert index_resilience.timeout("search") == pytest.approx(0.06)
+        assert index_resilience.timeout("get") == resilience.ES_REQUEST_TIMEOUT
+        with pytest.raises(SearchTimeoutError):
+            await index_resilience.call("search", answer_after(1, []), hedge=False)
+        assert index_resilience.stats["search"].timeouts == 1
+
+    async def test_open_breaker_rejects_without_sending(self, monkeypatch):
+        monkeypatch.setattr(resilience, "ES_MAX_RETRIES", 0)
+        index_resilience = index_resilience_of(CircuitBreaker(failure_threshold=2, reset_timeout=10))
+        preferences = []
+
+        for _ in range(2):
+            with pytest.raises(SearchUnavailableError):
+                await index_resilience.call("search", answer_after(0, preferences, ConnectionError("down")))
+        with pytest.raises(SearchUnavailableError) as error:
+            await index_resilience.call("search", answer_after(0, preferences))
+
+        assert len(preferences) == 2
+        assert error.value.retry_after == pytest.approx(10, abs=0.1)
+
+    async def test_retryable_failures_are_retried_with_backoff(self, monkeypatch):
+        monkeypatch.setattr(resilience, "ES_MAX_RETRIES", 2)
+        monkeypatch.setattr(resilience, "ES_RETRY_BACKOFF_FACTOR", 0.01)
+        index_resilience = index_resilience_of(CircuitBreaker(failure_threshold=1, reset_timeout=10))
+        attempts = 0
+        errors = [ConnectionError("down"), overloaded()]
+
+        async def send(client, preference):
+            nonlocal attempts
+            attempts += 1
+            if errors:
+                raise errors.pop(0)
+            return ObjectApiResponse(body={}, meta=META)
+
+        await index_resilience.call("search", send, hedge=False)
+
+        assert attempts == 3
+        assert index_resilience.stats["search"].retries == 2
+        assert index_resilience.breaker.state == CircuitState.CLOSED
+
+    async def test_errors_caused_by_the_request_are_not_retried(self):
+        index_resilience = index_resilience_of(CircuitBreaker(failure_threshold=1, reset_timeout=10))
+        preferences = []
+
+        with pytest.raises(NotFoundError):
+            await index_resilience.call("get", answer_after(0, preferences, not_found()))
+
+        assert len(preferences) == 1
+
+    async def test_errors_caused_by_the_request_are_not_failures(self):
+        index_resilience = index_resilience_of(CircuitBreaker(failure_threshold=1, reset_timeout=10))
+
+        with pytest.raises(NotFoundError):
+            await index_resilience.call("get", answer_after(0, [], not_found()))
+
+        assert index_resilience.breaker.state == CircuitState.CLOSED
+
+
+class TestStaleResults:
+    async def test_kept_result_is_served_while_unavailable(self):
+        stale_results = StaleResults(max_size=10, max_age=60)
+
+        async def unavailable():
+            raise SearchUnavailableError("down")
+
+        assert await stale_results.get(1, fetch=lambda: asyncio.sleep(0, result=[1, 2])) == [1, 2]
+        assert await stale_results.get(1, fetch=unavailable) == [1, 2]
+        with pytest.raises(SearchUnavailableError):
+            await stale_results.get(2, fetch=unavailable)
+        assert (stale_results.stats.served, stale_results.stats.missing) == (1, 1)
+
+    async def test_shed_requests_are_not_served_stale(self):
+        stale_results = StaleResults(max_size=10, max_age=60)
+
+        async def shed():
+            raise SearchOverloadedError("Too many requests are waiting for elasticsearch", retry_after=2)
+
+        await stale_results.get(1, fetch=lambda: asyncio.sleep(0, result=[1, 2]))
+        with pytest.raises(SearchOverloadedError):
+            await stale_results.get(1, fetch=shed)
+        assert stale_results.stats.served == 0
+
+    async def test_results_older_than_max_age_are_not_served(self):
+        stale_results = StaleResults(max_size=10, max_age=0)
+
+        async def unavailable():
+            raise SearchUnavailableError("down")
+
+        await stale_results.get(1, fetch=lambda: asyncio.sleep(0, result=[1]))
+        with pytest.raises(SearchUnavailableError):
+            await stale_results.get(1, fetch=unavailable)
+
+
+class TestDegradedResponses:
+    @pytest.fixture
+    def app(self) -> FastAPI:
+        stale_results = StaleResults(max_size=10, max_age=60)
+        fail = False
+
+        async def fetch():
+            if fail:
+                raise SearchUnavailableError("down", retry_after=2.5)
+            return {"fresh": True}
+
+        app = FastAPI()
+        app.add_exception_handler(SearchUnavailableError, search_unavailable_handler)
+        app.add_middleware(DegradedResponseMiddleware)
+
+        @app.get("/matches/{id}")
+        async def matches(id: int):
+            return await stale_results.get(id, fetch=fetch)
+
+        @app.post("/outage")
+        async def outage():
+            nonlocal fail
+            fail = True
+
+        @app.get("/timeout")
+        async def timeout():
+            raise SearchTimeoutError("slow")
+
+        return app
+
+    async def test_stale_responses_are_marked_and_missing_ones_unavailable(self, app):
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+            fresh = await client.get("/matches/1")
+            await client.post("/outage")
+            stale = await client.get("/matches/1")
+            missing = await client.get("/matches/2")
+            timeout = await client.get("/timeout")
+
+        assert "x-degraded" not in fresh.headers
+        assert stale.status_code == 200
+        assert stale.headers["x-degraded"] == "stale"
+        assert stale.json() == fresh.json()
+        assert missing.status_code == 503
+        assert missing.headers["retry-after"] == "3"
+        assert timeout.status_code == 504
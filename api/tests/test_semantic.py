@@ -0,0 +1,28 @@
+from api.lib.semantic import SEMANTIC_OVERLAP_WEIGHT, rerank
+
+
+def _hit(id: int, score: float, top_skill_ids: list[int]) -> dict:
+    return {"_id": str(id), "_score": score, "_source": {"top_skill_ids": top_skill_ids}}
+
+
+class TestRerank:
+    def test_exact_skills_break_close_similarities(self):
+        response = {"hits": {"hits": [_hit(1, 0.9, [7]), _hit(2, 0.85, [1, 2]), _hit(3, 0.3, [1, 2])]}}
+
+        ranked = rerank(response, top_skill_ids=[1, 2], limit=2)
+
+        assert [id for id, _ in ranked] == [2, 1]
+        assert ranked[0][1] == 0.85 + SEMANTIC_OVERLAP_WEIGHT
+
+    def test_ties_are_broken_by_id(self):
+        response = {"hits": {"hits": [_hit(5, 0.7, []), _hit(3, 0.7, [])]}}
+
+        assert rerank(response, top_skill_ids=[1], limit=10) == [(3, 0.7), (5, 0.7)]
+
+    def test_without_top_skills_keeps_the_similarity(self):
+        response = {"hits": {"hits": [_hit(1, 0.4, [1]), _hit(2, 0.6, [])]}}
+
+        assert rerank(response, top_skill_ids=[], limit=10) == [(2, 0.6), (1, 0.4)]
+
+    def test_empty_response(self):
+        assert rerank({}, top_skill_ids=[1], limit=10) == []
@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+
+from api.lib.elasticsearch.exceptions import IDNotFoundError
+from api.lib.singleflight import SingleFlight
+
+pytestmark = pytest.mark.anyio
+
+
+def slow_call(calls: list[str], result=None, error: Exception | None = None):
+    async def call():
+        calls.append("call")
+        await asyncio.sleep(0.01)
+        if error is not None:
+            raise error
+        return result
+
+    return call
+
+
+class TestSingleFlight:
+    async def test_concurrent_calls_share_one_execution(self):
+        single_flight = SingleFlight()
+        calls = []
+
+        results = await asyncio.gather(*(single_flight.do(1, slow_call(calls, result=[1, 2])) for _ in range(5)))
+
+        assert calls == ["call"]
+        assert results == [[1, 2]] * 5
+        assert (single_flight.stats.executions, single_flight.stats.coalesced) == (1, 4)
+
+    async def test_different_keys_are_not_coalesced(self):
+        single_flight = SingleFlight()
+        calls = []
+
+        await asyncio.gather(single_flight.do(1, slow_call(calls)), single_flight.do(2, slow_call(calls)))
+
+        assert calls == ["call", "call"]
+
+    async def test_errors_are_propagated_to_all_callers(self):
+        single_flight = SingleFlight()
+        calls = []
+        error = IDNotFoundError("ID '1' was not found in the index 'jobs'.")
+
+        results = await asyncio.gather(
+            *(single_flight.do(1, slow_call(calls, error=error)) for _ in range(3)), return_exceptions=True
+        )
+
+        assert calls == ["call"]
+        assert all(isinstance(result, IDNotFoundError) for result in results)
+        assert single_flight.stats.errors == 1
+
+        # Errors are never reused
+        assert await single_flight.do(1, slow_call(calls, result="ok")) == "ok"
+
+    async def test_cancelled_caller_does_not_cancel_the_others(self):
+        single_flight = SingleFlight()
+        calls = []
+
+        first = asyncio.ensure_future(single_flight.do(1, slow_call(calls, result="ok")))
+        second = asyncio.ensure_future(single_flight.do(1, slow_call(calls, result="ok")))
+        await asyncio.sleep(0)
+        first.cancel()
+
+        assert await second == "ok"
+        assert calls == ["call"]
+
+    async def test_results_are_reused_within_the_window(self):
+        single_flight = SingleFlight(reuse_window=60)
+        calls = []
+
+        await single_flight.do(1, slow_call(calls, result="ok"))
+        assert await single_flight.do(1, slow_call(calls, result="new")) == "ok"
+
+        assert calls == ["call"]
+        assert single_flight.stats.reused == 1
@@ -0,0 +1,93 @@
+import json
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+from api.lib.snapshot import EntitySnapshot, SnapshotError, SnapshotStore
+from api.models.candidate_models import CandidatePublic
+from api.models.job_models import JobPublic
+
+SEED_IMAGE_PATH = Path(__file__).parents[2] / "seed_image"
+sys.path.insert(0, str(SEED_IMAGE_PATH))
+snapshot = pytest.importorskip("snapshot")
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _actions(index_name: str) -> list[dict]:
+    with open(SEED_IMAGE_PATH / "data" / f"{index_name}.json", encoding="utf-8") as file_pointer:
+        return json.load(file_pointer)
+
+
+def _write(path: Path, index_name: str, actions: list[dict], concrete_index: str = "test_v1") -> None:
+    writer = snapshot.SnapshotWriter(index_name, concrete_index)
+    for seq_no, action in enumerate(actions):
+        writer.add(action["_id"], action["_source"], seq_no, 1)
+    writer.write(path)
+
+
+@pytest.mark.parametrize("index_name, model", [("jobs", JobPublic), ("candidates", CandidatePublic)])
+def test_snapshot_returns_public_fields_and_version_of_every_document(tmp_path, index_name, model):
+    actions = _actions(index_name)
+    _write(tmp_path / "entities.snapshot", index_name, actions)
+
+    entity_snapshot = EntitySnapshot(tmp_path / "entities.snapshot")
+
+    assert len(entity_snapshot) == len(actions)
+    for seq_no, action in enumerate(actions):
+        entity = entity_snapshot.get(int(action["_id"]))
+        expected = {field: action["_source"][field] for field in model.model_fields}
+        assert entity.source == expected
+        assert entity.version == f"test_v1/1/{seq_no}"
+    assert entity_snapshot.get(-1) is None
+    assert entity_snapshot.get(10**9) is None
+
+
+def test_store_swaps_to_replaced_snapshot_after_check_interval(tmp_path):
+    path = tmp_path / "jobs.snapshot"
+    actions = _actions("jobs")[:2]
+    clock = Clock()
+    store = SnapshotStore(path, check_interval=5, clock=clock)
+
+    assert store.get(int(actions[0]["_id"])) is None
+    _write(path, "jobs", actions)
+    clock.now = 5
+    assert store.get(int(actions[0]["_id"])).version == "test_v1/1/0"
+    assert store.get(int(actions[0]["_id"]) + 10**6) is None
+
+    _write(path, "jobs", actions[1:], concrete_index="test_v2")
+    assert store.get(int(actions[0]["_id"])).version == "test_v1/1/0"
+    clock.now = 10
+    assert store.get(int(actions[0]["_id"])) is None
+    assert store.get(int(actions[1]["_id"])).version == "test_v2/1/0"
+    assert (store.stats.hits, store.stats.misses, store.stats.reloads) == (3, 2, 2)
+
+
+def test_store_keeps_snapshot_when_replacement_is_unreadable(tmp_path):
+    path = tmp_path / "jobs.snapshot"
+    actions = _actions("jobs")[:1]
+    _write(path, "jobs", actions)
+    clock = Clock()
+    store = SnapshotStore(path, check_interval=5, clock=clock)
+    assert store.get(int(actions[0]["_id"])) is not None
+
+    path.write_bytes(b"not a snapshot")
+    os.utime(path, ns=(1, 1))
+    clock.now = 5
+
+    assert store.get(int(actions[0]["_id"])) is not None
+    assert store.stats.errors == 1
+    with pytest.raises(SnapshotError):
+        EntitySnapshot(path)
+
+
+def test_store_without_path_is_disabled():
+    assert SnapshotStore(None, check_interval=5).get(1) is None
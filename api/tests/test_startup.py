@@ -0,0 +1,90 @@
+from types import SimpleNamespace
+
+import pytest
+from elastic_transport import ConnectionError
+from fastapi import FastAPI
+from httpx import ASGITransport, AsyncClient
+
+from api.lib import startup
+from api.routes import health
+
+pytestmark = pytest.mark.anyio
+
+
+class FakeElasticsearch:
+    """Answers cluster health with the given statuses in turn, an exception is raised instead"""
+
+    def __init__(self, *statuses, indices=("jobs", "candidates")) -> None:
+        self.statuses = list(statuses)
+        self.cluster = SimpleNamespace(health=self.health)
+        self.indices = SimpleNamespace(exists=self.exists)
+        self.existing_indices = indices
+        self.pings = 0
+
+    def options(self, **options) -> "FakeElasticsearch":
+        return self
+
+    async def health(self) -> dict:
+        status = self.statuses.pop(0) if len(self.statuses) > 1 else self.statuses[0]
+        if isinstance(status, Exception):
+            raise status
+        return {"status": status}
+
+    async def exists(self, *, index: str) -> bool:
+        return index in self.existing_indices
+
+    async def ping(self) -> bool:
+        self.pings += 1
+        return True
+
+
+async def test_waits_for_elasticsearch_with_bounded_attempts():
+    unreachable = ConnectionError("refused")
+
+    assert await startup.wait_for_elasticsearch(
+        FakeElasticsearch(unreachable, "red", "yellow"), attempts=3, retry_delay=0
+    )
+    assert not await startup.wait_for_elasticsearch(FakeElasticsearch(unreachable), attempts=3, retry_delay=0)
+
+
+async def test_prewarm_opens_connections_concurrently():
+    client = FakeElasticsearch("green")
+
+    await startup.prewarm_connections(client, 4)
+
+    assert client.pings == 4
+
+
+async def test_readiness_requires_startup_healthy_cluster_and_indices(monkeypatch):
+    monkeypatch.setattr(startup, "REQUIRES_ELASTICSEARCH", True)
+    monkeypatch.setattr(startup, "_started", True)
+
+    monkeypatch.setattr(startup, "get_elasticsearch", lambda: FakeElasticsearch("yellow"))
+    assert (await startup._check_readiness())[0]
+
+    monkeypatch.setattr(startup, "get_elasticsearch", lambda: FakeElasticsearch("green", indices=("jobs",)))
+    ready, checks = await startup._check_readiness()
+    assert not ready
+    assert checks["indices"] == {"jobs": True, "candidates": False}
+
+    monkeypatch.setattr(startup, "get_elasticsearch", lambda: FakeElasticsearch(ConnectionError("refused")))
+    assert not (await startup._check_readiness())[0]
+
+    monkeypatch.setattr(startup, "get_elasticsearch", lambda: FakeElasticsearch("green"))
+    monkeypatch.setattr(startup, "_started", False)
+    assert not (await startup._check_readiness())[0]
+
+
+async def test_health_routes(monkeypatch):
+    monkeypatch.setattr(startup, "REQUIRES_ELASTICSEARCH", False)
+    monkeypatch.setattr(startup, "_started", False)
+    app = FastAPI()
+    app.include_router(health.router)
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        live = await client.get("/health/live")
+        ready = await client.get("/health/ready")
+
+    assert live.status_code == 200
+    assert ready.status_code == 503
+    assert ready.json() == {"status": "not_ready", "checks": {"startup": False}}
@@ -0,0 +1,125 @@
+import json
+import os
+import zlib
+from pathlib import Path
+from typing import Iterable, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+SKILL_DICTIONARY_PATH = Path(__file__).parent / "data" / "skill_dictionary.json"
+# Written by skill_embeddings.py, documents get no skill_vector without it
+SKILL_EMBEDDINGS_PATH = Path(__file__).parent / "data" / "skill_embeddings.npz"
+# Skills that aren't in the dictionary get a hashed id at or above this offset, so they never collide with it
+UNKNOWN_SKILL_ID_OFFSET = 1 << 30
+SENIORITY_LEVELS = {"none": 0, "junior": 1, "midlevel": 2, "senior": 3}
+# How many levels below or above the seniority of a job a candidate may be, e.g. SENIORITY_LEVELS_BELOW=1
+# lets senior jobs accept midlevel candidates. The API reads the same variables, see api/lib/enrichment.py
+SENIORITY_LEVELS_BELOW = int(os.getenv("SENIORITY_LEVELS_BELOW", "0"))
+SENIORITY_LEVELS_ABOVE = int(os.getenv("SENIORITY_LEVELS_ABOVE", "0"))
+
+# Field with the skill ids per skill field
+SKILL_ID_FIELDS = {"top_skills": "top_skill_ids", "other_skills": "other_skill_ids"}
+# Weight of the skills of every field in the skill_vector of a document
+SKILL_VECTOR_WEIGHTS = {"top_skills": 1.0, "other_skills": 0.5}
+
+
+def normalize(name: str) -> str:
+    """Normalizes a skill or seniority like the `lowercase` normalizer, and collapses whitespace."""
+    return " ".join(name.lower().split())
+
+
+class Enricher:
+    """
+    Adds canonical ids of the skills and ordinals of the seniorities to documents before they are indexed,
+    so synonyms like "Softwareentwicklung" and "Software Development" match and seniorities can be
+    compared by range.
+
+    The skill dictionary is a JSON array of {"id", "name", "synonyms"} entries. Ids must never be reused,
+    new skills are appended with new ids.
+
+    If skill embeddings exist (see skill_embeddings.py), documents also get a `skill_vector`, the normalized
+    weighted mean of the embeddings of their skills, for the semantic matching mode.
+
+    Args:
+        dictionary_path (Path): the skill dictionary
+        embeddings_path (Path): the skill embeddings
+    """
+
+    def __init__(self, dictionary_path: Path = SKILL_DICTIONARY_PATH, embeddings_path: Path = SKILL_EMBEDDINGS_PATH):
+        with open(dictionary_path, encoding="utf-8") as file_pointer:
+            entries = json.load(file_pointer)
+        self.skill_ids = {}
+        for entry in entries:
+            for name in [entry["name"], *entry.get("synonyms", [])]:
+                self.skill_ids[normalize(name)] = entry["id"]
+
+        self.skill_vectors = {}
+        if embeddings_path.exists():
+            embeddings = np.load(embeddings_path)
+            self.skill_vectors = dict(zip(embeddings["ids"].tolist(), embeddings["vectors"]))
+
+    def skill_id(self, skill: str) -> int:
+        name = normalize(skill)
+        skill_id = self.skill_ids.get(name)
+        if skill_id is None:
+            skill_id = UNKNOWN_SKILL_ID_OFFSET + zlib.crc32(name.encode("utf-8")) % UNKNOWN_SKILL_ID_OFFSET
+        return skill_id
+
+    def skill_id_list(self, skills: Iterable[str]) -> list[int]:
+        """Returns the ids of the skills in their order, synonyms of an earlier skill are dropped."""
+        return list(dict.fromkeys(self.skill_id(skill) for skill in skills))
+
+    def enrich(self, source: dict, stored: Optional[dict] = None) -> dict:
+        """
+        Adds the enriched fields of all source fields the document (or partial document of an update) has.
+        Unknown seniorities get no level.
+
+        The skill_vector depends on all skill fields, so it is recomputed whenever one of them changes. A partial
+        document takes the skill fields it doesn't change from the stored one, and its skill_vector is removed if
+        none of the skills has an embedding anymore.
+
+        Args:
+            source (dict): the document or the partial document of an update
+            stored (Optional[dict]): skill fields of the document a partial update is applied to, {} if it doesn't
+                exist yet, None for whole documents
+
+        Returns:
+            dict: the same document
+        """
+        for field, enriched_field in SKILL_ID_FIELDS.items():
+            if field in source:
+                source[enriched_field] = self.skill_id_list(source[field] or [])
+        if self.skill_vectors and any(field in source for field in SKILL_ID_FIELDS):
+            skills = {field: source.get(field, (stored or {}).get(field)) for field in SKILL_VECTOR_WEIGHTS}
+            vector = self.skill_vector(skills)
+            if vector is not None or stored is not None:
+                source["skill_vector"] = vector
+        if "seniority" in source:
+            source["seniority_level"] = seniority_level(source["seniority"])
+        if "seniorities" in source:
+            levels = (seniority_level(seniority) for seniority in source["seniorities"] or [])
+            source["seniority_levels"] = sorted({level for level in levels if level is not None})
+        return source
+
+    def skill_vector(self, source: dict) -> Optional[list[float]]:
+        """Returns the normalized weighted mean of the embeddings of the skills, None if none has one."""
+        vector = None
+        for field, weight in SKILL_VECTOR_WEIGHTS.items():
+            for skill_id in self.skill_id_list(source.get(field) or []):
+                skill_vector = self.skill_vectors.get(skill_id)
+                if skill_vector is not None:
+                    vector = weight * skill_vector if vector is None else vector + weight * skill_vector
+        norm = 0.0 if vector is None else float(np.linalg.norm(vector))
+        return None if norm == 0.0 else (vector / norm).tolist()
+
+
+def seniority_level(seniority: Optional[str]) -> Optional[int]:
+    return None if seniority is None else SENIORITY_LEVELS.get(normalize(seniority))
+
+
+def accepts(job_level: int, candidate_level: int) -> bool:
+    """Whether a job of the given seniority level accepts a candidate of the other one."""
+    return job_level - SENIORITY_LEVELS_BELOW <= candidate_level <= job_level + SENIORITY_LEVELS_ABOVE
@@ -0,0 +1,162 @@
+import argparse
+import json
+import logging
+import math
+import random
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Iterator, Optional
+
+from populate_es_indices import DATA_PATH, iter_actions
+
+_LOGGER = logging.getLogger("python_developer_test")
+
+# Fields that hold skills and the salary field of every index
+SKILL_FIELDS = ["top_skills", "other_skills"]
+SALARY_FIELDS = {"jobs": "max_salary", "candidates": "salary_expectation"}
+
+
+class DocumentSampler:
+    """
+    Generates documents that are distributed like the seed documents of an index.
+
+    Every document starts as a copy of a random seed document, so the joint distribution of the fields
+    (e.g. salaries per seniority, which skills appear together, missing values) is kept. It is then perturbed:
+    every skill is swapped with probability `skill_swap_probability` for a skill drawn by its popularity in that
+    field, and salaries are scaled by a log-normal factor with `salary_sigma` and rounded to 500.
+
+    Args:
+        seed_documents (list[dict]): the _source of all seed documents of the index
+        salary_field (str): "max_salary" or "salary_expectation"
+        skill_swap_probability (float): probability that a skill is replaced by another one
+        salary_sigma (float): standard deviation of the logarithm of the salary factor
+        rng (random.Random): source of randomness
+    """
+
+    def __init__(
+        self,
+        seed_documents: list[dict],
+        *,
+        salary_field: str,
+        skill_swap_probability: float,
+        salary_sigma: float,
+        rng: random.Random,
+    ):
+        self.seed_documents = seed_documents
+        self.salary_field = salary_field
+        self.skill_swap_probability = skill_swap_probability
+        self.salary_sigma = salary_sigma
+        self.rng = rng
+
+        self.skill_populations: dict[str, tuple[list[str], list[int]]] = {}
+        for field in SKILL_FIELDS:
+            counts = Counter(skill for document in seed_documents for skill in document.get(field) or [])
+            skills = sorted(counts)
+            # Cumulative weights make every draw a bisect instead of a pass over all skills
+            cumulative, total = [], 0
+            for skill in skills:
+                total += counts[skill]
+                cumulative.append(total)
+            self.skill_populations[field] = (skills, cumulative)
+
+    def sample(self) -> dict:
+        document = dict(self.rng.choice(self.seed_documents))
+
+        for field in SKILL_FIELDS:
+            skills, cumulative = self.skill_populations[field]
+            if not document.get(field) or not skills:
+                continue
+            sampled = []
+            for skill in document[field]:
+                if self.rng.random() < self.skill_swap_probability:
+                    skill = self.rng.choices(skills, cum_weights=cumulative)[0]
+                if skill not in sampled:
+                    sampled.append(skill)
+            document[field] = sampled
+
+        salary = document.get(self.salary_field)
+        if salary is not None:
+            salary = max(500, round(salary * math.exp(self.rng.gauss(0, self.salary_sigma)) / 500) * 500)
+            document[self.salary_field] = salary if isinstance(document[self.salary_field], int) else float(salary)
+
+        return document
+
+
+def generate(
+    *,
+    index_name: str,
+    count: int,
+    skill_swap_probability: float,
+    salary_sigma: float,
+    seed: Optional[int],
+) -> Iterator[dict]:
+    """
+    Yields `count` actions in the format of the seed data files, with the ids 1 to `count`.
+
+    Args:
+        index_name (str): "jobs" or "candidates", the seed file of the index is the template
+        count (int): number of documents to generate
+        skill_swap_probability (float): see DocumentSampler
+        salary_sigma (float): see DocumentSampler
+        seed (Optional[int]): seed of the random generator, for reproducible data
+    """
+    sampler = DocumentSampler(
+        [action["_source"] for action in iter_actions(DATA_PATH / (index_name + ".json"))],
+        salary_field=SALARY_FIELDS[index_name],
+        skill_swap_probability=skill_swap_probability,
+        salary_sigma=salary_sigma,
+        rng=random.Random(seed),
+    )
+    for id in range(1, count + 1):
+        yield {"_source": sampler.sample(), "_id": id}
+
+
+def write_actions(*, output_path: Path, index_name: str, actions: Iterator[dict]) -> int:
+    """
+    Writes the actions as a JSON array with one action per line, streaming so memory doesn't grow with the count.
+
+    Returns:
+        int: number of written actions
+    """
+    output_path.mkdir(parents=True, exist_ok=True)
+    written = 0
+    with open(output_path / (index_name + ".json"), mode="w", encoding="utf-8") as file_pointer:
+        file_pointer.write("[\n")
+        for action in actions:
+            if written:
+                file_pointer.write(",\n")
+            file_pointer.write(json.dumps(action, ensure_ascii=False))
+            written += 1
+        file_pointer.write("\n]\n")
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Generates jobs and candidates distributed like the seed data, in the format of the data files."
+    )
+    parser.add_argument("--jobs", type=int, default=500_000, help="number of jobs to generate")
+    parser.add_argument("--candidates", type=int, default=1_000_000, help="number of candidates to generate")
+    parser.add_argument("--output-path", type=Path, default=DATA_PATH / "generated")
+    parser.add_argument("--skill-swap-probability", type=float, default=0.2)
+    parser.add_argument("--salary-sigma", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    for index_name, count in (("jobs", args.jobs), ("candidates", args.candidates)):
+        start = time.perf_counter()
+        written = write_actions(
+            output_path=args.output_path,
+            index_name=index_name,
+            actions=generate(
+                index_name=index_name,
+                count=count,
+                skill_swap_probability=args.skill_swap_probability,
+                salary_sigma=args.salary_sigma,
+                seed=args.seed,
+            ),
+        )
+        _LOGGER.info(
+            f"Wrote {written} {index_name} to {args.output_path} ({written / (time.perf_counter() - start):.0f} docs/s)."
+        )
@@ -0,0 +1,80 @@
+from typing import Callable, Optional
+
+from enrichment import SENIORITY_LEVELS_ABOVE, SENIORITY_LEVELS_BELOW
+
+# Percolator index with the matching query of every document of an index, e.g. percolating a new job against
+# percolate_candidates returns the candidates it matches
+PERCOLATOR_INDICES = {"candidates": "percolate_candidates", "jobs": "percolate_jobs"}
+
+
+def candidate_query(candidate: dict) -> dict:
+    """
+    Returns the query for the jobs matching an enriched candidate, with the same clauses as
+    `CandidateRepository._extract_queries_from_candidate` with all filters selected.
+    """
+    seniority_level = candidate.get("seniority_level")
+    top_skill_ids = candidate.get("top_skill_ids") or []
+    # A candidate without a known seniority matches no job by seniority
+    seniority_query = {"match_none": {}}
+    if seniority_level is not None:
+        levels = {"gte": seniority_level - SENIORITY_LEVELS_ABOVE, "lte": seniority_level + SENIORITY_LEVELS_BELOW}
+        seniority_query = {"constant_score": {"filter": {"range": {"seniority_levels": levels}}}}
+    return {
+        "bool": {
+            "should": [
+                _salary_query("max_salary", "gte", candidate.get("salary_expectation")),
+                seniority_query,
+                _top_skills_query(top_skill_ids),
+            ]
+        }
+    }
+
+
+def job_query(job: dict) -> dict:
+    """
+    Returns the query for the candidates matching an enriched job, with the same clauses as
+    `JobRepository._extract_queries_from_job` with all filters selected.
+    """
+    seniority_levels = job.get("seniority_levels") or []
+    # A job without a known seniority matches no candidate by seniority
+    seniority_query = {"match_none": {}}
+    if seniority_levels:
+        ranges = [
+            {
+                "range": {
+                    "seniority_level": {"gte": level - SENIORITY_LEVELS_BELOW, "lte": level + SENIORITY_LEVELS_ABOVE}
+                }
+            }
+            for level in seniority_levels
+        ]
+        seniority_query = {"constant_score": {"filter": {"bool": {"should": ranges}}}}
+    return {
+        "bool": {
+            "should": [
+                _salary_query("salary_expectation", "lte", job.get("max_salary")),
+                seniority_query,
+                _top_skills_query(job.get("top_skill_ids") or []),
+            ]
+        }
+    }
+
+
+def _salary_query(field: str, operator: str, salary: Optional[int]) -> dict:
+    # Without a salary the range would be unbounded and match everything
+    if salary is None:
+        return {"match_none": {}}
+    return {"constant_score": {"filter": {"range": {field: {operator: salary}}}}}
+
+
+def _top_skills_query(top_skill_ids: list) -> dict:
+    return {
+        "terms_set": {"top_skill_ids": {"terms": top_skill_ids, "minimum_should_match": min(2, len(top_skill_ids))}}
+    }
+
+
+MATCHING_QUERIES: dict[str, Callable[[dict], dict]] = {"candidates": candidate_query, "jobs": job_query}
+
+
+def percolator_action(index_name: str, id, source: dict) -> dict:
+    """Returns the bulk action that stores the matching query of an enriched document of `index_name`."""
+    return {"_id": id, "_source": {"id": id, "query": MATCHING_QUERIES[index_name](source)}}
@@ -1,12 +1,19 @@
+import argparse
 import json
 import logging
 import os
+import re
+import time
 from pathlib import Path
+from typing import Callable, Iterator, Optional
 
 import yaml
 from dotenv import load_dotenv
-from elasticsearch import Elasticsearch
-from elasticsearch.helpers import bulk
+from elasticsearch import Elasticsearch, NotFoundError
+from elasticsearch.helpers import parallel_bulk
+from enrichment import SKILL_VECTOR_WEIGHTS, Enricher
+from percolator import PERCOLATOR_INDICES, percolator_action
+from snapshot import export_snapshot
 
 _LOGGER = logging.getLogger("python_developer_test")
 logging.basicConfig(
@@ -33,57 +40,445 @@ ES_URL = os.getenv("ES_URL")
 ES_CONFIG_PATH = Path(__file__).parent / "es_config"
 DATA_PATH = Path(__file__).parent / "data"
 
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "1000"))
+BULK_THREAD_COUNT = int(os.getenv("BULK_THREAD_COUNT", "4"))
+# Number of failed actions that are reported in the IndexPopulationError
+MAX_REPORTED_ERRORS = 10
+# Index versions kept per alias, the published one and the previous ones for a rollback
+KEEP_VERSIONS = int(os.getenv("KEEP_VERSIONS", "2"))
+WARM_UP_SEARCHES = int(os.getenv("WARM_UP_SEARCHES", "3"))
+# Directory the columnar snapshots of the indices are written to for the api, see snapshot.py, none without it
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR")
 
-def index_setup(*, es_client: Elasticsearch, index_name: str, index_settings: dict):
-    if es_client.indices.exists(index=index_name):
-        es_client.indices.delete(index=index_name)
+# Field every change of a change file needs per operation type
+CHANGE_FIELDS = {"index": "_source", "update": "doc", "delete": None}
 
-    index_mapping = read_yaml(ES_CONFIG_PATH / ("mappings_" + index_name + ".yml"))
+_SEPARATORS = re.compile(r"[\s,]*")
 
-    es_client.indices.create(index=index_name, mappings=index_mapping, settings=index_settings)
-    _LOGGER.info(f"Successfully created index {index_name}.")
 
+def index_setup(
+    *, es_client: Elasticsearch, index_name: str, index_settings: dict, mapping_name: Optional[str] = None
+) -> str:
+    """
+    Creates the next version of an index, "<index_name>_v<n>", next to the versions that are in use.
+    The API only reads through the alias `index_name`, see `publish`, so it keeps serving the current
+    version while the new one is populated.
+
+    Args:
+        index_name (str): Name of the alias, e.g. candidates or jobs.
+        index_settings (dict): settings of the new index.
+        mapping_name (Optional[str]): mapping file "mappings_<mapping_name>.yml", defaults to index_name.
 
-def populate(*, es_client: Elasticsearch, index_name: str) -> None:
+    Returns:
+        str: Name of the created index.
     """
-    Populates indices defined in config by inserting all actions.
+    index_mapping = read_yaml(ES_CONFIG_PATH / ("mappings_" + (mapping_name or index_name) + ".yml"))
+
+    versions = index_versions(es_client=es_client, index_name=index_name)
+    versioned_name = f"{index_name}_v{(versions[-1] if versions else 0) + 1}"
+
+    es_client.indices.create(index=versioned_name, mappings=index_mapping, settings=index_settings)
+    _LOGGER.info(f"Successfully created index {versioned_name}.")
+    return versioned_name
+
+
+def index_versions(*, es_client: Elasticsearch, index_name: str) -> list[int]:
+    """Returns the existing version numbers of an index in ascending order."""
+    pattern = re.compile(re.escape(index_name) + r"_v(\d+)")
+    indices = es_client.indices.get(index=f"{index_name}_v*", expand_wildcards="open,closed", allow_no_indices=True)
+    return sorted(int(match.group(1)) for name in indices if (match := pattern.fullmatch(name)))
+
+
+def publish(*, es_client: Elasticsearch, index_name: str, versioned_name: str, keep_versions: int = KEEP_VERSIONS):
+    """
+    Warms up a populated index version and points the alias `index_name` to it in one atomic alias update,
+    so readers switch from the old to the new version without seeing a missing or half filled index.
+    Afterwards all but the newest `keep_versions` versions are deleted, the previous ones allow a quick rollback
+    by pointing the alias back.
+
+    An index that still has the plain name `index_name`, as created by earlier versions of the seeder,
+    is deleted by the same alias update.
+
+    Args:
+        index_name (str): Name of the alias, e.g. candidates or jobs.
+        versioned_name (str): Name of the index version to publish.
+        keep_versions (int): Number of versions to keep, including the published one.
+    """
+    warm_up(es_client=es_client, index_name=versioned_name)
+
+    actions = [{"add": {"index": versioned_name, "alias": index_name}}]
+    if es_client.indices.exists_alias(name=index_name):
+        current = es_client.indices.get_alias(name=index_name)
+        actions += [{"remove": {"index": name, "alias": index_name}} for name in current if name != versioned_name]
+    elif es_client.indices.exists(index=index_name):
+        actions.append({"remove_index": {"index": index_name}})
+    es_client.indices.update_aliases(actions=actions)
+    _LOGGER.info(f"Alias {index_name} now points to {versioned_name}.")
+
+    for version in index_versions(es_client=es_client, index_name=index_name)[:-keep_versions]:
+        name = f"{index_name}_v{version}"
+        if name != versioned_name:
+            es_client.indices.delete(index=name)
+            _LOGGER.info(f"Deleted old index {name}.")
+
+
+def warm_up(*, es_client: Elasticsearch, index_name: str) -> None:
+    """
+    Waits until all primaries of a new index are allocated and runs a few searches over every field, so
+    caches, global ordinals and the file system cache are loaded before the index gets traffic.
+    """
+    es_client.cluster.health(index=index_name, wait_for_status="yellow", timeout="60s")
+    fields = es_client.indices.get_mapping(index=index_name)[index_name]["mappings"].get("properties", {})
+    aggregations = {}
+    for field, mapping in fields.items():
+        if mapping.get("type") == "keyword":
+            aggregations[field] = {"terms": {"field": field, "size": 100}}
+        elif mapping.get("type") in ("byte", "integer", "long", "float", "double"):
+            aggregations[field] = {"stats": {"field": field}}
+    for _ in range(WARM_UP_SEARCHES):
+        es_client.search(index=index_name, size=100, aggs=aggregations, request_cache=False)
+    _LOGGER.info(f"Warmed up index {index_name}.")
+
+
+def iter_actions(path: Path, buffer_size: int = 1 << 20) -> Iterator[dict]:
+    """
+    Yields the actions of a data file, a JSON array of {"_id", "_source"} objects, one by one.
+    The file is read in chunks of `buffer_size` characters, so memory doesn't grow with the size of the file.
+
+    Args:
+        path (Path): data file to read
+
+    Raises:
+        ValueError: If the file isn't a JSON array of objects.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, encoding="utf-8") as file_pointer:
+        buffer = file_pointer.read(buffer_size)
+        position = _SEPARATORS.match(buffer).end()
+        if not buffer.startswith("[", position):
+            raise ValueError(f"{path} is not a JSON array.")
+        position += 1
+        end_of_file = False
+
+        while True:
+            position = _SEPARATORS.match(buffer, position).end()
+            if buffer.startswith("]", position):
+                return
+            try:
+                action, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # The action continues in the next chunk of the file
+                if end_of_file:
+                    raise ValueError(f"{path} is not a JSON array of objects.")
+                chunk = file_pointer.read(buffer_size)
+                end_of_file = not chunk
+                buffer, position = buffer[position:] + chunk, 0
+                continue
+            yield action
+
+
+def populate(
+    *,
+    es_client: Elasticsearch,
+    index_name: str,
+    versioned_name: str,
+    data_path: Path = DATA_PATH,
+    chunk_size: int = BULK_CHUNK_SIZE,
+    thread_count: int = BULK_THREAD_COUNT,
+    percolator: bool = False,
+) -> None:
+    """
+    Populates indices defined in config by streaming all actions of the data file into parallel bulk requests.
+    Every document is enriched with skill ids and seniority levels on the way, see `Enricher`.
+    Refreshes and replicas are turned off while loading and restored afterwards.
 
     Args:
         index_name (str): Name of index to populate, e.g. candidates or jobs.
+        versioned_name (str): Index version the documents are written to, see `index_setup`.
+        data_path (Path): directory of the data file, "<index_name>.json".
+        chunk_size (int): number of actions per bulk request.
+        thread_count (int): number of bulk requests sent concurrently.
+        percolator (bool): write the matching query of every document instead of the document,
+            `versioned_name` is a version of the percolator index of `index_name` then, see `percolator.py`.
 
     Raises:
         IndexPopulationError: If errors occur in bulk insertion.
     """
 
-    with open(DATA_PATH / (index_name + ".json")) as file_pointer:
-        actions = json.load(file_pointer)
+    enricher = Enricher()
+
+    def actions() -> Iterator[dict]:
+        for action in iter_actions(data_path / (index_name + ".json")):
+            # The id is also stored as field, it is the tiebreaker when paginating matches with search_after
+            action["_source"]["id"] = action["_id"]
+            enricher.enrich(action["_source"])
+            yield percolator_action(index_name, action["_id"], action["_source"]) if percolator else action
+
+    index_settings = es_client.indices.get_settings(
+        index=versioned_name, name=["index.refresh_interval", "index.number_of_replicas"], include_defaults=True
+    )[versioned_name]
+    restored_settings = {
+        "refresh_interval": _setting(index_settings, "refresh_interval"),
+        "number_of_replicas": _setting(index_settings, "number_of_replicas"),
+    }
+    es_client.indices.put_settings(index=versioned_name, settings={"refresh_interval": "-1", "number_of_replicas": 0})
+
+    start = time.perf_counter()
+    try:
+        indexed = _bulk(
+            es_client=es_client,
+            index_name=versioned_name,
+            actions=actions(),
+            chunk_size=chunk_size,
+            thread_count=thread_count,
+        )
+    finally:
+        es_client.indices.put_settings(index=versioned_name, settings=restored_settings)
+        es_client.indices.refresh(index=versioned_name)
+    duration = time.perf_counter() - start
+
+    _LOGGER.info(
+        f"Successfully populated index {versioned_name} with {indexed} documents in {duration:.1f}s "
+        f"({indexed / duration:.0f} docs/s)."
+    )
+
+
+def iter_changes(
+    path: Path, enricher: Enricher, stored_skills: Callable[[str], Optional[dict]] = lambda id: None
+) -> Iterator[dict]:
+    """
+    Yields the bulk actions of an NDJSON change file. Every line is one change:
+    {"_id": 1, "_source": {...}} replaces or adds a document, {"_op_type": "update", "_id": 1, "doc": {...}}
+    changes some fields (and adds the document if it doesn't exist) and {"_op_type": "delete", "_id": 1}
+    removes it. Documents and changed fields are enriched like by `populate`.
+
+    Args:
+        path (Path): the NDJSON change file
+        enricher (Enricher): enriches the documents and changed fields
+        stored_skills: returns the skill fields of the stored document of an id, None if it doesn't exist. An
+            update that changes only some of the skill fields needs the others for its skill_vector
+
+    Raises:
+        ValueError: If a line isn't a change.
+    """
+    with open(path, encoding="utf-8") as file_pointer:
+        for line_number, line in enumerate(file_pointer, start=1):
+            if not line.strip():
+                continue
+            change = json.loads(line)
+            op_type = change.get("_op_type", "index")
+            if "_id" not in change or op_type not in CHANGE_FIELDS:
+                raise ValueError(f"line {line_number} of {path} is not a valid change.")
+            required_field = CHANGE_FIELDS[op_type]
+            if required_field is not None and not isinstance(change.get(required_field), dict):
+                raise ValueError(f"line {line_number} of {path} has no '{required_field}' object.")
+
+            if op_type == "index":
+                change["_source"]["id"] = change["_id"]
+                enricher.enrich(change["_source"])
+            elif op_type == "update":
+                change["doc"]["id"] = change["_id"]
+                stored = None
+                if any(field in change["doc"] for field in SKILL_VECTOR_WEIGHTS):
+                    stored = {}
+                    if not all(field in change["doc"] for field in SKILL_VECTOR_WEIGHTS):
+                        stored = stored_skills(change["_id"]) or {}
+                enricher.enrich(change["doc"], stored)
+                change["doc_as_upsert"] = True
+            yield change
+
+
+def apply_changes(
+    *,
+    es_client: Elasticsearch,
+    index_name: str,
+    changes_path: Path,
+    chunk_size: int = BULK_CHUNK_SIZE,
+    thread_count: int = BULK_THREAD_COUNT,
+) -> None:
+    """
+    Applies an NDJSON change file (see `iter_changes`) to the index version the alias `index_name` points to,
+    without rebuilding the index. The changes are visible once they are applied, the alias stays where it is.
+    Afterwards the matching queries of the changed documents are updated in the percolator index, see `sync_percolator`.
+
+    Args:
+        index_name (str): Name of the alias, e.g. candidates or jobs.
+        changes_path (Path): the NDJSON change file.
+        chunk_size (int): number of changes per bulk request.
+        thread_count (int): number of bulk requests sent concurrently.
+
+    Raises:
+        IndexPopulationError: If changes could not be applied.
+    """
+    changed_ids = []
+
+    def stored_skills(id: str) -> Optional[dict]:
+        try:
+            return es_client.get(index=index_name, id=id, source_includes=list(SKILL_VECTOR_WEIGHTS))["_source"]
+        except NotFoundError:
+            return None
+
+    def changes() -> Iterator[dict]:
+        for change in iter_changes(changes_path, Enricher(), stored_skills):
+            changed_ids.append(change["_id"])
+            yield change
+
+    start = time.perf_counter()
+    applied = _bulk(
+        es_client=es_client, index_name=index_name, actions=changes(), chunk_size=chunk_size, thread_count=thread_count
+    )
+    es_client.indices.refresh(index=index_name)
+
+    _LOGGER.info(f"Successfully applied {applied} changes to index {index_name} in {time.perf_counter() - start:.1f}s.")
+    sync_percolator(
+        es_client=es_client, index_name=index_name, ids=changed_ids, chunk_size=chunk_size, thread_count=thread_count
+    )
+
+
+def sync_percolator(
+    *,
+    es_client: Elasticsearch,
+    index_name: str,
+    ids: list,
+    chunk_size: int = BULK_CHUNK_SIZE,
+    thread_count: int = BULK_THREAD_COUNT,
+) -> None:
+    """
+    Rewrites the matching queries of the given documents in the percolator index of `index_name` from their
+    current version, read back from the index after an update merged it, and removes the ones of deleted documents.
+
+    Args:
+        index_name (str): Name of the alias, e.g. candidates or jobs.
+        ids (list): ids of the changed documents.
+        chunk_size (int): number of documents read and written per request.
+        thread_count (int): number of bulk requests sent concurrently.
 
-    _, errors = bulk(
+    Raises:
+        IndexPopulationError: If queries could not be written.
+    """
+    percolator_name = PERCOLATOR_INDICES[index_name]
+    if not es_client.indices.exists_alias(name=percolator_name):
+        _LOGGER.warning(f"There is no percolator index {percolator_name}, run a full rebuild to create it.")
+        return
+    ids = list(dict.fromkeys(ids))
+
+    def actions() -> Iterator[dict]:
+        for start in range(0, len(ids), chunk_size):
+            for document in es_client.mget(index=index_name, ids=ids[start : start + chunk_size])["docs"]:
+                if document.get("found"):
+                    yield percolator_action(index_name, document["_id"], document["_source"])
+                else:
+                    yield {"_op_type": "delete", "_id": document["_id"]}
+
+    synced = _bulk(
+        es_client=es_client,
+        index_name=percolator_name,
+        actions=actions(),
+        chunk_size=chunk_size,
+        thread_count=thread_count,
+        ignore_missing=True,
+    )
+    es_client.indices.refresh(index=percolator_name)
+    _LOGGER.info(f"Successfully synced {synced} matching queries to index {percolator_name}.")
+
+
+def _bulk(
+    *,
+    es_client: Elasticsearch,
+    index_name: str,
+    actions: Iterator[dict],
+    chunk_size: int,
+    thread_count: int,
+    ignore_missing: bool = False,
+) -> int:
+    """
+    Sends the actions with concurrent bulk requests and returns the number of successful ones.
+    With `ignore_missing` deletes of documents that don't exist count as successful.
+
+    Raises:
+        IndexPopulationError: If some actions failed.
+    """
+    succeeded, errors = 0, []
+    for ok, item in parallel_bulk(
         client=es_client,
         actions=actions,
         index=index_name,
-        chunk_size=50,
+        chunk_size=chunk_size,
+        thread_count=thread_count,
         raise_on_error=False,
-        refresh=True,
-    )
+    ):
+        if ok or (ignore_missing and item.get("delete", {}).get("status") == 404):
+            succeeded += 1
+        elif len(errors) < MAX_REPORTED_ERRORS:
+            errors.append(item)
+
     if errors:
         raise IndexPopulationError(f"failed to index some documents: {errors}.")
+    return succeeded
 
-    _LOGGER.info(f"Successfully populated index {index_name}.")
+
+def _setting(index_settings: dict, name: str):
+    """Returns the explicitly set value of an index setting, or its default."""
+    for scope in ("settings", "defaults"):
+        value = index_settings.get(scope, {}).get("index", {}).get(name)
+        if value is not None:
+            return value
+    return None
 
 
 if __name__ == "__main__":
-    es_client = Elasticsearch(ES_URL)
-    es_client.cluster.put_settings(persistent=read_yaml(ES_CONFIG_PATH / "cluster_settings.yml")["persistent"])
+    parser = argparse.ArgumentParser(
+        description="Builds new versions of the jobs and candidates indices and their percolator indices from the "
+        "data files and publishes them, or applies a change file to one of them with --changes."
+    )
+    parser.add_argument("--data-path", type=Path, default=DATA_PATH, help="directory of jobs.json and candidates.json")
+    parser.add_argument("--chunk-size", type=int, default=BULK_CHUNK_SIZE, help="actions per bulk request")
+    parser.add_argument("--thread-count", type=int, default=BULK_THREAD_COUNT, help="concurrent bulk requests")
+    parser.add_argument("--keep-versions", type=int, default=KEEP_VERSIONS, help="index versions kept per index")
+    parser.add_argument("--changes", type=Path, help="NDJSON change file to apply instead of a full rebuild")
+    parser.add_argument("--index", choices=["jobs", "candidates"], help="index the change file is applied to")
+    parser.add_argument(
+        "--snapshot-dir", type=Path, default=SNAPSHOT_DIR, help="directory the snapshots of the indices are written to"
+    )
+    args = parser.parse_args()
+    if args.changes is not None and args.index is None:
+        parser.error("--changes requires --index")
+    bulk_options = {"chunk_size": args.chunk_size, "thread_count": args.thread_count}
 
-    index_settings = read_yaml(ES_CONFIG_PATH / "index_settings.yml")
+    es_client = Elasticsearch(ES_URL)
 
-    index_setup(es_client=es_client, index_name="jobs", index_settings=index_settings)
-    populate(es_client=es_client, index_name="jobs")
+    if args.changes is not None:
+        apply_changes(es_client=es_client, index_name=args.index, changes_path=args.changes, **bulk_options)
+        if args.snapshot_dir is not None:
+            path = export_snapshot(es_client=es_client, index_name=args.index, snapshot_dir=args.snapshot_dir)
+            _LOGGER.info(f"Wrote snapshot {path} of index {args.index}.")
+    else:
+        es_client.cluster.put_settings(persistent=read_yaml(ES_CONFIG_PATH / "cluster_settings.yml")["persistent"])
+        index_settings = read_yaml(ES_CONFIG_PATH / "index_settings.yml")
 
-    index_setup(
-        es_client=es_client,
-        index_name="candidates",
-        index_settings=index_settings,
-    )
-    populate(es_client=es_client, index_name="candidates")
+        for index_name in ("jobs", "candidates"):
+            # The documents and, in the percolator index, the matching query of every document
+            for target_name, percolator in ((index_name, False), (PERCOLATOR_INDICES[index_name], True)):
+                versioned_name = index_setup(es_client=es_client, index_name=target_name, index_settings=index_settings)
+                populate(
+                    es_client=es_client,
+                    index_name=index_name,
+                    versioned_name=versioned_name,
+                    data_path=args.data_path,
+                    percolator=percolator,
+                    **bulk_options,
+                )
+                publish(
+                    es_client=es_client,
+                    index_name=target_name,
+                    versioned_name=versioned_name,
+                    keep_versions=args.keep_versions,
+                )
+                if args.snapshot_dir is not None and not percolator:
+                    path = export_snapshot(
+                        es_client=es_client,
+                        index_name=index_name,
+                        snapshot_dir=args.snapshot_dir,
+                        concrete_index=versioned_name,
+                    )
+                    _LOGGER.info(f"Wrote snapshot {path} of index {versioned_name}.")
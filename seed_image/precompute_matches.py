@@ -0,0 +1,308 @@
+import argparse
+import json
+import logging
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+from elasticsearch import Elasticsearch
+from elasticsearch.helpers import bulk
+from enrichment import SENIORITY_LEVELS, Enricher, accepts
+from populate_es_indices import (
+    DATA_PATH,
+    ES_CONFIG_PATH,
+    ES_URL,
+    IndexPopulationError,
+    index_setup,
+    iter_actions,
+    publish,
+    read_yaml,
+)
+from scipy import sparse
+
+_LOGGER = logging.getLogger("python_developer_test")
+
+# BM25 parameters elasticsearch uses by default
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+@dataclass
+class EncodedEntities:
+    """
+    Column oriented encoding of all jobs or candidates.
+
+    Attributes:
+        ids: document ids
+        top_skills: sparse (n_entities x n_skills) 0/1 matrix over the shared vocabulary of skill ids
+        salaries: max_salary of jobs or salary_expectation of candidates, NaN if missing
+        seniorities: dense (n_entities x n_seniority_levels) one-hot, multi-hot for jobs
+    """
+
+    ids: np.ndarray
+    top_skills: sparse.csr_matrix
+    salaries: np.ndarray
+    seniorities: np.ndarray
+
+    def bm25_weights(self, matrix: sparse.csr_matrix) -> np.ndarray:
+        """
+        Returns the score elasticsearch gives a matching keyword term per column of the given field matrix,
+        BM25 with a term frequency of one and no length norms.
+        """
+        doc_count = np.count_nonzero(matrix.getnnz(axis=1))
+        term_doc_count = np.asarray(matrix.sum(axis=0)).ravel()
+        if not doc_count:
+            return np.zeros(matrix.shape[1], dtype=np.float32)
+        idf = np.log(1 + (doc_count - term_doc_count + 0.5) / (term_doc_count + 0.5))
+        average_values = matrix.nnz / doc_count
+        weights = idf / (1 + BM25_K1 * (1 - BM25_B + BM25_B / average_values))
+        return np.where(term_doc_count > 0, weights, 0).astype(np.float32)
+
+
+def read_entities(index_name: str, data_path: Path = DATA_PATH) -> list[tuple[int, dict]]:
+    """Reads the documents of a data file enriched like `populate` indexes them."""
+    enricher = Enricher()
+    return [
+        (int(action["_id"]), enricher.enrich(action["_source"]))
+        for action in iter_actions(data_path / (index_name + ".json"))
+    ]
+
+
+def encode(
+    entities: list[tuple[int, dict]],
+    *,
+    salary_field: str,
+    seniority_field: str,
+    skill_vocabulary: dict[int, int],
+) -> EncodedEntities:
+    rows, columns = [], []
+    seniorities = np.zeros((len(entities), len(SENIORITY_LEVELS)), dtype=np.float32)
+    salaries = np.full(len(entities), np.nan, dtype=np.float64)
+
+    for row, (_, source) in enumerate(entities):
+        for skill_id in set(source.get("top_skill_ids") or []):
+            rows.append(row)
+            columns.append(skill_vocabulary[skill_id])
+        level = source.get(seniority_field)
+        for value in level if isinstance(level, list) else [level]:
+            if value is not None:
+                seniorities[row, value] = 1
+        if source.get(salary_field) is not None:
+            salaries[row] = source[salary_field]
+
+    top_skills = sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.float32), (rows, columns)), shape=(len(entities), len(skill_vocabulary))
+    )
+    return EncodedEntities(
+        ids=np.array([id for id, _ in entities], dtype=np.int64),
+        top_skills=top_skills,
+        salaries=salaries,
+        seniorities=seniorities,
+    )
+
+
+def top_k_matches(
+    query: EncodedEntities,
+    target: EncodedEntities,
+    *,
+    k: int,
+    salary_match: str,
+    seniority_acceptance: np.ndarray,
+    row_chunk_size: int,
+    column_chunk_size: int,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Computes the top k targets for every query entity with the same OR semantics and scoring as the live
+    matching queries: a salary and a seniority clause (constant score 1) and a top skills clause that
+    requires min(2, n_query_top_skills) shared skill ids and scores the sum of the BM25 weights of the shared ones.
+    Pairs are processed in blocks of row_chunk_size x column_chunk_size so memory stays bounded.
+
+    Args:
+        query: the entities we want matches for
+        target: the entities that can be matched
+        k: number of matches to keep per query entity
+        salary_match: "gte" if the target salary has to be >= the query salary, "lte" for <=
+        seniority_acceptance: (n_seniority_levels x n_seniority_levels) 0/1 matrix, 1 if a query entity of the
+            row level matches a target entity of the column level
+        row_chunk_size: number of query entities per block
+        column_chunk_size: number of target entities per block
+
+    Returns:
+        (ids, scores): two (n_query x k) arrays ordered by descending score,
+            rows with fewer than k matches are padded with -inf scores
+    """
+    skill_weights = target.bm25_weights(target.top_skills)
+    weighted_query_skills = query.top_skills.multiply(skill_weights[None, :]).tocsr()
+    n_query_skills = np.asarray(query.top_skills.sum(axis=1)).ravel()
+    required_overlap = np.where(n_query_skills > 0, np.minimum(2, n_query_skills), np.inf)
+    target_skills = target.top_skills.T.tocsc()
+
+    n_queries, n_targets = len(query.ids), len(target.ids)
+    best_ids = np.full((n_queries, k), -1, dtype=np.int64)
+    best_scores = np.full((n_queries, k), -np.inf, dtype=np.float32)
+
+    for row_start in range(0, n_queries, row_chunk_size):
+        rows = slice(row_start, min(row_start + row_chunk_size, n_queries))
+        chunk_ids = best_ids[rows]
+        chunk_scores = best_scores[rows]
+
+        for column_start in range(0, n_targets, column_chunk_size):
+            columns = slice(column_start, min(column_start + column_chunk_size, n_targets))
+
+            with np.errstate(invalid="ignore"):
+                if salary_match == "gte":
+                    salary = target.salaries[None, columns] >= query.salaries[rows, None]
+                else:
+                    salary = target.salaries[None, columns] <= query.salaries[rows, None]
+            seniority = (query.seniorities[rows] @ seniority_acceptance @ target.seniorities[columns].T) > 0
+            overlap = (query.top_skills[rows] @ target_skills[:, columns]).toarray()
+            top_skills = overlap >= required_overlap[rows, None]
+
+            scores = salary.astype(np.float32) + seniority
+            scores += np.where(top_skills, (weighted_query_skills[rows] @ target_skills[:, columns]).toarray(), 0)
+            scores = np.where(salary | seniority | top_skills, scores, -np.inf).astype(np.float32)
+
+            block_ids = np.broadcast_to(target.ids[columns], scores.shape)
+            chunk_ids, chunk_scores = _merge_top_k(
+                np.concatenate([chunk_ids, block_ids], axis=1),
+                np.concatenate([chunk_scores, scores], axis=1),
+                k,
+            )
+
+        best_ids[rows] = chunk_ids
+        best_scores[rows] = chunk_scores
+
+    return best_ids, best_scores
+
+
+def _merge_top_k(ids: np.ndarray, scores: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+    """Keeps the k best entries per row, ordered by descending score and ascending id."""
+    if scores.shape[1] > k:
+        candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        ids = np.take_along_axis(ids, candidates, axis=1)
+        scores = np.take_along_axis(scores, candidates, axis=1)
+    order = np.lexsort((np.where(ids < 0, np.iinfo(np.int64).max, ids), -scores), axis=1)
+    return np.take_along_axis(ids, order, axis=1), np.take_along_axis(scores, order, axis=1)
+
+
+def to_documents(query: EncodedEntities, ids: np.ndarray, scores: np.ndarray) -> list[dict]:
+    """Converts the top k arrays into documents in the bulk action format of the data files."""
+    documents = []
+    for id, match_ids, match_scores in zip(query.ids, ids, scores):
+        matches = [
+            {"id": int(match_id), "relevance_score": float(score)}
+            for match_id, score in zip(match_ids, match_scores)
+            if np.isfinite(score)
+        ]
+        documents.append({"_id": int(id), "_source": {"id": int(id), "matches": matches}})
+    return documents
+
+
+def compute_all_matches(
+    *, k: int, row_chunk_size: int, column_chunk_size: int, data_path: Path = DATA_PATH
+) -> dict[str, list[dict]]:
+    """
+    Computes the top k jobs of every candidate and the top k candidates of every job.
+
+    Returns:
+        dict[str, list[dict]]: documents of the "matches_candidates" (jobs per candidate)
+            and "matches_jobs" (candidates per job) indices
+    """
+    jobs = read_entities("jobs", data_path)
+    candidates = read_entities("candidates", data_path)
+
+    skill_ids = sorted({id for _, source in jobs + candidates for id in source.get("top_skill_ids") or []})
+    skill_vocabulary = {id: i for i, id in enumerate(skill_ids)}
+    encoded_jobs = encode(
+        jobs, salary_field="max_salary", seniority_field="seniority_levels", skill_vocabulary=skill_vocabulary
+    )
+    encoded_candidates = encode(
+        candidates,
+        salary_field="salary_expectation",
+        seniority_field="seniority_level",
+        skill_vocabulary=skill_vocabulary,
+    )
+    # Rows are job levels, columns candidate levels
+    acceptance = np.array(
+        [
+            [accepts(job_level, candidate_level) for candidate_level in range(len(SENIORITY_LEVELS))]
+            for job_level in range(len(SENIORITY_LEVELS))
+        ],
+        dtype=np.float32,
+    )
+    chunk_sizes = {"row_chunk_size": row_chunk_size, "column_chunk_size": column_chunk_size}
+
+    ids, scores = top_k_matches(
+        encoded_candidates, encoded_jobs, k=k, salary_match="gte", seniority_acceptance=acceptance.T, **chunk_sizes
+    )
+    matches_candidates = to_documents(encoded_candidates, ids, scores)
+    _LOGGER.info(f"Computed top {k} jobs for {len(candidates)} candidates.")
+
+    ids, scores = top_k_matches(
+        encoded_jobs, encoded_candidates, k=k, salary_match="lte", seniority_acceptance=acceptance, **chunk_sizes
+    )
+    matches_jobs = to_documents(encoded_jobs, ids, scores)
+    _LOGGER.info(f"Computed top {k} candidates for {len(jobs)} jobs.")
+
+    return {"matches_candidates": matches_candidates, "matches_jobs": matches_jobs}
+
+
+def write_index(*, es_client: Elasticsearch, index_name: str, documents: list[dict]) -> None:
+    """
+    Builds a new version of the given matches index with the precomputed matches and publishes it.
+
+    Raises:
+        IndexPopulationError: If errors occur in bulk insertion.
+    """
+    versioned_name = index_setup(
+        es_client=es_client,
+        index_name=index_name,
+        index_settings=read_yaml(ES_CONFIG_PATH / "index_settings.yml"),
+        mapping_name="matches",
+    )
+    _, errors = bulk(
+        client=es_client,
+        actions=documents,
+        index=versioned_name,
+        chunk_size=500,
+        raise_on_error=False,
+        refresh=True,
+    )
+    if errors:
+        raise IndexPopulationError(f"failed to index some documents: {errors}.")
+
+    _LOGGER.info(f"Successfully populated index {versioned_name}.")
+    publish(es_client=es_client, index_name=index_name, versioned_name=versioned_name)
+
+
+def write_file(*, output_path: Path, index_name: str, documents: list[dict]) -> None:
+    output_path.mkdir(parents=True, exist_ok=True)
+    with open(output_path / (index_name + ".json"), mode="w", encoding="utf-8") as file_pointer:
+        json.dump(documents, file_pointer)
+
+    _LOGGER.info(f"Successfully wrote {index_name} to {output_path}.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precomputes the top k matches of every job and candidate.")
+    parser.add_argument("--k", type=int, default=100, help="number of matches to keep per entity")
+    parser.add_argument("--data-path", type=Path, default=DATA_PATH, help="directory of jobs.json and candidates.json")
+    parser.add_argument("--target", choices=["elasticsearch", "file"], default="elasticsearch")
+    parser.add_argument("--output-path", type=Path, default=DATA_PATH, help="directory used with --target file")
+    parser.add_argument("--row-chunk-size", type=int, default=256)
+    parser.add_argument("--column-chunk-size", type=int, default=32768)
+    args = parser.parse_args()
+
+    all_matches = compute_all_matches(
+        k=args.k,
+        row_chunk_size=args.row_chunk_size,
+        column_chunk_size=args.column_chunk_size,
+        data_path=args.data_path,
+    )
+
+    es_client = Elasticsearch(ES_URL) if args.target == "elasticsearch" else None
+    for index_name, documents in all_matches.items():
+        if es_client is not None:
+            write_index(es_client=es_client, index_name=index_name, documents=documents)
+        else:
+            write_file(output_path=args.output_path, index_name=index_name, documents=documents)
@@ -0,0 +1,93 @@
+import argparse
+import logging
+from pathlib import Path
+
+import numpy as np
+from enrichment import SKILL_EMBEDDINGS_PATH, Enricher
+from populate_es_indices import DATA_PATH, iter_actions
+from scipy import sparse
+from scipy.sparse.linalg import svds
+
+_LOGGER = logging.getLogger("python_developer_test")
+
+# Has to match the dims of the skill_vector field in mappings_jobs.yml and mappings_candidates.yml
+EMBEDDING_DIMS = 64
+# Exponent of the context distribution smoothing, dampens the PMI of rare skills
+CONTEXT_SMOOTHING = 0.75
+
+
+def read_skill_sets(data_path: Path, enricher: Enricher) -> list[list[int]]:
+    """Returns the canonical ids of all skills, top and other ones, of every job and candidate."""
+    skill_sets = []
+    for index_name in ("jobs", "candidates"):
+        for action in iter_actions(data_path / (index_name + ".json")):
+            source = action["_source"]
+            skill_sets.append(
+                enricher.skill_id_list((source.get("top_skills") or []) + (source.get("other_skills") or []))
+            )
+    return skill_sets
+
+
+def compute_embeddings(skill_sets: list[list[int]], dims: int = EMBEDDING_DIMS) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Derives skill embeddings from how often skills appear in the same document: the positive pointwise mutual
+    information of all skill pairs is factorized with a truncated SVD, so skills that share many co-occurring
+    skills, e.g. "React" and "Vue", get similar vectors even if they never appear together.
+
+    Args:
+        skill_sets: canonical skill ids per document
+        dims: length of the vectors
+
+    Returns:
+        (ids, vectors): the skill ids and their L2 normalized (n_skills x dims) vectors,
+            skills without any co-occurring skill are left out
+    """
+    ids = np.array(sorted({id for skills in skill_sets for id in skills}), dtype=np.int64)
+    columns = {id: column for column, id in enumerate(ids)}
+    rows = [row for row, skills in enumerate(skill_sets) for _ in skills]
+    documents = sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.float64), (rows, [columns[id] for skills in skill_sets for id in skills])),
+        shape=(len(skill_sets), len(ids)),
+    )
+
+    cooccurrences = (documents.T @ documents).tocoo()
+    off_diagonal = cooccurrences.row != cooccurrences.col
+    counts = sparse.csr_matrix(
+        (cooccurrences.data[off_diagonal], (cooccurrences.row[off_diagonal], cooccurrences.col[off_diagonal])),
+        shape=cooccurrences.shape,
+    )
+    total = counts.sum()
+    if not total:
+        return ids[:0], np.zeros((0, dims), dtype=np.float32)
+
+    skill_counts = np.asarray(counts.sum(axis=1)).ravel()
+    context_counts = skill_counts**CONTEXT_SMOOTHING
+    pmi = counts.tocoo()
+    values = np.log(pmi.data * context_counts.sum() / (skill_counts[pmi.row] * context_counts[pmi.col]))
+    positive = values > 0
+    ppmi = sparse.csr_matrix(
+        (values[positive], (pmi.row[positive], pmi.col[positive])), shape=counts.shape, dtype=np.float64
+    )
+
+    k = min(dims, min(ppmi.shape) - 1)
+    u, s, _ = svds(ppmi, k=k, random_state=0)
+    vectors = np.zeros((len(ids), dims), dtype=np.float32)
+    vectors[:, :k] = u * np.sqrt(s)
+
+    norms = np.linalg.norm(vectors, axis=1)
+    known = norms > 0
+    return ids[known], (vectors[known] / norms[known, None]).astype(np.float32)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Derives skill embeddings from the co-occurrence of skills in the data files, "
+        "populate_es_indices.py stores the resulting vector of every job and candidate."
+    )
+    parser.add_argument("--data-path", type=Path, default=DATA_PATH, help="directory of jobs.json and candidates.json")
+    parser.add_argument("--output-path", type=Path, default=SKILL_EMBEDDINGS_PATH)
+    args = parser.parse_args()
+
+    skill_ids, skill_vectors = compute_embeddings(read_skill_sets(args.data_path, Enricher()))
+    np.savez(args.output_path, ids=skill_ids, vectors=skill_vectors)
+    _LOGGER.info(f"Wrote embeddings of {len(skill_ids)} skills to {args.output_path}.")
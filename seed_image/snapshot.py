@@ -0,0 +1,188 @@
+import json
+import os
+import struct
+import sys
+import time
+from array import array
+from pathlib import Path
+from typing import Iterable, Optional
+
+from elasticsearch import Elasticsearch
+from elasticsearch.helpers import scan
+
+# Columnar snapshot of the public fields of every document of an index, opened with mmap by the api workers
+# (api/lib/snapshot.py) to answer GET /jobs/{id} and GET /candidates/{id} without a request to elasticsearch.
+#
+# Layout: SNAPSHOT_MAGIC, the length of the JSON header as little endian uint32, the JSON header, and the
+# sections, every one aligned to 8 bytes from the start of the data, the first byte after the padded header.
+# The header lists every section with its offset from the start of the data, its length and its array typecode:
+#   rows                 int32 per document ID up to the highest one, the row of the document or -1
+#   seq_no, primary_term int64 per row, together with the concrete index they are the version of the document
+#   strings.offsets      uint32 per string + 1, the byte range of every string in strings.data (utf-8)
+#   <field>.offsets      uint32 per row + 1, the range of every row in <field>.values, for lists of strings
+#   <field>.values       uint32 string number of every element (lists of strings), int64 value of every row
+#                        with NULL_INT for null (int fields) or int32 string number with NULL_CODE (code fields)
+SNAPSHOT_MAGIC = b"ENTSNAP\x00"
+SNAPSHOT_FORMAT = 1
+NULL_INT = -(2**63)
+NULL_CODE = -1
+
+# Public fields of the documents of every index and how they are stored, see JobPublic and CandidatePublic
+SNAPSHOT_FIELDS = {
+    "jobs": {"top_skills": "strings", "other_skills": "strings", "seniorities": "strings", "max_salary": "int"},
+    "candidates": {
+        "top_skills": "strings",
+        "other_skills": "strings",
+        "seniority": "code",
+        "salary_expectation": "int",
+    },
+}
+
+_HEADER_LENGTH = struct.Struct("<I")
+
+
+class SnapshotWriter:
+    """
+    Collects the documents of one index column by column and writes them as snapshot file.
+
+    Args:
+        index_name (str): name of the index, e.g. jobs or candidates, it selects the stored fields
+        concrete_index (str): index version the documents were read from, e.g. jobs_v3
+    """
+
+    def __init__(self, index_name: str, concrete_index: str) -> None:
+        self.index_name = index_name
+        self.concrete_index = concrete_index
+        self.fields = SNAPSHOT_FIELDS[index_name]
+        self.ids = array("q")
+        self.seq_no = array("q")
+        self.primary_term = array("q")
+        self.strings: dict[str, int] = {}
+        self.columns: dict[str, array] = {}
+        for field, kind in self.fields.items():
+            if kind == "strings":
+                self.columns[f"{field}.offsets"] = array("I", [0])
+                self.columns[f"{field}.values"] = array("I")
+            else:
+                self.columns[f"{field}.values"] = array("q" if kind == "int" else "i")
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def add(self, id, source: dict, seq_no: int, primary_term: int) -> None:
+        """
+        Adds a document as next row.
+
+        Raises:
+            ValueError: If the ID isn't a non-negative integer or an int field has a fractional value.
+        """
+        id = int(id)
+        if id < 0:
+            raise ValueError(f"document ID {id} is negative.")
+        self.ids.append(id)
+        self.seq_no.append(seq_no)
+        self.primary_term.append(primary_term)
+        for field, kind in self.fields.items():
+            value = source.get(field)
+            values = self.columns[f"{field}.values"]
+            if kind == "strings":
+                values.extend(self._string_number(string) for string in value or [])
+                self.columns[f"{field}.offsets"].append(len(values))
+            elif kind == "code":
+                values.append(NULL_CODE if value is None else self._string_number(value))
+            elif value is None:
+                values.append(NULL_INT)
+            elif value != int(value):
+                raise ValueError(f"{field} of document {id} is not an integer: {value}.")
+            else:
+                values.append(int(value))
+
+    def write(self, path: Path) -> str:
+        """
+        Writes the snapshot to a temporary file next to `path` and renames it to `path`, so a worker
+        opening `path` always sees a complete file. Returns the version of the snapshot.
+        """
+        rows = array("i", [-1]) * (max(self.ids, default=-1) + 1)
+        for row, id in enumerate(self.ids):
+            rows[id] = row
+        string_data = bytearray()
+        string_offsets = array("I", [0])
+        for string in self.strings:
+            string_data += string.encode("utf-8")
+            string_offsets.append(len(string_data))
+
+        sections = {
+            "rows": rows,
+            "seq_no": self.seq_no,
+            "primary_term": self.primary_term,
+            "strings.offsets": string_offsets,
+            "strings.data": array("B", string_data),
+            **self.columns,
+        }
+        version = f"{self.concrete_index}@{time.time_ns()}"
+        header = {
+            "format": SNAPSHOT_FORMAT,
+            "byteorder": sys.byteorder,
+            "index": self.index_name,
+            "concrete_index": self.concrete_index,
+            "version": version,
+            "documents": len(self.ids),
+            "strings": len(self.strings),
+            "fields": self.fields,
+            "sections": {},
+        }
+        offset = 0
+        for name, values in sections.items():
+            header["sections"][name] = [offset, len(values) * values.itemsize, values.typecode]
+            offset += _padding(len(values) * values.itemsize)
+        encoded_header = json.dumps(header).encode("utf-8")
+
+        temporary_path = path.with_name(f".{path.name}.tmp")
+        with open(temporary_path, "wb") as file_pointer:
+            file_pointer.write(SNAPSHOT_MAGIC + _HEADER_LENGTH.pack(len(encoded_header)) + encoded_header)
+            file_pointer.write(bytes(_padding(file_pointer.tell()) - file_pointer.tell()))
+            for values in sections.values():
+                values.tofile(file_pointer)
+                size = len(values) * values.itemsize
+                file_pointer.write(bytes(_padding(size) - size))
+        os.replace(temporary_path, path)
+        return version
+
+    def _string_number(self, string: str) -> int:
+        return self.strings.setdefault(string, len(self.strings))
+
+
+def export_snapshot(
+    *, es_client: Elasticsearch, index_name: str, snapshot_dir: Path, concrete_index: Optional[str] = None
+) -> Path:
+    """
+    Writes the snapshot of the index version the alias `index_name` points to, "<snapshot_dir>/<index_name>.snapshot".
+    It is read from the index after it was populated or changed, so every document has the version elasticsearch
+    returns for it as well.
+
+    Args:
+        index_name (str): name of the alias, e.g. jobs or candidates.
+        snapshot_dir (Path): directory of the snapshot files, shared with the api.
+        concrete_index (str): index version behind the alias, looked up when not given.
+    """
+    if concrete_index is None:
+        concrete_index = next(iter(es_client.indices.get_alias(name=index_name)))
+    writer = SnapshotWriter(index_name, concrete_index)
+    hits: Iterable[dict] = scan(
+        es_client,
+        index=concrete_index,
+        query={"query": {"match_all": {}}, "_source": list(SNAPSHOT_FIELDS[index_name]), "seq_no_primary_term": True},
+        size=5000,
+    )
+    for hit in hits:
+        writer.add(hit["_id"], hit["_source"], hit["_seq_no"], hit["_primary_term"])
+
+    snapshot_dir.mkdir(parents=True, exist_ok=True)
+    path = snapshot_dir / f"{index_name}.snapshot"
+    writer.write(path)
+    return path
+
+
+def _padding(size: int) -> int:
+    """Rounds up to the next multiple of 8, so every section can be read as array of its typecode."""
+    return (size + 7) // 8 * 8